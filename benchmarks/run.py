@@ -0,0 +1,212 @@
+"""
+Benchmarks for the IpWhitelister's per-request overhead.
+
+Times IpWhitelister.process_request on its own, and the full middleware stack (as configured in tests.settings),
+across the number of allowed ranges, the matcher engine, the IPv4/IPv6 mix, the X-Forwarded-For length, allowed
+vs denied clients, and admin vs non-admin paths.  Results are written as JSON, which can be compared against a
+previous run to spot regressions, e.g.
+
+    $ python -m benchmarks.run --output before.json
+    $ python -m benchmarks.run --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import ipaddress
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+
+import django
+
+
+SIZES = [10, 1000, 100000]
+ENGINES = ['trie', 'interval']
+MIXES = ['ipv4', 'ipv6', 'mixed']
+FORWARDED_FOR_LENGTHS = [1, 5, 20]
+PATHS = {'site': '/example', 'admin': '/admin/login/'}
+
+# Addresses that are never in the generated ranges, for clients that should be denied
+MISS_IPV4 = ipaddress.ip_network('203.0.113.0/24')
+MISS_IPV6 = ipaddress.ip_network('2001:db8::/32')
+
+
+def generate_ranges(size, mix, rng):
+    """
+    Generate size distinct ranges: /24s for IPv4, /48s for IPv6, or half of each for 'mixed'
+    """
+
+    ranges = set()
+    while len(ranges) < size:
+        ipv6 = mix == 'ipv6' or (mix == 'mixed' and len(ranges) % 2)
+        if ipv6:
+            network = ipaddress.IPv6Network((rng.getrandbits(48) << 80, 48))
+            if network.overlaps(MISS_IPV6):
+                continue
+        else:
+            network = ipaddress.IPv4Network((rng.getrandbits(24) << 8, 24))
+            if network.overlaps(MISS_IPV4):
+                continue
+        ranges.add(str(network))
+    return sorted(ranges)
+
+
+def client_ips(ranges, mix, length, hit, rng):
+    """
+    Build a list of client IPs for the X-Forwarded-For header.  Every entry misses, except for the last one when
+    hit is True, so the whole header has to be checked either way
+    """
+
+    ips = []
+    for index in range(length):
+        ipv6 = mix == 'ipv6' or (mix == 'mixed' and index % 2)
+        miss_network = MISS_IPV6 if ipv6 else MISS_IPV4
+        ips.append(str(miss_network[rng.randrange(1, 255)]))
+
+    if hit:
+        network = ipaddress.ip_network(rng.choice(ranges))
+        ips[-1] = str(network[rng.randrange(1, 255)])
+
+    return ips
+
+
+def time_call(func, repeat, min_time):
+    """
+    Time func, returning the per-call times in microseconds of each of repeat runs, each taking at least min_time
+    """
+
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+
+    return [seconds / number * 1e6 for seconds in timer.repeat(repeat, number)], number
+
+
+def run(sizes, engines, mixes, lengths, repeat, min_time):
+    from django.core.exceptions import PermissionDenied
+    from django.core.handlers.base import BaseHandler
+    from django.http import Http404
+    from django.test import override_settings
+    from django.test.client import RequestFactory
+
+    from ip_restriction import IpWhitelister
+
+    factory = RequestFactory()
+    results = []
+
+    for size, engine, mix in itertools.product(sizes, engines, mixes):
+        rng = random.Random('{}-{}'.format(size, mix))
+        ranges = generate_ranges(size, mix, rng)
+
+        config = override_settings(
+            RESTRICT_IPS=True,
+            ALLOWED_IP_RANGES=ranges,
+            RESTRICT_ADMIN_BY_IPS=True,
+            ALLOWED_ADMIN_IP_RANGES=ranges,
+            IP_MATCHER_ENGINE=engine,
+        )
+
+        with config:
+            restrictor = IpWhitelister()
+            handler = BaseHandler()
+            handler.load_middleware()
+
+            for length, hit, path_name in itertools.product(lengths, [True, False], sorted(PATHS)):
+                header = ', '.join(client_ips(ranges, mix, length, hit, rng))
+                request = factory.get(PATHS[path_name], HTTP_X_FORWARDED_FOR=header)
+
+                def check():
+                    try:
+                        restrictor.process_request(request)
+                    except (PermissionDenied, Http404):
+                        # A denial, timed like any other outcome.  Anything else is a real failure
+                        pass
+
+                def stack():
+                    handler.get_response(factory.get(PATHS[path_name], HTTP_X_FORWARDED_FOR=header))
+
+                scenario = {
+                    'ranges': size,
+                    'engine': engine,
+                    'mix': mix,
+                    'forwarded_for_length': length,
+                    'hit': hit,
+                    'path': path_name,
+                }
+                for target, func in [('process_request', check), ('stack', stack)]:
+                    times, number = time_call(func, repeat, min_time)
+                    results.append({
+                        'scenario': scenario,
+                        'target': target,
+                        'iterations': number,
+                        'min_us': min(times),
+                        'median_us': statistics.median(times),
+                    })
+                    print('{:>15} {:>6} ranges {:>8} {:>5} xff={:<3} {:<4} {:<5} {:9.2f} us'.format(
+                        target, size, engine, mix, length, 'hit' if hit else 'miss', path_name, min(times)
+                    ), file=sys.stderr)
+
+    return results
+
+
+def result_key(result):
+    scenario = result['scenario']
+    return (result['target'],) + tuple(scenario[name] for name in sorted(scenario))
+
+
+def compare(results, baseline):
+    """
+    Print the ratio of each result's best time to the baseline's, for the scenarios in both
+    """
+
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    for result in results:
+        previous = baseline_results.get(result_key(result))
+        if previous:
+            print('{:<90} {:6.2f}x'.format(
+                ' '.join(str(part) for part in result_key(result)), result['min_us'] / previous['min_us']
+            ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default='benchmark-results.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='JSON results of a previous run, to compare against')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='Numbers of allowed ranges')
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--mixes', nargs='+', default=MIXES, choices=MIXES)
+    parser.add_argument('--forwarded-for-lengths', type=int, nargs='+', default=FORWARDED_FOR_LENGTHS)
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs per scenario, the best is reported')
+    parser.add_argument('--min-time', type=float, default=0.05, help='Minimum seconds per timing run')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+    results = run(args.sizes, args.engines, args.mixes, args.forwarded_for_lengths, args.repeat, args.min_time)
+    output = {
+        'meta': {
+            'created': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w') as output_file:
+        json.dump(output, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
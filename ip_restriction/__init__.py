@@ -1 +1,7 @@
+from django import VERSION
+
 from .middleware import IpWhitelister
+from .policy import IpPolicy, get_policy, reload_policy
+
+if VERSION < (3, 2):
+    default_app_config = 'ip_restriction.apps.IpRestrictionConfig'
@@ -0,0 +1,69 @@
+import ipaddress
+from socket import AF_INET, AF_INET6, inet_pton
+
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+# IPv4-mapped IPv6 addresses, ::ffff:0.0.0.0 to ::ffff:255.255.255.255, which are treated as the IPv4 address
+IPV4_MAPPED_START = 0xffff << 32
+IPV4_MAPPED_END = IPV4_MAPPED_START | 0xffffffff
+
+
+def _parse_address(address):
+    try:
+        if ':' in address:
+            return 6, int.from_bytes(inet_pton(AF_INET6, address), 'big')
+        return 4, int.from_bytes(inet_pton(AF_INET, address), 'big')
+    except (OSError, TypeError):
+        raise ValueError('{!r} does not appear to be an IPv4 or IPv6 address'.format(address))
+
+
+def fold_interval(version, start, end):
+    """
+    Move an interval lying within the IPv4-mapped IPv6 addresses into the IPv4 address space
+    """
+
+    if version == 6 and IPV4_MAPPED_START <= start and end <= IPV4_MAPPED_END:
+        return 4, start - IPV4_MAPPED_START, end - IPV4_MAPPED_START
+    return version, start, end
+
+
+def parse_address(address):
+    """
+    Parse an IP address string into a (version, integer) pair.  Uses inet_pton, which is much quicker than
+    building an ipaddress object.  IPv4-mapped IPv6 addresses, e.g. ::ffff:10.0.0.1, are returned as the IPv4
+    address they map, so they match the same entries.  Raises ValueError if the string is not an IPv4 or IPv6
+    address
+    """
+
+    version, value = _parse_address(address)
+    if version == 6 and IPV4_MAPPED_START <= value <= IPV4_MAPPED_END:
+        return 4, value - IPV4_MAPPED_START
+    return version, value
+
+
+def parse_network(network):
+    """
+    Parse an IP range string (CIDR notation, or a bare address) into a (version, start, end) tuple of the first
+    and last integer addresses in the range.  Like ipaddress.ip_network, raises ValueError if the range has
+    host bits set.  Ranges of IPv4-mapped IPv6 addresses are returned as the IPv4 range they map
+    """
+
+    address, slash, prefix = network.partition('/')
+
+    # Leave anything other than a plain prefix length, e.g. a netmask, to the ipaddress module
+    if slash and not prefix.isdigit():
+        network = ipaddress.ip_network(network)
+        return fold_interval(network.version, int(network.network_address), int(network.broadcast_address))
+
+    version, start = _parse_address(address)
+    bits = ADDRESS_BITS[version]
+    prefixlen = int(prefix) if prefix else bits
+    if prefixlen > bits:
+        raise ValueError('{!r} does not appear to be an IPv4 or IPv6 network'.format(network))
+
+    host_mask = (1 << (bits - prefixlen)) - 1
+    if start & host_mask:
+        raise ValueError('{} has host bits set'.format(network))
+
+    return fold_interval(version, start, start | host_mask)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class IpRestrictionConfig(AppConfig):
+    name = 'ip_restriction'
+    verbose_name = 'IP restriction'
+
+    def ready(self):
+        # Register the system checks
+        from . import checks  # noqa
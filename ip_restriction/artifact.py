@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .matchers import ADDRESS_BITS, IntervalMatcher, WideArray
+
+
+# A compiled policy artifact is a header, a table of sections, then the sections' data.  Each section is the
+# sorted interval boundaries of an IntervalMatcher, for one scope (e.g. 'site') and one address family.
+# IPv4 boundaries are little-endian 32 bit integers, which can be used in place on little-endian machines,
+# and IPv6 boundaries are big-endian 128 bit integers
+MAGIC = b'IPRA'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sHH')
+SECTION = struct.Struct('>16sBxxxQQ')
+WIDTHS = {4: 4, 6: 16}
+BYTEORDERS = {4: 'little', 6: 'big'}
+
+
+def _pack_boundaries(version, boundaries):
+    if version == 6:
+        return WideArray.from_ints(boundaries).buffer
+
+    if array('I').itemsize != 4:
+        return b''.join(value.to_bytes(4, 'little') for value in boundaries)
+
+    packed = array('I', boundaries)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def write_artifact(path, matchers):
+    """
+    Write a dict of IntervalMatchers keyed by scope to a compiled policy artifact.  The file is written
+    alongside and then renamed into place, so readers never see a partly written artifact
+    """
+
+    sections = [(scope, version) for scope in sorted(matchers) for version in sorted(ADDRESS_BITS)]
+    offset = HEADER.size + SECTION.size * len(sections)
+
+    table = []
+    blobs = []
+    for scope, version in sections:
+        boundaries = matchers[scope].boundaries(version)
+        blob = _pack_boundaries(version, boundaries)
+        # Keep each section 8 byte aligned
+        padding = -offset % 8
+        offset += padding
+        blobs.append(b'\0' * padding + blob)
+        table.append(SECTION.pack(scope.encode('ascii'), version, len(boundaries), offset))
+        offset += len(blob)
+
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as artifact:
+        artifact.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        artifact.writelines(table)
+        artifact.writelines(blobs)
+    os.replace(tmp_path, path)
+
+
+def _view_boundaries(view, version, count, offset):
+    width = WIDTHS[version]
+    buffer = view[offset:offset + count * width]
+
+    # The IPv4 boundaries can be bisected in place when they match the machine's native 32 bit integers
+    if version == 4 and sys.byteorder == 'little' and array('I').itemsize == 4:
+        return buffer.cast('I')
+    return WideArray(buffer, width, BYTEORDERS[version])
+
+
+def _unpack_header(path, header, size):
+    # The version and number of sections, from the header of an artifact of size bytes
+    if len(header) < HEADER.size:
+        raise ValueError('{} is not a compiled IP policy'.format(path))
+
+    magic, version, section_count = HEADER.unpack_from(header, 0)
+    if magic != MAGIC:
+        raise ValueError('{} is not a compiled IP policy'.format(path))
+    if version != FORMAT_VERSION:
+        raise ValueError('{} is compiled IP policy version {}, expected {}'.format(path, version, FORMAT_VERSION))
+    if HEADER.size + section_count * SECTION.size > size:
+        raise ValueError('{} is a corrupt compiled IP policy'.format(path))
+    return version, section_count
+
+
+def check_artifact(path):
+    """
+    Check that a compiled policy artifact can be read, and that its header and table of sections are valid for
+    its size, without mapping its data.  Raises OSError or ValueError if not
+    """
+
+    with open(path, 'rb') as artifact:
+        size = os.fstat(artifact.fileno()).st_size
+        header = artifact.read(HEADER.size)
+    _unpack_header(path, header, size)
+
+
+def load_artifact(path):
+    """
+    Memory-map a compiled policy artifact read-only, returning a dict of IntervalMatchers keyed by scope.  The
+    matchers read directly from the mapped file, so every process that loads it shares one copy in the page
+    cache.  Raises ValueError if the file is not a valid artifact
+    """
+
+    with open(path, 'rb') as artifact:
+        mapped = mmap.mmap(artifact.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+    _, section_count = _unpack_header(path, view[:HEADER.size], len(view))
+
+    boundaries = {}
+    for index in range(section_count):
+        scope, family, count, offset = SECTION.unpack_from(view, HEADER.size + index * SECTION.size)
+        if family not in WIDTHS or offset + count * WIDTHS[family] > len(view):
+            raise ValueError('{} is a corrupt compiled IP policy'.format(path))
+
+        scope = scope.rstrip(b'\0').decode('ascii')
+        boundaries.setdefault(scope, {})[family] = _view_boundaries(view, family, count, offset)
+
+    return {
+        scope: IntervalMatcher.from_boundaries(scope_boundaries) for scope, scope_boundaries in boundaries.items()
+    }
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, which has no async support anyway
+    sync_to_async = None
+
+
+def client_key(client_ips):
+    """
+    The key bans are kept under: the client IP, or the whole list of IPs when there are no trusted proxies
+    """
+
+    return ','.join(str(ip) for ip in client_ips)
+
+
+def window_count(previous, current, now, window):
+    """
+    Estimate the count over the sliding window ending now, from the counts of the current fixed window and the
+    one before it, weighting the previous one by how much of it the sliding window still covers
+    """
+
+    return previous * (1 - (now % window) / window) + current
+
+
+class LocalBanStore():
+    """
+    Counts denials per client, and bans clients with threshold denials within a sliding window of seconds, in
+    this process's memory.  At most max_tracked clients are counted, and at most max_tracked are banned, the
+    least recently seen being dropped first, so memory use is bounded however many clients there are
+    """
+
+    def __init__(self, threshold, window, duration, max_tracked=10000, timer=time.monotonic):
+        self.threshold = threshold
+        self.window = window
+        self.duration = duration
+        self.max_tracked = max_tracked
+        self.timer = timer
+        # Client key: [fixed window index, previous window's count, current window's count]
+        self._counters = OrderedDict()
+        # Client key: ban expiry time
+        self._bans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_banned(self, key):
+        expires = self._bans.get(key)
+        if expires is None:
+            return False
+        if expires <= self.timer():
+            self._bans.pop(key, None)
+            return False
+        return True
+
+    def record_denial(self, key):
+        """
+        Count a denial for the client, returning True if that gets it banned
+        """
+
+        now = self.timer()
+        index = int(now // self.window)
+
+        with self._lock:
+            counter = self._counters.pop(key, None)
+            if counter is None or counter[0] < index - 1:
+                counter = [index, 0, 0]
+            elif counter[0] == index - 1:
+                counter = [index, counter[2], 0]
+            counter[2] += 1
+
+            if window_count(counter[1], counter[2], now, self.window) < self.threshold:
+                self._counters[key] = counter
+                if len(self._counters) > self.max_tracked:
+                    self._counters.popitem(last=False)
+                return False
+
+            self._bans.pop(key, None)
+            self._bans[key] = now + self.duration
+            if len(self._bans) > self.max_tracked:
+                self._bans.popitem(last=False)
+            return True
+
+    async def ais_banned(self, key):
+        return self.is_banned(key)
+
+    async def arecord_denial(self, key):
+        return self.record_denial(key)
+
+
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+
+def get_local_ban_store(threshold, window, duration, max_tracked=10000):
+    """
+    Return the LocalBanStore for the arguments, shared by everything in the process that asks for the same one,
+    e.g. the middleware and the WSGI and ASGI wrappers, so that each counts the others' denials and sees their bans
+    """
+
+    key = (threshold, window, duration, max_tracked)
+    with _local_stores_lock:
+        store = _local_stores.get(key)
+        if store is None:
+            store = _local_stores[key] = LocalBanStore(threshold, window, duration, max_tracked)
+        return store
+
+
+class CacheBanStore():
+    """
+    Counts denials and keeps bans in a Django cache, so they are shared by all the workers using it.  Counts are
+    kept per fixed window, expiring after two, and bans expire after the ban duration, so the cache bounds the
+    memory used
+    """
+
+    def __init__(self, threshold, window, duration, cache, timer=time.time):
+        self.threshold = threshold
+        self.window = window
+        self.duration = duration
+        self.cache = cache
+        self.timer = timer
+
+    def _cache_key(self, kind, key):
+        # Hashed, as cache backends limit the characters and length of keys
+        return 'ip_restriction:{}:{}'.format(kind, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def is_banned(self, key):
+        return self.cache.get(self._cache_key('ban', key)) is not None
+
+    def record_denial(self, key):
+        now = self.timer()
+        index = int(now // self.window)
+        counter_key = self._cache_key('denials', key)
+
+        current_key = '{}:{}'.format(counter_key, index)
+        self.cache.add(current_key, 0, timeout=int(self.window * 2) + 1)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Evicted since it was added
+            current = 1
+            self.cache.set(current_key, current, timeout=int(self.window * 2) + 1)
+        previous = self.cache.get('{}:{}'.format(counter_key, index - 1), 0)
+
+        if window_count(previous, current, now, self.window) < self.threshold:
+            return False
+
+        self.cache.set(self._cache_key('ban', key), True, timeout=int(self.duration))
+        return True
+
+    async def ais_banned(self, key):
+        return await sync_to_async(self.is_banned)(key)
+
+    async def arecord_denial(self, key):
+        return await sync_to_async(self.record_denial)(key)
@@ -0,0 +1,156 @@
+import hashlib
+
+from django import VERSION
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.signals import user_logged_in
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, which has no async support anyway
+    sync_to_async = None
+
+from .config import get_config_var
+
+
+class BypassMarker():
+    """
+    A signed, expiring marker that a client has authenticated, so that ALLOW_AUTHENTICATED can let its requests
+    through without loading the user from the database.
+
+    With storage 'session' the marker is kept in the session, and is signed with the session's user ID, so it
+    only applies to the user it was issued for.  With storage 'cookie' it is a cookie of its own, signed with a
+    hash of the session key, so issuing it doesn't write to the session.  The session key comes from the client,
+    so checking the marker still loads the session, to make sure it is one a user is logged in to: it stops
+    working when the session ends, e.g. on logout.  Either way it expires after max_age seconds, after which the
+    user is checked again
+    """
+
+    salt = 'ip_restriction.bypass'
+    session_key = '_ip_restriction_bypass'
+    # Where a marker to be set as a cookie is kept on the request until the response
+    request_attribute = '_ip_restriction_bypass'
+
+    def __init__(self, storage='session', max_age=3600, cookie_name='ip_restriction_bypass'):
+        self.storage = storage
+        self.max_age = max_age
+        self.cookie_name = cookie_name
+        self.signer = signing.TimestampSigner(salt=self.salt)
+
+    def _subject(self, request):
+        # What the marker is signed with, or None if the request has no session to bind it to
+        session = getattr(request, 'session', None)
+        if session is None:
+            return None
+
+        if self.storage == 'cookie':
+            session_key = session.session_key
+            if not session_key:
+                return None
+            return hashlib.sha256(session_key.encode('utf-8')).hexdigest()
+
+        user_id = session.get(SESSION_KEY)
+        return str(user_id) if user_id is not None else None
+
+    def is_valid(self, request):
+        """
+        Does the request carry an unexpired marker, issued for its session or user?
+        """
+
+        if self.storage == 'cookie':
+            marker = request.COOKIES.get(self.cookie_name)
+        else:
+            session = getattr(request, 'session', None)
+            marker = session.get(self.session_key) if session is not None else None
+        if not marker:
+            return False
+
+        subject = self._subject(request)
+        if subject is None:
+            return False
+        try:
+            if self.signer.unsign(marker, max_age=self.max_age) != subject:
+                return False
+        except signing.BadSignature:
+            # Including SignatureExpired
+            return False
+
+        # A client can replay an old session cookie along with the marker, so check the session is still in the
+        # store, with a user logged in.  Logging out flushes it
+        return self.storage != 'cookie' or request.session.get(SESSION_KEY) is not None
+
+    def issue(self, request):
+        """
+        Give the request's client a new marker, once it is known to be authenticated
+        """
+
+        subject = self._subject(request)
+        if subject is None:
+            return
+        marker = self.signer.sign(subject)
+        if self.storage == 'cookie':
+            setattr(request, self.request_attribute, marker)
+        else:
+            request.session[self.session_key] = marker
+
+    async def ais_valid(self, request):
+        return await sync_to_async(self.is_valid)(request)
+
+    async def aissue(self, request):
+        # The cookie only needs the session key, which is read from the session cookie without loading the session
+        if self.storage == 'cookie':
+            return self.issue(request)
+        return await sync_to_async(self.issue)(request)
+
+    def process_response(self, request, response):
+        """
+        Set the cookie of a marker issued during the request, if any
+        """
+
+        marker = getattr(request, self.request_attribute, None)
+        if marker is None:
+            return response
+
+        kwargs = {}
+        if VERSION >= (2, 1):
+            kwargs['samesite'] = settings.SESSION_COOKIE_SAMESITE
+        response.set_cookie(
+            self.cookie_name, marker, max_age=self.max_age, path=settings.SESSION_COOKIE_PATH,
+            domain=settings.SESSION_COOKIE_DOMAIN, secure=settings.SESSION_COOKIE_SECURE or None, httponly=True,
+            **kwargs
+        )
+        return response
+
+
+def get_bypass_marker():
+    """
+    The BypassMarker configured by IP_BYPASS_MARKER, IP_BYPASS_MARKER_MAX_AGE and IP_BYPASS_COOKIE_NAME, or None
+    if IP_BYPASS_MARKER or ALLOW_AUTHENTICATED is off
+    """
+
+    storage = get_config_var('IP_BYPASS_MARKER', str, '')
+    if storage not in ('', 'session', 'cookie'):
+        raise ImproperlyConfigured("IP_BYPASS_MARKER must be 'session' or 'cookie'")
+    if not storage or not get_config_var('ALLOW_AUTHENTICATED', bool):
+        return None
+
+    return BypassMarker(
+        storage,
+        get_config_var('IP_BYPASS_MARKER_MAX_AGE', int, 3600),
+        get_config_var('IP_BYPASS_COOKIE_NAME', str, 'ip_restriction_bypass'),
+    )
+
+
+def _user_logged_in(sender, request=None, **kwargs):
+    # Issue the marker as the user logs in, rather than on their first request that needs it
+    if request is None:
+        return
+    marker = get_bypass_marker()
+    if marker is not None:
+        marker.issue(request)
+
+
+user_logged_in.connect(_user_logged_in)
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class DecisionCache():
+    """
+    Bounded least-recently-used cache of allow/deny decisions, where each entry expires after a time to live.
+
+    Keeps hit, miss and eviction counters; an expired entry counts as a miss, and as an eviction when removed
+    """
+
+    def __init__(self, maxsize, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Return the cached decision for the key, or default if it is missing or expired
+        """
+
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= self.timer():
+                del self._entries[key]
+                self.misses += 1
+                self.evictions += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = self.timer() + self.ttl if self.ttl else None
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop all the cached decisions, e.g. when the policy they were made under has changed
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,156 @@
+from django.core.checks import Error, Warning, register
+from django.core.exceptions import ImproperlyConfigured
+
+from . import geoip
+from .addresses import parse_address, parse_network
+from .artifact import check_artifact
+from .config import get_config_var
+from .matchers import MATCHER_ENGINES
+from .policy import SCOPE_LISTS
+from .sources import check_ip_file
+
+
+NUMBER_SETTINGS = [
+    ('IP_DECISION_CACHE_SIZE', int),
+    ('IP_DECISION_CACHE_TTL', float),
+    ('ADMIN_RESOLVE_CACHE_SIZE', int),
+    ('ALLOWED_IPS_FILE_POLL_INTERVAL', float),
+    ('TRUSTED_PROXY_COUNT', int),
+    ('MAX_FORWARDED_FOR_ENTRIES', int),
+    ('IP_METRICS_SAMPLE_RATE', float),
+    ('IP_DENY_RESPONSE_STATUS', int),
+    ('IP_BAN_THRESHOLD', int),
+    ('IP_BAN_WINDOW', float),
+    ('IP_BAN_DURATION', float),
+    ('IP_BAN_MAX_TRACKED', int),
+    ('IP_BYPASS_MARKER_MAX_AGE', int),
+]
+
+
+def check_entries(name, entries, parse):
+    """
+    Warn about each entry of the list that can't be parsed, and so will be skipped when the policy is compiled
+    """
+
+    warnings = []
+    for entry in entries:
+        try:
+            parse(entry)
+        except (ValueError, TypeError) as e:
+            warnings.append(Warning(
+                '{} entry {!r} is not valid, and will be ignored: {}'.format(name, entry, e),
+                hint='Use an IPv4 or IPv6 address, or a range in CIDR notation without host bits set',
+                id='ip_restriction.W001',
+            ))
+    return warnings
+
+
+def check_scope_policies(setting):
+    """
+    Check a dict of allowlists per view or per host, e.g. IP_VIEW_POLICIES, and the entries in each
+    """
+
+    messages = []
+    try:
+        scope_policies = get_config_var(setting, dict)
+    except ImproperlyConfigured as e:
+        return [Error(str(e), id='ip_restriction.E002')]
+
+    if not isinstance(scope_policies, dict):
+        return [Error('{} must be a dict'.format(setting), id='ip_restriction.E002')]
+
+    for name, scope_policy in scope_policies.items():
+        if not isinstance(scope_policy, dict) or set(scope_policy) - set(SCOPE_LISTS['site']):
+            messages.append(Error(
+                '{}[{!r}] must be a dict of ALLOWED_IPS and ALLOWED_IP_RANGES'.format(setting, name),
+                id='ip_restriction.E002',
+            ))
+            continue
+        messages += check_entries(
+            "{}[{!r}]['ALLOWED_IPS']".format(setting, name), scope_policy.get('ALLOWED_IPS', []), parse_address,
+        )
+        messages += check_entries(
+            "{}[{!r}]['ALLOWED_IP_RANGES']".format(setting, name), scope_policy.get('ALLOWED_IP_RANGES', []),
+            parse_network,
+        )
+    return messages
+
+
+@register()
+def check_ip_lists(app_configs, **kwargs):
+    """
+    Validate the IP restriction configuration from the settings and environment, so mistakes are found when the
+    project starts rather than by the first requests.  The allowlist and denylist files and the policy artifact
+    may be very large, and the checks run on every management command, so only their headers are checked here,
+    and their entries when they are compiled
+    """
+
+    messages = []
+
+    for ips_name, ranges_name in SCOPE_LISTS.values():
+        messages += check_entries(ips_name, get_config_var(ips_name, list), parse_address)
+        messages += check_entries(ranges_name, get_config_var(ranges_name, list), parse_network)
+    messages += check_entries('TRUSTED_PROXY_RANGES', get_config_var('TRUSTED_PROXY_RANGES', list), parse_network)
+
+    engine = get_config_var('IP_MATCHER_ENGINE', str, 'trie')
+    if engine not in MATCHER_ENGINES:
+        messages.append(Error(
+            'IP_MATCHER_ENGINE {!r} is not a matcher engine'.format(engine),
+            hint='Use one of {}'.format(', '.join(sorted(MATCHER_ENGINES))),
+            id='ip_restriction.E001',
+        ))
+
+    for setting in ('IP_VIEW_POLICIES', 'IP_HOST_POLICIES'):
+        messages += check_scope_policies(setting)
+
+    for name, vartype in NUMBER_SETTINGS:
+        try:
+            get_config_var(name, vartype, 0)
+        except ValueError as e:
+            messages.append(Error(
+                '{} is not a valid {}: {}'.format(name, vartype.__name__, e), id='ip_restriction.E003'
+            ))
+
+    for name, check in [('ALLOWED_IPS_FILE', check_ip_file), ('DENIED_IPS_FILE', check_ip_file),
+                        ('IP_POLICY_ARTIFACT', check_artifact)]:
+        path = get_config_var(name, str, '')
+        if path:
+            try:
+                check(path)
+            except (OSError, ValueError) as e:
+                messages.append(Warning(
+                    '{} {!r} can not be read: {}'.format(name, path, e),
+                    hint='Only the IPs in the settings and environment will be used until it can be read',
+                    id='ip_restriction.W002',
+                ))
+
+    for name in ('IP_COUNTRY_DATABASE', 'IP_ASN_DATABASE'):
+        path = get_config_var(name, str, '')
+        if not path:
+            continue
+        if geoip.maxminddb is None:
+            messages.append(Error(
+                '{} is set, but the maxminddb package is not installed'.format(name),
+                hint='pip install maxminddb',
+                id='ip_restriction.E004',
+            ))
+        else:
+            try:
+                geoip.maxminddb.open_database(path, geoip.maxminddb.MODE_MMAP).close()
+            except (OSError, ValueError) as e:
+                messages.append(Error(
+                    '{} {!r} can not be opened: {}'.format(name, path, e), id='ip_restriction.E004'
+                ))
+
+    for name in ('ALLOWED_ASNS', 'DENIED_ASNS'):
+        for asn in get_config_var(name, list):
+            try:
+                geoip.parse_asn(asn)
+            except (ValueError, AttributeError):
+                messages.append(Error(
+                    '{} entry {!r} is not an AS number'.format(name, asn),
+                    hint="Use the number, e.g. 2856 or 'AS2856'",
+                    id='ip_restriction.E005',
+                ))
+
+    return messages
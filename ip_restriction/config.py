@@ -0,0 +1,44 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+# The names of the settings that have been read, so that a change to one of them, e.g. by override_settings, can
+# be told from a change to a setting the app doesn't use
+config_names = set()
+
+
+def get_config_var(name, vartype, default=None):
+    """
+    Get the whitelist config variable from the Django settings, or from the environment.
+    Environment variables take preference over Django settings
+    """
+
+    config_names.add(name)
+    env_val = os.environ.get(name)
+    setting_val = getattr(settings, name, None)
+
+    if vartype == bool:
+        if env_val is None:
+            return setting_val is True
+        else:
+            return env_val.lower() == 'true' or env_val == '1'
+    elif vartype == list:
+        if env_val is None:
+            return setting_val if setting_val is not None else []
+        else:
+            return [val.strip() for val in env_val.split(',') if val != '']
+    elif vartype == dict:
+        if env_val is None:
+            return setting_val if setting_val is not None else {}
+        try:
+            return json.loads(env_val)
+        except ValueError as e:
+            raise ImproperlyConfigured('{} must be a JSON object: {}'.format(name, e))
+    else:
+        if env_val is None:
+            return setting_val if setting_val is not None else default
+        else:
+            return vartype(env_val.strip())
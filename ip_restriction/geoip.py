@@ -0,0 +1,113 @@
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+from .cache import DecisionCache
+
+
+def parse_asn(asn):
+    """
+    Parse an ASN given as a number, or a string like '2856' or 'AS2856'.  Raises ValueError if it isn't one
+    """
+
+    if isinstance(asn, int):
+        return asn
+    asn = asn.strip().upper()
+    if asn.startswith('AS'):
+        asn = asn[2:]
+    return int(asn)
+
+
+class GeoIpLookup():
+    """
+    Looks up the country and the autonomous system (ASN) of IP addresses, in MaxMind format (.mmdb) databases,
+    e.g. GeoLite2-Country and GeoLite2-ASN.  The databases are memory-mapped, so all the workers on a server
+    share one copy in the page cache, and the result for each IP is kept in a bounded cache
+    """
+
+    def __init__(self, country_database='', asn_database='', cache_size=10000):
+        if maxminddb is None:
+            raise ImproperlyConfigured('The maxminddb package is needed to look up countries and ASNs')
+
+        try:
+            self._country_reader = self._open(country_database)
+            self._asn_reader = self._open(asn_database)
+        except (OSError, ValueError) as e:
+            raise ImproperlyConfigured('Failed to open the GeoIP database: {}'.format(e))
+
+        self.cache = DecisionCache(cache_size) if cache_size > 0 else None
+
+    @staticmethod
+    def _open(path):
+        return maxminddb.open_database(path, maxminddb.MODE_MMAP) if path else None
+
+    def lookup(self, ip):
+        """
+        Return the (country ISO code, ASN) of the IP, either of which is None if not known
+        """
+
+        if self.cache is None:
+            return self._lookup(ip)
+
+        result = self.cache.get(ip)
+        if result is None:
+            result = self._lookup(ip)
+            self.cache.set(ip, result)
+        return result
+
+    def _lookup(self, ip):
+        country = asn = None
+        try:
+            if self._country_reader is not None:
+                record = self._country_reader.get(ip) or {}
+                country = (record.get('country') or record.get('registered_country') or {}).get('iso_code')
+            if self._asn_reader is not None:
+                record = self._asn_reader.get(ip) or {}
+                asn = record.get('autonomous_system_number')
+        except (ValueError, TypeError):
+            # Malformed IPs are in no country or ASN
+            pass
+        return country, asn
+
+
+class GeoIpPolicy():
+    """
+    The allowed and denied countries and ASNs.  A request is allowed if any of its IPs are in an allowed country
+    or ASN, and denied if any are in a denied one, in the same way as the IP lists
+    """
+
+    def __init__(self, lookup, allowed_countries=(), denied_countries=(), allowed_asns=(), denied_asns=()):
+        self.lookup = lookup
+        self.allowed_countries = frozenset(country.strip().upper() for country in allowed_countries)
+        self.denied_countries = frozenset(country.strip().upper() for country in denied_countries)
+        self.allowed_asns = frozenset(parse_asn(asn) for asn in allowed_asns)
+        self.denied_asns = frozenset(parse_asn(asn) for asn in denied_asns)
+
+    @property
+    def allows(self):
+        return bool(self.allowed_countries or self.allowed_asns)
+
+    @property
+    def denies(self):
+        return bool(self.denied_countries or self.denied_asns)
+
+    def is_allowed(self, client_ips):
+        if not self.allows:
+            return False
+        for ip in client_ips:
+            country, asn = self.lookup.lookup(ip)
+            if country in self.allowed_countries or asn in self.allowed_asns:
+                return True
+        return False
+
+    def is_denied(self, client_ips):
+        if not self.denies:
+            return False
+        for ip in client_ips:
+            country, asn = self.lookup.lookup(ip)
+            if country in self.denied_countries or asn in self.denied_asns:
+                return True
+        return False
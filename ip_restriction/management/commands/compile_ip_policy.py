@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ip_restriction import IpPolicy
+from ip_restriction.artifact import write_artifact
+from ip_restriction.matchers import IntervalMatcher
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile the configured IP lists, and the entries in ALLOWED_IPS_FILE and DENIED_IPS_FILE, into a binary '
+        'policy artifact for the middleware to memory-map via IP_POLICY_ARTIFACT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path to write the compiled policy to')
+
+    def handle(self, *args, **options):
+        policy = IpPolicy()
+
+        try:
+            file_lists = policy.read_ip_files()
+        except (OSError, ValueError) as e:
+            raise CommandError('Failed to read the IP files: {}'.format(e))
+
+        matchers = {
+            scope: IntervalMatcher.from_intervals(intervals)
+            for scope, intervals in policy.parse_scopes(file_lists).items()
+        }
+        write_artifact(options['output'], matchers)
+
+        for scope, matcher in sorted(matchers.items()):
+            self.stdout.write('{}: {} ranges'.format(scope, len(matcher)))
+        self.stdout.write('Wrote {}'.format(options['output']))
@@ -0,0 +1,117 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ip_restriction import IpPolicy
+from ip_restriction.artifact import load_artifact
+from ip_restriction.matchers import IntervalMatcher
+from ip_restriction.replay import BatchEvaluator, open_log, replay
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay access logs, which may be gzipped, against the IP policy, and report how many requests it would '
+        'allow and deny, and the most denied IPs.  Only the IP lists are checked: requests that ALLOW_ADMIN or '
+        'ALLOW_AUTHENTICATED would let through are counted as denied'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='+', help='Access log files to replay')
+        parser.add_argument(
+            '--field', type=int, default=0,
+            help='Whitespace separated field of each line holding the client IP (default 0, as in the common and '
+                 'combined log formats)',
+        )
+        parser.add_argument(
+            '--regex', help='Regular expression to find the client IP in each line, in its "ip" group, or the '
+                            'first group if it has none.  Overrides --field',
+        )
+        parser.add_argument(
+            '--scope', choices=['site', 'admin'], default='site', help='Which allowlist to check against',
+        )
+        parser.add_argument(
+            '--allowed-ips-file', help='Proposed allowlist file to check against, instead of ALLOWED_IPS_FILE',
+        )
+        parser.add_argument(
+            '--artifact', help='Proposed compiled policy artifact to check against, instead of the configuration',
+        )
+        parser.add_argument('--batch-size', type=int, default=100000)
+        parser.add_argument('--top', type=int, default=20, help='How many of the most denied IPs to list')
+
+    def get_matchers(self, options):
+        if options['artifact']:
+            return self.load_artifact(options['artifact'])
+
+        overrides = {}
+        if options['allowed_ips_file']:
+            # Checked along with the configured IP lists, rather than any configured artifact
+            overrides['ALLOWED_IPS_FILE'] = options['allowed_ips_file']
+            overrides['IP_POLICY_ARTIFACT'] = ''
+        policy = IpPolicy(**overrides)
+
+        # The artifact the middleware is enforcing, if IP_POLICY_ARTIFACT is set
+        if policy.IP_POLICY_ARTIFACT:
+            return self.load_artifact(policy.IP_POLICY_ARTIFACT)
+
+        try:
+            file_lists = policy.read_ip_files()
+        except (OSError, ValueError) as e:
+            raise CommandError('Failed to read the IP files: {}'.format(e))
+
+        return {
+            scope: IntervalMatcher.from_intervals(intervals)
+            for scope, intervals in policy.parse_scopes(file_lists).items()
+        }
+
+    def load_artifact(self, path):
+        try:
+            return load_artifact(path)
+        except (OSError, ValueError) as e:
+            raise CommandError('Failed to load the policy artifact: {}'.format(e))
+
+    def get_extractor(self, options):
+        if options['regex']:
+            pattern = re.compile(options['regex'])
+            group = 'ip' if 'ip' in pattern.groupindex else 1
+
+            def extract_ip(line):
+                match = pattern.search(line)
+                return match.group(group) if match else None
+        else:
+            field = options['field']
+
+            def extract_ip(line):
+                fields = line.split(None, field + 1)
+                return fields[field] if len(fields) > field else None
+
+        return extract_ip
+
+    def iter_lines(self, paths):
+        for path in paths:
+            try:
+                log_file = open_log(path)
+            except OSError as e:
+                raise CommandError('Failed to open {}: {}'.format(path, e))
+            with log_file:
+                for line in log_file:
+                    yield line
+
+    def handle(self, *args, **options):
+        matchers = self.get_matchers(options)
+        evaluator = BatchEvaluator(matchers[options['scope']], matchers.get('deny'))
+
+        totals, top_denied = replay(
+            self.iter_lines(options['logs']), self.get_extractor(options), evaluator, options['batch_size']
+        )
+
+        checked = totals['allowed'] + totals['denied']
+        for name in ('allowed', 'denied'):
+            self.stdout.write('{}: {} ({:.2f}%)'.format(
+                name.capitalize(), totals[name], 100.0 * totals[name] / checked if checked else 0
+            ))
+        self.stdout.write('Unparsed: {}'.format(totals['unparsed']))
+
+        if options['top'] and totals['denied']:
+            self.stdout.write('Most denied IPs:')
+            for ip, count in top_denied.most_common(options['top']):
+                self.stdout.write('  {} {}'.format(ip, count))
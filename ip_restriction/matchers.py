@@ -0,0 +1,253 @@
+from array import array
+from bisect import bisect_right
+
+from .addresses import ADDRESS_BITS, fold_interval, parse_address
+
+
+class PrefixMatcher():
+    """
+    Longest-prefix matcher over integer addresses, compiled once from a list of networks.
+
+    This is a binary prefix trie flattened into one hash set per depth: for every prefix length
+    in use there is a set of the network prefixes of that length.  A lookup shifts the address
+    down to each depth in turn, longest first, so it costs at most one set lookup per address bit
+    regardless of how many networks were added.  IPv4 and IPv6 have separate roots.
+    """
+
+    def __init__(self, networks=()):
+        self._tables = {version: {} for version in ADDRESS_BITS}
+        self._levels = {version: () for version in ADDRESS_BITS}
+
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return sum(
+            len(prefixes) for table in self._tables.values() for prefixes in table.values()
+        )
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        """
+        Create a matcher from (version, start, end) integer intervals, each of which must be a whole network
+        """
+
+        matcher = cls()
+        for version, start, end in intervals:
+            matcher.add_interval(version, start, end)
+        return matcher
+
+    def add(self, network):
+        """
+        Add an ipaddress network object to the matcher
+        """
+
+        self.add_interval(
+            *fold_interval(network.version, int(network.network_address), int(network.broadcast_address))
+        )
+
+    def add_interval(self, version, start, end):
+        bits = ADDRESS_BITS[version]
+        host_bits = (end - start + 1).bit_length() - 1
+        if end - start + 1 != 1 << host_bits or start & ((1 << host_bits) - 1):
+            raise ValueError('{}-{} is not a network'.format(start, end))
+
+        table = self._tables[version]
+        table.setdefault(bits - host_bits, set()).add(start >> host_bits)
+
+        # (shift, prefixes) pairs, longest prefix first
+        self._levels[version] = tuple(
+            (bits - prefixlen, table[prefixlen]) for prefixlen in sorted(table, reverse=True)
+        )
+
+    def longest_prefix(self, version, value):
+        """
+        Return the length of the longest prefix containing the integer address, or None
+        """
+
+        bits = ADDRESS_BITS[version]
+        for shift, prefixes in self._levels[version]:
+            if value >> shift in prefixes:
+                return bits - shift
+        return None
+
+    def match(self, version, value):
+        return self.longest_prefix(version, value) is not None
+
+    def match_many(self, version, values):
+        """
+        Return whether each of a sorted list of integer addresses matches
+        """
+
+        return [self.longest_prefix(version, value) is not None for value in values]
+
+    def __contains__(self, address):
+        return self.match(*parse_address(address))
+
+
+# Smallest native array type that can hold a 32 bit address
+IPV4_TYPECODE = 'I' if array('I').itemsize >= 4 else 'L'
+
+
+class WideArray():
+    """
+    Read-only sequence of fixed width unsigned integers packed into a bytes-like buffer, used for IPv6
+    addresses which do not fit in any native array type.  Supports what bisect needs: len() and indexing
+    """
+
+    def __init__(self, buffer, width=16, byteorder='big'):
+        self.buffer = buffer
+        self.width = width
+        self.byteorder = byteorder
+
+    @classmethod
+    def from_ints(cls, values, width=16, byteorder='big'):
+        return cls(b''.join(value.to_bytes(width, byteorder) for value in values), width, byteorder)
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('WideArray index out of range')
+
+        start = index * self.width
+        return int.from_bytes(self.buffer[start:start + self.width], self.byteorder)
+
+
+def merge_intervals(intervals):
+    """
+    Sort (start, end) integer intervals and merge any that overlap or are adjacent
+    """
+
+    return merge_sorted_intervals(sorted(intervals))
+
+
+def merge_sorted_intervals(intervals):
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def interval_boundaries(merged, bits):
+    """
+    Flatten merged intervals into a sorted list of boundaries, where each interval contributes its start and
+    the address just past its end.  The end boundary is left off an interval reaching the top of the address
+    space, as it would not fit in the address width
+    """
+
+    boundaries = []
+    for start, end in merged:
+        boundaries.append(start)
+        if end < (1 << bits) - 1:
+            boundaries.append(end + 1)
+    return boundaries
+
+
+class IntervalMatcher():
+    """
+    Membership index over merged address intervals, compiled once from a list of networks.
+
+    Overlapping and adjacent networks are merged, and the resulting intervals are stored as one sorted array
+    of boundaries per address family (a native 32 bit array for IPv4, packed 128 bit integers for IPv6).  An
+    address is inside an interval when an odd number of boundaries are less than or equal to it, so a lookup
+    is a single bisect.  This is compact and fast for very large lists, at the cost of not knowing which
+    network an address matched.
+    """
+
+    def __init__(self, networks=()):
+        self._boundaries = {}
+        self._counts = {}
+        self._build(
+            fold_interval(network.version, int(network.network_address), int(network.broadcast_address))
+            for network in networks
+        )
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        """
+        Create a matcher from (version, start, end) integer intervals, which needn't be whole networks
+        """
+
+        matcher = cls()
+        matcher._build(intervals)
+        return matcher
+
+    def _build(self, intervals):
+        # IPv4 intervals are sorted as single 64 bit keys of start and end, rather than as tuples, which keeps
+        # building from millions of entries quick and small
+        ipv4_keys = array('Q')
+        ipv6_intervals = []
+        for version, start, end in intervals:
+            if version == 4:
+                ipv4_keys.append(start << 32 | end)
+            else:
+                ipv6_intervals.append((start, end))
+
+        merged = {
+            4: merge_sorted_intervals((key >> 32, key & 0xffffffff) for key in sorted(ipv4_keys)),
+            6: merge_intervals(ipv6_intervals),
+        }
+        for version, bits in ADDRESS_BITS.items():
+            self._counts[version] = len(merged[version])
+            self._boundaries[version] = self._pack(version, interval_boundaries(merged[version], bits))
+
+    @classmethod
+    def from_boundaries(cls, boundaries):
+        """
+        Create a matcher directly from a dict of sorted boundary sequences keyed by address family, e.g. as
+        read back from a compiled policy artifact
+        """
+
+        matcher = cls()
+        matcher._boundaries.update(boundaries)
+        matcher._counts.update(
+            (version, (len(version_boundaries) + 1) // 2) for version, version_boundaries in boundaries.items()
+        )
+        return matcher
+
+    def boundaries(self, version):
+        return list(self._boundaries[version])
+
+    @staticmethod
+    def _pack(version, boundaries):
+        if version == 4:
+            return array(IPV4_TYPECODE, boundaries)
+        return WideArray.from_ints(boundaries)
+
+    def __len__(self):
+        # The number of intervals after merging
+        return sum(self._counts.values())
+
+    def match(self, version, value):
+        return bisect_right(self._boundaries[version], value) & 1 == 1
+
+    def match_many(self, version, values):
+        """
+        Return whether each of a sorted list of integer addresses matches.  Each search starts from where the
+        last one ended, so the whole list is one sweep through the boundaries
+        """
+
+        boundaries = self._boundaries[version]
+        results = []
+        position = 0
+        for value in values:
+            position = bisect_right(boundaries, value, position)
+            results.append(position & 1 == 1)
+        return results
+
+    def __contains__(self, address):
+        return self.match(*parse_address(address))
+
+
+MATCHER_ENGINES = {
+    'trie': PrefixMatcher,
+    'interval': IntervalMatcher,
+}
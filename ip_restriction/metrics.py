@@ -0,0 +1,279 @@
+import logging
+import random
+import socket
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from django.utils.module_loading import import_string
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.  The checks normally take microseconds
+DEFAULT_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1,
+)
+
+
+class MetricsSink():
+    """
+    Base class for metrics sinks, which are sent each decision counted and each latency timed.  Labels are a
+    tuple of (name, value) pairs.  Sinks named in IP_METRICS_SINKS are created with the IpWhitelister, so they
+    can read their configuration from it
+    """
+
+    def __init__(self, whitelister=None):
+        self.whitelister = whitelister
+
+    def increment(self, name, labels=(), value=1):
+        pass
+
+    def observe(self, name, labels, value, sample_rate=1.0):
+        pass
+
+
+class _Shard():
+    def __init__(self):
+        self.counters = {}
+        # Bucket counts, with the +Inf bucket last, keyed by (name, labels)
+        self.histograms = {}
+        self.sums = {}
+
+    def add(self, other):
+        """
+        Add another shard's metrics into this one.  Copying a dict with list() happens without releasing the GIL,
+        so this is safe while the other shard's thread records
+        """
+
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, value in list(other.sums.items()):
+            self.sums[key] = self.sums.get(key, 0.0) + value
+        for key, counts in list(other.histograms.items()):
+            total_counts = self.histograms.get(key)
+            if total_counts is None:
+                self.histograms[key] = list(counts)
+            else:
+                self.histograms[key] = [total + count for total, count in zip(total_counts, counts)]
+
+
+class MetricsRegistry(MetricsSink):
+    """
+    In-process counters and latency histograms.
+
+    Each thread records into its own shard, so recording never takes a lock; only a thread's first record does,
+    to register its shard.  The shards are added together when the metrics are read.  The shards of threads that
+    have finished are added into one total, when a new thread registers or the metrics are read, so a server
+    starting a thread per request doesn't build up a shard for each
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.buckets = tuple(buckets)
+        self._shards_lock = threading.Lock()
+        self.reset()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:
+                self._fold_finished_threads()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def _fold_finished_threads(self):
+        # Called with the lock held.  A finished thread can't record any more, so its shard can be added into the
+        # total for finished threads, and dropped
+        live_shards = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                live_shards.append((thread_ref, shard))
+            else:
+                self._finished.add(shard)
+        self._shards = live_shards
+
+    def increment(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, sample_rate=1.0):
+        shard = self._shard()
+        key = (name, labels)
+        try:
+            counts = shard.histograms[key]
+        except KeyError:
+            counts = shard.histograms[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        shard.sums[key] = shard.sums.get(key, 0.0) + value
+
+    def reset(self):
+        with self._shards_lock:
+            self._shards = []
+            self._finished = _Shard()
+        self._local = threading.local()
+
+    def snapshot(self):
+        """
+        Return the counters as {(name, labels): value}, and the histograms as {(name, labels): (bucket counts,
+        sum)}, totalled over all the threads
+        """
+
+        total = _Shard()
+        with self._shards_lock:
+            self._fold_finished_threads()
+            total.add(self._finished)
+            shards = [shard for _, shard in self._shards]
+
+        for shard in shards:
+            total.add(shard)
+
+        histograms = {
+            key: (counts, total.sums.get(key, 0.0)) for key, counts in total.histograms.items()
+        }
+        return {'counters': total.counters, 'histograms': histograms}
+
+    def render_prometheus(self, prefix='ip_restriction_'):
+        """
+        Render the metrics in the Prometheus text exposition format
+        """
+
+        snapshot = self.snapshot()
+        lines = []
+
+        for name in sorted({name for name, _ in snapshot['counters']}):
+            lines.append('# TYPE {}{}_total counter'.format(prefix, name))
+            for (key_name, labels), value in sorted(snapshot['counters'].items()):
+                if key_name == name:
+                    lines.append('{}{}_total{} {}'.format(prefix, name, _format_labels(labels), value))
+
+        for name in sorted({name for name, _ in snapshot['histograms']}):
+            lines.append('# TYPE {}{} histogram'.format(prefix, name))
+            for (key_name, labels), (counts, total) in sorted(snapshot['histograms'].items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append('{}{}_bucket{} {}'.format(
+                        prefix, name, _format_labels(labels + (('le', str(bound)),)), cumulative
+                    ))
+                lines.append('{}{}_sum{} {!r}'.format(prefix, name, _format_labels(labels), total))
+                lines.append('{}{}_count{} {}'.format(prefix, name, _format_labels(labels), cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+# The registry for this process, which the middleware records into and the metrics view reads from
+registry = MetricsRegistry()
+
+
+class CallbackSink(MetricsSink):
+    """
+    Call the function named in IP_METRICS_CALLBACK with (kind, name, labels, value), where kind is 'increment'
+    or 'observe'
+    """
+
+    def __init__(self, whitelister):
+        super().__init__(whitelister)
+        self.callback = import_string(whitelister.IP_METRICS_CALLBACK)
+
+    def increment(self, name, labels=(), value=1):
+        self.callback('increment', name, labels, value)
+
+    def observe(self, name, labels, value, sample_rate=1.0):
+        self.callback('observe', name, labels, value)
+
+
+class StatsdSink(MetricsSink):
+    """
+    Send the metrics to statsd over UDP, at IP_METRICS_STATSD_HOST and IP_METRICS_STATSD_PORT.  The label values
+    are appended to the metric name, e.g. ip_restriction.decisions.deny.site_ip, and latencies are sent as
+    timings in milliseconds.  Sending is fire and forget, failures are ignored
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, whitelister):
+        super().__init__(whitelister)
+        self.prefix = whitelister.IP_METRICS_STATSD_PREFIX
+        self.address = (whitelister.IP_METRICS_STATSD_HOST, whitelister.IP_METRICS_STATSD_PORT)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def _metric_name(self, name, labels):
+        return '.'.join([self.prefix, name] + [str(value) for _, value in labels])
+
+    def _send(self, line):
+        try:
+            self.socket.sendto(line.encode('ascii'), self.address)
+        except (OSError, UnicodeError) as e:
+            self.logger.debug('Failed to send metric to statsd: {}'.format(e))
+
+    def increment(self, name, labels=(), value=1):
+        self._send('{}:{}|c'.format(self._metric_name(name, labels), value))
+
+    def observe(self, name, labels, value, sample_rate=1.0):
+        line = '{}:{:.6f}|ms'.format(self._metric_name(name, labels), value * 1000)
+        if sample_rate < 1:
+            line += '|@{}'.format(sample_rate)
+        self._send(line)
+
+
+class DecisionMetrics():
+    """
+    Counts the middleware's decisions by outcome and by the rule that made them, and times a sample of the
+    checks, sending both to the registry and any configured sinks
+    """
+
+    def __init__(self, sinks, sample_rate=1.0, timer=time.perf_counter):
+        self.sinks = list(sinks)
+        self.sample_rate = sample_rate
+        self.timer = timer
+
+    def start(self):
+        """
+        Return the start time if this check is to be timed, otherwise None
+        """
+
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return self.timer()
+        return None
+
+    def record(self, context, outcome, started=None):
+        rule = context.decided_by
+        if rule is not None:
+            self.record_rule(rule.name, outcome, started)
+        elif outcome == 'allow' and context.allowed_by is not None:
+            # Let through by a restriction's allowed IPs, so by the matcher of its exact IPs or of its ranges
+            if context.allowed_scope is None:
+                matcher = 'geoip'
+            else:
+                matcher = context.policy.match_kind(context.client_ips, context.allowed_scope)
+            self.record_rule(context.allowed_by.name, outcome, started, matcher)
+        else:
+            self.record_rule('none', outcome, started)
+
+    def record_rule(self, rule_name, outcome, started=None, matcher=None):
+        labels = (('outcome', outcome), ('rule', rule_name))
+        if matcher is not None:
+            labels += (('matcher', matcher),)
+        for sink in self.sinks:
+            sink.increment('decisions', labels)
+
+        if started is not None:
+            elapsed = self.timer() - started
+            for sink in self.sinks:
+                sink.observe('check_seconds', labels[:1], elapsed, self.sample_rate)
@@ -1,150 +1,467 @@
-import os
-import ipaddress
+import asyncio
 import logging
 
-from django.core.exceptions import PermissionDenied
 try:
-    from django.core.urlresolvers import resolve
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 except ImportError:
-    from django.urls import resolve
+    # asgiref < 3.6, or not installed at all before Django 3.0
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
 from django.conf import settings
-from django.http import Http404
-from django import VERSION
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+try:
+    from django.core.urlresolvers import get_urlconf, resolve
+except ImportError:
+    from django.urls import get_urlconf, resolve
+from django.core.cache import caches
+from django.http import Http404, HttpResponse
+from django.http.request import split_domain_port
+from django.utils.module_loading import import_string
+
+from .addresses import parse_address
+from .bans import CacheBanStore, client_key, get_local_ban_store
+from .bypass import get_bypass_marker
+from .cache import DecisionCache
+from .config import get_config_var
+from .geoip import GeoIpLookup, GeoIpPolicy
+from .matchers import PrefixMatcher
+from . import metrics
+from .policy import config_generation, get_policy, parse_intervals, read_policy_config
+from .rules import DEFAULT_RULES, RequestContext, RulePipeline
+
+
+def get_host_name(meta):
+    """
+    The host name a request is for, from its META, lower case and without the port, as request.get_host() finds
+    it but without checking it against ALLOWED_HOSTS (which Django does anyway)
+    """
+
+    if getattr(settings, 'USE_X_FORWARDED_HOST', False) and 'HTTP_X_FORWARDED_HOST' in meta:
+        host = meta['HTTP_X_FORWARDED_HOST']
+    else:
+        host = meta.get('HTTP_HOST') or meta.get('SERVER_NAME', '')
+    return split_domain_port(host)[0]
 
 
 class IpWhitelister():
     """
     Simple middlware to allow IP addresses via settings variables ALLOWED_IPS, ALLOWED_IP_RANGES.
 
-    Made to be compatible with Django 1.9 and also 1.10+
+    The checks themselves are the rules in ip_restriction.rules, run by a RulePipeline, against the IP lists
+    compiled by the IpPolicy shared with the rest of the process.
+
+    Made to be compatible with Django 1.9 and also 1.10+, and to run natively in both sync and async middleware
+    stacks on Django 3.1+
     """
 
     logger = logging.getLogger(__name__)
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response=None):
         self.get_response = get_response
+        self._is_async = get_response is not None and iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+        self.load_config()
+
+    def load_config(self):
+        """
+        Read the configuration from Django settings and the environment, and compile the policy
+        """
+
+        # Taken first, so a change made while loading is picked up by the next request
+        self._config_generation = config_generation()
+
         self.RESTRICT_IPS = self._get_config_var('RESTRICT_IPS', bool)
-        self.ALLOWED_IPS = self._get_config_var('ALLOWED_IPS', list)
-        self.ALLOWED_IP_RANGES = self._get_config_var('ALLOWED_IP_RANGES', list)
         self.ALLOW_ADMIN = self._get_config_var('ALLOW_ADMIN', bool)
         self.ALLOW_AUTHENTICATED = self._get_config_var('ALLOW_AUTHENTICATED', bool)
         self.RESTRICT_ADMIN_BY_IPS = self._get_config_var('RESTRICT_ADMIN_BY_IPS', bool)
-        self.ALLOWED_ADMIN_IPS = self._get_config_var('ALLOWED_ADMIN_IPS', list)
-        self.ALLOWED_ADMIN_IP_RANGES = self._get_config_var('ALLOWED_ADMIN_IP_RANGES', list)
+        self.ADMIN_URL_PREFIX = self._get_config_var('ADMIN_URL_PREFIX', str, '')
+        self.ADMIN_RESOLVE_CACHE_SIZE = self._get_config_var('ADMIN_RESOLVE_CACHE_SIZE', int, 0)
+        self.IP_RESTRICTION_RULES = self._get_config_var('IP_RESTRICTION_RULES', list)
+        self.TRUSTED_PROXY_COUNT = self._get_config_var('TRUSTED_PROXY_COUNT', int, 0)
+        self.TRUSTED_PROXY_RANGES = self._get_config_var('TRUSTED_PROXY_RANGES', list)
+        self.MAX_FORWARDED_FOR_ENTRIES = self._get_config_var('MAX_FORWARDED_FOR_ENTRIES', int, 20)
+        self.IP_DENY_RESPONSE = self._get_config_var('IP_DENY_RESPONSE', bool)
+        self.IP_DENY_RESPONSE_STATUS = self._get_config_var('IP_DENY_RESPONSE_STATUS', int, 0)
+        self.IP_DENY_RESPONSE_BODY = self._get_config_var('IP_DENY_RESPONSE_BODY', str, '')
+        self.IP_DENY_RESPONSE_HEADERS = self._get_config_var('IP_DENY_RESPONSE_HEADERS', dict)
+        self.IP_BAN_THRESHOLD = self._get_config_var('IP_BAN_THRESHOLD', int, 0)
+        self.IP_BAN_WINDOW = self._get_config_var('IP_BAN_WINDOW', float, 60.0)
+        self.IP_BAN_DURATION = self._get_config_var('IP_BAN_DURATION', float, 600.0)
+        self.IP_BAN_BACKEND = self._get_config_var('IP_BAN_BACKEND', str, 'local')
+        self.IP_BAN_CACHE = self._get_config_var('IP_BAN_CACHE', str, 'default')
+        self.IP_BAN_MAX_TRACKED = self._get_config_var('IP_BAN_MAX_TRACKED', int, 10000)
+        self.IP_COUNTRY_DATABASE = self._get_config_var('IP_COUNTRY_DATABASE', str, '')
+        self.IP_ASN_DATABASE = self._get_config_var('IP_ASN_DATABASE', str, '')
+        self.IP_GEOIP_CACHE_SIZE = self._get_config_var('IP_GEOIP_CACHE_SIZE', int, 10000)
+        self.ALLOWED_COUNTRIES = self._get_config_var('ALLOWED_COUNTRIES', list)
+        self.DENIED_COUNTRIES = self._get_config_var('DENIED_COUNTRIES', list)
+        self.ALLOWED_ASNS = self._get_config_var('ALLOWED_ASNS', list)
+        self.DENIED_ASNS = self._get_config_var('DENIED_ASNS', list)
+        self.IP_METRICS = self._get_config_var('IP_METRICS', bool)
+        self.IP_METRICS_SAMPLE_RATE = self._get_config_var('IP_METRICS_SAMPLE_RATE', float, 1.0)
+        self.IP_METRICS_SINKS = self._get_config_var('IP_METRICS_SINKS', list)
+        self.IP_METRICS_CALLBACK = self._get_config_var('IP_METRICS_CALLBACK', str, '')
+        self.IP_METRICS_STATSD_HOST = self._get_config_var('IP_METRICS_STATSD_HOST', str, 'localhost')
+        self.IP_METRICS_STATSD_PORT = self._get_config_var('IP_METRICS_STATSD_PORT', int, 8125)
+        self.IP_METRICS_STATSD_PREFIX = self._get_config_var('IP_METRICS_STATSD_PREFIX', str, 'ip_restriction')
+
+        if self.IP_BAN_BACKEND not in ('local', 'cache'):
+            raise ImproperlyConfigured("IP_BAN_BACKEND must be 'local' or 'cache'")
+
+        # The compiled IP lists, shared with everything else in the process using the same configuration, and
+        # rebuilt if they were built from another one.  Its settings are copied here too, for the rules
+        self.ip_policy = get_policy(read_policy_config())
+        for name, value in self.ip_policy.config.items():
+            setattr(self, name, value)
+
+        # Optional cache of the app name and view scope resolved for each path, used by the admin and view rules
+        if self.ADMIN_RESOLVE_CACHE_SIZE > 0:
+            self.resolve_cache = DecisionCache(self.ADMIN_RESOLVE_CACHE_SIZE)
+        else:
+            self.resolve_cache = None
+
+        # The proxies whose X-Forwarded-For entries can be believed, if configured
+        if self.TRUSTED_PROXY_RANGES:
+            self._trusted_proxies = PrefixMatcher.from_intervals(
+                parse_intervals([], self.TRUSTED_PROXY_RANGES, self.logger)
+            )
+        else:
+            self._trusted_proxies = None
+
+        # Countries and ASNs to allow or deny, looked up in the GeoIP databases
+        if self.IP_COUNTRY_DATABASE or self.IP_ASN_DATABASE:
+            try:
+                self.geoip = GeoIpPolicy(
+                    GeoIpLookup(self.IP_COUNTRY_DATABASE, self.IP_ASN_DATABASE, self.IP_GEOIP_CACHE_SIZE),
+                    self.ALLOWED_COUNTRIES, self.DENIED_COUNTRIES, self.ALLOWED_ASNS, self.DENIED_ASNS,
+                )
+            except ValueError as e:
+                raise ImproperlyConfigured('ALLOWED_ASNS and DENIED_ASNS must be AS numbers: {}'.format(e))
+        else:
+            self.geoip = None
+
+        # Temporary bans of clients that keep being denied.  Kept in this process's memory by default, in a store
+        # shared with the WSGI and ASGI wrappers
+        if self.IP_BAN_THRESHOLD > 0:
+            ban_args = (self.IP_BAN_THRESHOLD, self.IP_BAN_WINDOW, self.IP_BAN_DURATION)
+            if self.IP_BAN_BACKEND == 'cache':
+                self.bans = CacheBanStore(*ban_args, cache=caches[self.IP_BAN_CACHE])
+            else:
+                self.bans = get_local_ban_store(*ban_args, max_tracked=self.IP_BAN_MAX_TRACKED)
+        else:
+            self.bans = None
+
+        # A marker that lets authenticated clients through without loading the user, if configured
+        self.bypass_marker = get_bypass_marker()
+
+        # The checks to run on each request, with any extra rules configured in IP_RESTRICTION_RULES
+        rules = DEFAULT_RULES + [import_string(path) for path in self.IP_RESTRICTION_RULES]
+        self.pipeline = RulePipeline(rule(self) for rule in rules)
+
+        # Encoded once, so that a denial only costs building a plain response
+        self._deny_body = self.IP_DENY_RESPONSE_BODY.encode('utf-8')
+
+        # Decision counts and latencies, recorded into the process's registry and any sinks in IP_METRICS_SINKS
+        if self.IP_METRICS:
+            sinks = [metrics.registry] + [import_string(path)(self) for path in self.IP_METRICS_SINKS]
+            self.metrics = metrics.DecisionMetrics(sinks, self.IP_METRICS_SAMPLE_RATE)
+        else:
+            self.metrics = None
+
+    @property
+    def policy(self):
+        """
+        The current CompiledPolicy, which a request holds on to for all its checks
+        """
+
+        self.reload_if_changed()
+        return self.ip_policy.compiled
+
+    @property
+    def decision_cache(self):
+        return self.policy.decision_cache
+
+    def reload_if_changed(self):
+        """
+        Load the configuration again if it has changed since it was loaded, e.g. by override_settings or
+        reload_policy().  Checked at the start of each request.  If the new configuration is invalid, the current
+        one is kept
+        """
+
+        if self._config_generation != config_generation():
+            try:
+                self.load_config()
+            except ImproperlyConfigured as e:
+                self.logger.error('Failed to reload IP restriction config: {}'.format(e))
 
     def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+
         response = self.process_request(request)
         
-        if not response and self.get_response:
+        if response is None and self.get_response:
             response = self.get_response(request)
         
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.aprocess_request(request)
+
+        if response is None:
+            response = await self.get_response(request)
+
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if self.bypass_marker is not None and response is not None:
+            response = self.bypass_marker.process_response(request, response)
         return response
 
-    def _get_config_var(self, name, vartype):
+    def _get_config_var(self, name, vartype, default=None):
         """
-        Get the whitelist config variable from the Django settings, or from the environment.
-        Environment variables take preference over Django settings
+        Get the whitelist config variable from the Django settings, or from the environment
         """
 
-        env_val = os.environ.get(name)
-        setting_val = getattr(settings, name, None)
-
-        if vartype == bool:
-            if env_val is None:
-                return setting_val is True
-            else:
-                return env_val.lower() == 'true' or env_val == '1'
-        else:
-            if env_val is None:
-                return setting_val if setting_val is not None else []
-            else:
-                return [val.strip() for val in env_val.split(',') if val != '']
+        return get_config_var(name, vartype, default)
 
     def get_client_ip_list(self, request):
         """
         Get the incoming request's originating IP, looks first for X_FORWARDED_FOR header, which is provided by some
         PaaS platforms, since the Django REMOTE_ADDR is affected by internal routing.  Fallback to the REMOTE_ADDR if
         the header is not present
+
+        If TRUSTED_PROXY_COUNT or TRUSTED_PROXY_RANGES are set, only the one IP that the trusted proxies say the
+        request came from is returned.  Otherwise all the IPs in the header are returned.  Either way at most
+        MAX_FORWARDED_FOR_ENTRIES are looked at, from the right of the header, so a huge header costs no more than
+        a short one
         """
 
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        remote_addr = request.META.get('REMOTE_ADDR')
+
+        if self.TRUSTED_PROXY_COUNT or self._trusted_proxies is not None:
+            return [self._get_untrusted_ip(x_forwarded_for, remote_addr)]
 
         if x_forwarded_for:
-            ips = x_forwarded_for.split(',')
-            ips = map(str.strip, ips)
+            ips = [ip.strip() for ip in self._split_forwarded_for(x_forwarded_for)]
         else:
-            ips = [request.META.get('REMOTE_ADDR')]
+            ips = [remote_addr]
 
         return ips
 
-    def is_blocked_ip(self, request, allowed_ips, allowed_ip_ranges):
-        # Default blocked
-        block_request = True
+    def _split_forwarded_for(self, x_forwarded_for, limit=None):
+        """
+        Split off at most limit entries (or MAX_FORWARDED_FOR_ENTRIES) from the right of the header.  The entries
+        further left are never split apart, and the left-most ones are the easiest for a client to forge
+        """
 
-        # Get the incoming IP address
-        request_ips = self.get_client_ip_list(request)
+        limit = limit or self.MAX_FORWARDED_FOR_ENTRIES
+        if limit <= 0:
+            return x_forwarded_for.split(',')
+        return x_forwarded_for.rsplit(',', limit)[-limit:]
 
-        for request_ip_str in request_ips:
-            request_ip = ipaddress.ip_address(request_ip_str)
+    def _get_untrusted_ip(self, x_forwarded_for, remote_addr):
+        """
+        Walk back from REMOTE_ADDR through the X-Forwarded-For entries, past TRUSTED_PROXY_COUNT proxies, and then
+        past any in TRUSTED_PROXY_RANGES, returning the first IP not vouched for by a trusted proxy
+        """
 
-            # If it's in the ALLOWED_IPS, don't block it
-            if request_ip_str in allowed_ips:
-                block_request = False
-                break
+        hops = [remote_addr]
+        if x_forwarded_for:
+            limit = self.MAX_FORWARDED_FOR_ENTRIES
+            if self._trusted_proxies is None and limit > 0:
+                # Only one entry past the trusted proxies is needed
+                limit = min(limit, self.TRUSTED_PROXY_COUNT)
+            hops = [ip.strip() for ip in self._split_forwarded_for(x_forwarded_for, limit)] + hops
+
+        # Without enough entries, the left-most one is as far back as can be seen
+        index = max(len(hops) - 1 - self.TRUSTED_PROXY_COUNT, 0)
 
-            # If it's within a ALLOWED_IP_RANGE, don't block it
-            for allowed_range in allowed_ip_ranges:
+        if self._trusted_proxies is not None:
+            while index > 0:
                 try:
-                    network = ipaddress.ip_network(allowed_range)
-                except ValueError as e:
-                    self.logger.warning('Failed to parse specific network address: {}'.format("".join(e.args)))
-                    continue
+                    version, value = parse_address(hops[index])
+                except ValueError:
+                    break
+                if not self._trusted_proxies.match(version, value):
+                    break
+                index -= 1
+
+        return hops[index]
+
+    def is_blocked_ip(self, request, scope='site', policy=None):
+        """
+        Check the request's IPs against the scope's allowed IPs and IP ranges, in the given compiled policy or
+        the current one
+        """
+
+        policy = policy or self.policy
+        return policy.is_blocked(tuple(self.get_client_ip_list(request)), scope)
+
+    def get_app_name(self, request):
+        """
+        Resolve the request's path to its app name, via the resolve cache if it is enabled
+        """
+
+        return self.resolve_request(request)[0]
+
+    def get_view_scope(self, request):
+        """
+        Return the policy scope of the IP_VIEW_POLICIES entry for the request's view, or None if there isn't one
+        """
+
+        return self.resolve_request(request)[1]
+
+    def resolve_request(self, request):
+        """
+        Resolve the request's path to its app name and view scope, via the resolve cache if it is enabled
+        """
+
+        if self.resolve_cache is None:
+            return self._resolve(request.path)
+
+        key = (get_urlconf(), request.path)
+        resolved = self.resolve_cache.get(key)
+        if resolved is None:
+            resolved = self._resolve(request.path)
+            self.resolve_cache.set(key, resolved)
+
+        return resolved
 
-                if request_ip in network:
-                    block_request = False
+    def _resolve(self, path):
+        match = resolve(path)
+        view_scope = None
+        view_scopes = self.ip_policy.view_scopes
+        if view_scopes:
+            # The most specific entry applies: the view name, then its namespace, then its app name
+            for name in (match.view_name, match.namespace, match.app_name):
+                view_scope = view_scopes.get(name)
+                if view_scope is not None:
                     break
 
-            if block_request is False:
-                break                
+        return match.app_name, view_scope
 
-        return block_request
+    def get_site_scope(self, meta):
+        """
+        Return the policy scope that the site restriction checks the request against, from its META: the
+        IP_HOST_POLICIES entry for its host if there is one, otherwise 'site' if RESTRICT_IPS is on, or None
+        """
+
+        if self.IP_HOST_POLICIES:
+            scope = self.ip_policy.host_scope(get_host_name(meta))
+            if scope is not None:
+                return scope
+        return 'site' if self.RESTRICT_IPS else None
+
+    def is_admin_request(self, request):
+        """
+        Is the request for the admin?  Checks the path against ADMIN_URL_PREFIX if that is set, which avoids
+        resolving the URL, otherwise checks the resolved app name
+        """
+
+        if self.ADMIN_URL_PREFIX:
+            return request.path.startswith(self.ADMIN_URL_PREFIX)
+
+        return self.get_app_name(request) == 'admin'
+
+    def deny_response(self, denial):
+        """
+        The response to return for a request a rule denied with PermissionDenied or Http404 when IP_DENY_RESPONSE is
+        on, which skips Django's exception handling and error templates.  Returns None to raise the denial as normal
+        """
+
+        if not self.IP_DENY_RESPONSE or not isinstance(denial, (PermissionDenied, Http404)):
+            return None
+
+        status = self.IP_DENY_RESPONSE_STATUS or (404 if isinstance(denial, Http404) else 403)
+        response = HttpResponse(self._deny_body, status=status, content_type='text/plain; charset=utf-8')
+        for name, value in self.IP_DENY_RESPONSE_HEADERS.items():
+            response[name] = value
+        return response
+
+    def _counts_towards_ban(self, context, denial):
+        # Repeat requests from a banned client don't extend the ban
+        return self.bans is not None and getattr(context.decided_by, 'name', None) != 'banned_ip'
+
+    def _record_denial(self, context, denial):
+        if self._counts_towards_ban(context, denial):
+            key = client_key(context.client_ips)
+            if self.bans.record_denial(key):
+                self.logger.info('Temporarily banned {!r} for {} seconds'.format(key[:100], self.IP_BAN_DURATION))
+
+    async def _arecord_denial(self, context, denial):
+        if self._counts_towards_ban(context, denial):
+            key = client_key(context.client_ips)
+            if await self.bans.arecord_denial(key):
+                self.logger.info('Temporarily banned {!r} for {} seconds'.format(key[:100], self.IP_BAN_DURATION))
 
     def process_request(self, request):
-        # Get the app name
-        app_name = resolve(request.path).app_name
-        if self.RESTRICT_IPS:
+        self.reload_if_changed()
 
-            if VERSION >= (1, 10):
-                authenticated = request.user.is_authenticated
-            else:
-                authenticated = request.user.is_authenticated()
+        # Nothing to check, e.g. when neither RESTRICT_IPS nor RESTRICT_ADMIN_BY_IPS are on
+        if not self.pipeline:
+            return None
 
-            # Allow access to the admin
-            if app_name == 'admin' and self.ALLOW_ADMIN:
-                return None
+        self.ip_policy.poll()
 
-            # Allow access to authenticated users
-            if authenticated and self.ALLOW_AUTHENTICATED:
-                return None
+        context = RequestContext(self, request)
+        started = self.metrics.start() if self.metrics is not None else None
+        try:
+            self.pipeline.run(context)
+        except Exception as denial:
+            if not context.denied:
+                # An error, not a denial, so isn't counted as one
+                raise
+            self._record_denial(context, denial)
+            if self.metrics is not None:
+                self.metrics.record(context, 'deny', started)
+            response = self.deny_response(denial)
+            if response is None:
+                raise
+            return response
 
-            block_request = self.is_blocked_ip(
-                request,
-                allowed_ips=self.ALLOWED_IPS,
-                allowed_ip_ranges=self.ALLOWED_IP_RANGES
-            )
+        if self.metrics is not None:
+            self.metrics.record(context, 'allow', started)
+        return None
 
-            # Otherwise, 403 Forbidden
-            if block_request:
-                raise PermissionDenied()
+    async def aprocess_request(self, request):
+        """
+        The async version of process_request.  The IP checks are run inline, only the authenticated user check
+        touches the database, and that is only done if an IP check would deny the request
+        """
 
-        if self.RESTRICT_ADMIN_BY_IPS and app_name == 'admin':
-            block_request = self.is_blocked_ip(
-                request,
-                allowed_ips=self.ALLOWED_ADMIN_IPS,
-                allowed_ip_ranges=self.ALLOWED_ADMIN_IP_RANGES
-            )
-            # raise 404
-            if block_request:
-                raise Http404()
+        self.reload_if_changed()
+
+        if not self.pipeline:
+            return None
+
+        self.ip_policy.poll()
+
+        context = RequestContext(self, request)
+        started = self.metrics.start() if self.metrics is not None else None
+        try:
+            await self.pipeline.arun(context)
+        except Exception as denial:
+            if not context.denied:
+                # An error, not a denial, so isn't counted as one
+                raise
+            await self._arecord_denial(context, denial)
+            if self.metrics is not None:
+                self.metrics.record(context, 'deny', started)
+            response = self.deny_response(denial)
+            if response is None:
+                raise
+            return response
 
+        if self.metrics is not None:
+            self.metrics.record(context, 'allow', started)
         return None
@@ -0,0 +1,589 @@
+import copy
+import logging
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+
+from .addresses import parse_address, parse_network
+from .artifact import load_artifact
+from .cache import DecisionCache
+from .config import config_names, get_config_var
+from .matchers import MATCHER_ENGINES, IntervalMatcher
+from .sources import DENIED_FILE_LISTS, FileWatcher, read_ip_file
+
+
+# The settings lists that make up each scope's IPs and IP ranges
+SCOPE_LISTS = {
+    'site': ('ALLOWED_IPS', 'ALLOWED_IP_RANGES'),
+    'admin': ('ALLOWED_ADMIN_IPS', 'ALLOWED_ADMIN_IP_RANGES'),
+    'deny': ('DENIED_IPS', 'DENIED_IP_RANGES'),
+}
+
+# The settings an IpPolicy is built from, with their types and defaults
+POLICY_SETTINGS = [
+    ('ALLOWED_IPS', list, None),
+    ('ALLOWED_IP_RANGES', list, None),
+    ('ALLOWED_ADMIN_IPS', list, None),
+    ('ALLOWED_ADMIN_IP_RANGES', list, None),
+    ('DENIED_IPS', list, None),
+    ('DENIED_IP_RANGES', list, None),
+    ('IP_MATCHER_ENGINE', str, 'trie'),
+    ('IP_DECISION_CACHE_SIZE', int, 0),
+    ('IP_DECISION_CACHE_TTL', float, 60.0),
+    ('ALLOWED_IPS_FILE', str, ''),
+    ('DENIED_IPS_FILE', str, ''),
+    ('ALLOWED_IPS_FILE_POLL_INTERVAL', float, 5.0),
+    ('IP_POLICY_ARTIFACT', str, ''),
+    ('IP_VIEW_POLICIES', dict, None),
+    ('IP_HOST_POLICIES', dict, None),
+]
+
+
+def parse_intervals(ips, ip_ranges, logger):
+    """
+    Parse a list of IP strings and a list of IP range strings (CIDR notation), yielding (version, start, end)
+    integer intervals, and logging and skipping any entries that are malformed
+    """
+
+    for ip in ips:
+        try:
+            version, value = parse_address(ip)
+        except ValueError as e:
+            logger.warning('Failed to parse specific IP address: {}'.format("".join(e.args)))
+        else:
+            yield version, value, value
+
+    for ip_range in ip_ranges:
+        try:
+            yield parse_network(ip_range)
+        except ValueError as e:
+            logger.warning('Failed to parse specific network address: {}'.format("".join(e.args)))
+
+
+class RateLimitedLog():
+    """
+    Logs a warning at most once per interval, with a count of how many were skipped since the last one, so a
+    flood of bad requests can't flood the logs
+    """
+
+    def __init__(self, logger, interval=60.0, timer=time.monotonic):
+        self.logger = logger
+        self.interval = interval
+        self.timer = timer
+        self.suppressed = 0
+        self._next_time = None
+        self._lock = threading.Lock()
+
+    def warning(self, message):
+        now = self.timer()
+        with self._lock:
+            if self._next_time is not None and now < self._next_time:
+                self.suppressed += 1
+                return
+            self._next_time = now + self.interval
+            suppressed, self.suppressed = self.suppressed, 0
+
+        if suppressed:
+            message = '{} ({} similar messages suppressed)'.format(message, suppressed)
+        self.logger.warning(message)
+
+
+# Shared by all policies, so reloading the policy doesn't reset the rate limit
+malformed_ip_log = RateLimitedLog(logging.getLogger(__name__))
+
+
+class CompiledPolicy():
+    """
+    The compiled IP lists that requests are checked against, one matcher per scope ('site', 'admin' and
+    'deny'), along with the cache of decisions made under them.
+
+    A policy is never changed once built.  A new configuration means building a new policy and replacing the
+    IpPolicy's reference to it, which is atomic, so a request always sees either the old policy or the new
+    one in full.  Since the decision cache belongs to the policy, replacing the policy also empties the cache.
+
+    The exact matchers hold just the single addresses of each allowed scope, so the metrics can tell a match on
+    an exact IP from a match on a range
+    """
+
+    def __init__(self, matchers, decision_cache=None, exact_matchers=None):
+        self.matchers = matchers
+        self.decision_cache = decision_cache
+        self.exact_matchers = exact_matchers or {}
+
+    def is_blocked(self, request_ips, scope):
+        """
+        Check a tuple of a request's IP strings against the scope's matcher.  The request is allowed if any of
+        its IPs match
+        """
+
+        if self.decision_cache is None:
+            return self._match_ips(request_ips, self.matchers[scope])
+
+        key = (request_ips, scope)
+        block_request = self.decision_cache.get(key)
+        if block_request is None:
+            block_request = self._match_ips(request_ips, self.matchers[scope])
+            self.decision_cache.set(key, block_request)
+
+        return block_request
+
+    def is_denied(self, request_ips):
+        """
+        Check a tuple of a request's IP strings against the denylist.  The request is denied if any of its IPs
+        match
+        """
+
+        denied = self.matchers.get('deny')
+        if not denied:
+            return False
+
+        if self.decision_cache is None:
+            return not self._match_ips(request_ips, denied)
+
+        key = (request_ips, 'deny')
+        deny_request = self.decision_cache.get(key)
+        if deny_request is None:
+            deny_request = not self._match_ips(request_ips, denied)
+            self.decision_cache.set(key, deny_request)
+
+        return deny_request
+
+    def match_kind(self, request_ips, scope):
+        """
+        Return 'exact' if one of a tuple of a request's IP strings is one of the scope's single addresses, and
+        otherwise 'range', for a request the scope allows.  Not cached, as it is only asked for the metrics
+        """
+
+        exact = self.exact_matchers.get(scope)
+        if exact is not None and not self._match_ips(request_ips, exact):
+            return 'exact'
+        return 'range'
+
+    def _match_ips(self, request_ips, allowed):
+        # Default blocked
+        block_request = True
+
+        for request_ip in request_ips:
+            try:
+                version, value = parse_address(request_ip)
+            except ValueError:
+                # A malformed client IP can't be in any list, so is skipped rather than failing the request
+                malformed_ip_log.warning('Malformed client IP address: {!r}'.format(str(request_ip)[:100]))
+                continue
+
+            # If it's in the allowed IPs or within an allowed IP range, don't block it
+            if allowed.match(version, value):
+                block_request = False
+                break
+
+        return block_request
+
+
+def compile_scope(engine, intervals):
+    """
+    Compile a scope's (version, start, end) intervals with the matcher engine, returning the matcher, and an
+    IntervalMatcher of just the single addresses among them, which is compact however many there are
+    """
+
+    exact = []
+
+    def note_exact(intervals):
+        for interval in intervals:
+            if interval[1] == interval[2]:
+                exact.append(interval)
+            yield interval
+
+    matcher = engine.from_intervals(note_exact(intervals))
+    return matcher, IntervalMatcher.from_intervals(exact)
+
+
+def read_policy_config(**overrides):
+    """
+    Read the settings an IpPolicy is built from, from Django settings and the environment, except those given
+    """
+
+    config = {}
+    for name, vartype, default in POLICY_SETTINGS:
+        config[name] = overrides[name] if name in overrides else get_config_var(name, vartype, default)
+    return config
+
+
+class IpPolicy():
+    """
+    The configured IP lists, compiled once and checked without a request, e.g. from Celery tasks, DRF throttles
+    or webhook receivers as well as the middleware:
+
+        policy = IpPolicy()
+        policy.is_allowed('10.0.0.1')
+        policy.check_many(['10.0.0.1', '192.168.0.1'], scope='admin')
+
+    The lists are read from Django settings and the environment, as the middleware reads them, unless given as
+    keyword arguments, e.g. IpPolicy(ALLOWED_IPS=['10.0.0.1']).  Raises ImproperlyConfigured if they are
+    invalid.  get_policy() returns the one shared by the middleware.
+
+    The compiled lists are a CompiledPolicy, built on first use.  If ALLOWED_IPS_FILE, DENIED_IPS_FILE or
+    IP_POLICY_ARTIFACT is set, the files are watched, and a changed file is recompiled into a new CompiledPolicy
+    that replaces the old one whole.  RESTRICT_IPS and the exemptions are the middleware's business, not the
+    policy's
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, **overrides):
+        unknown = set(overrides) - {name for name, _, _ in POLICY_SETTINGS}
+        if unknown:
+            raise TypeError('Unknown IpPolicy settings: {}'.format(', '.join(sorted(unknown))))
+
+        self.config = read_policy_config(**overrides)
+        for name, value in self.config.items():
+            setattr(self, name, value)
+
+        if self.IP_MATCHER_ENGINE not in MATCHER_ENGINES:
+            raise ImproperlyConfigured(
+                'IP_MATCHER_ENGINE must be one of {}'.format(', '.join(sorted(MATCHER_ENGINES)))
+            )
+
+        for setting in ('IP_VIEW_POLICIES', 'IP_HOST_POLICIES'):
+            for name, scope_policy in getattr(self, setting).items():
+                if not isinstance(scope_policy, dict) or set(scope_policy) - set(SCOPE_LISTS['site']):
+                    raise ImproperlyConfigured(
+                        '{}[{!r}] must be a dict of ALLOWED_IPS and ALLOWED_IP_RANGES'.format(setting, name)
+                    )
+
+        # The scope of each IP_VIEW_POLICIES entry, keyed by the view name, namespace or app name it applies to
+        self.view_scopes = {name: 'view:' + name for name in self.IP_VIEW_POLICIES}
+
+        # The scope of each IP_HOST_POLICIES entry, keyed by the host name, or for a wildcard such as
+        # '.example.com', by the suffix it matches
+        self._host_scopes = {}
+        self._host_suffix_scopes = {}
+        for name in self.IP_HOST_POLICIES:
+            host = name.lower().rstrip('.')
+            if host.startswith('.'):
+                self._host_suffix_scopes[host] = 'host:' + name
+            else:
+                self._host_scopes[host] = 'host:' + name
+
+        # Watch the files the policy comes from, if any, starting before they are first read so no change is missed
+        if self.IP_POLICY_ARTIFACT:
+            policy_files = [self.IP_POLICY_ARTIFACT]
+        else:
+            policy_files = [path for path in (self.ALLOWED_IPS_FILE, self.DENIED_IPS_FILE) if path]
+
+        if policy_files:
+            self.watcher = FileWatcher(policy_files, self.ALLOWED_IPS_FILE_POLL_INTERVAL, self.reload)
+        else:
+            self.watcher = None
+
+        self._compiled = None
+        self._compile_lock = threading.Lock()
+
+    @property
+    def compiled(self):
+        """
+        The current CompiledPolicy.  Take a reference to it to check several things against the same lists
+        """
+
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self.compile()
+        return compiled
+
+    def compile(self):
+        """
+        Compile the lists, if they haven't been already, and return the CompiledPolicy.  If the policy files
+        can't be read, the IP lists in the configuration are used alone
+        """
+
+        with self._compile_lock:
+            if self._compiled is None:
+                try:
+                    self._compiled = self.load()
+                except (OSError, ValueError) as e:
+                    self.logger.error(
+                        'Failed to read the policy files, using the configured IP lists only: {}'.format(e)
+                    )
+                    self._compiled = self.compile_lists({})
+            return self._compiled
+
+    def poll(self):
+        """
+        Check the policy files for changes, at most every ALLOWED_IPS_FILE_POLL_INTERVAL seconds
+        """
+
+        if self.watcher is not None:
+            self.watcher.poll()
+
+    def is_allowed(self, ip, scope='site'):
+        """
+        Is the IP string in the scope's allowed IPs and IP ranges, and not in the denied ones?  Scopes are
+        'site', 'admin', and 'view:<name>' or 'host:<name>' for the IP_VIEW_POLICIES and IP_HOST_POLICIES
+        entries.  A malformed IP is not allowed
+        """
+
+        self.poll()
+        compiled = self.compiled
+        self._check_scope(compiled, scope)
+        return not compiled.is_denied((ip,)) and not compiled.is_blocked((ip,), scope)
+
+    def check_many(self, ips, scope='site'):
+        """
+        Return a list of whether each of the IP strings is_allowed().  Each distinct IP is parsed once, and the
+        addresses of each family are sorted and looked up together, in one sweep through the interval engine's
+        boundaries
+        """
+
+        self.poll()
+        compiled = self.compiled
+        self._check_scope(compiled, scope)
+        allowed = compiled.matchers[scope]
+        denied = compiled.matchers.get('deny')
+
+        ips = list(ips)
+
+        # Parse each distinct IP once, collecting the distinct addresses of each family.  Malformed IPs are left
+        # out, so are not allowed
+        addresses = {}
+        family_values = {4: set(), 6: set()}
+        for ip in set(ips):
+            try:
+                address = parse_address(ip)
+            except ValueError:
+                continue
+            addresses[ip] = address
+            family_values[address[0]].add(address[1])
+
+        allowed_addresses = set()
+        for version, values in family_values.items():
+            if not values:
+                continue
+            values = sorted(values)
+            allowed_values = allowed.match_many(version, values)
+            denied_values = denied.match_many(version, values) if denied else [False] * len(values)
+            allowed_addresses.update(
+                (version, value)
+                for value, is_allowed, is_denied in zip(values, allowed_values, denied_values)
+                if is_allowed and not is_denied
+            )
+
+        allowed_ips = {ip for ip, address in addresses.items() if address in allowed_addresses}
+        return [ip in allowed_ips for ip in ips]
+
+    @staticmethod
+    def _check_scope(compiled, scope):
+        if scope == 'deny' or scope not in compiled.matchers:
+            raise ValueError('{!r} is not a policy scope'.format(scope))
+
+    def host_scope(self, host):
+        """
+        Return the scope of the IP_HOST_POLICIES entry for the lower case host name, or None if there isn't one.
+        An exact entry applies first, then the wildcard entry for the longest suffix, e.g. '.intranet.example.com'
+        before '.example.com'.  Each is a dict lookup, so the number of entries doesn't matter
+        """
+
+        scope = self._host_scopes.get(host)
+        if scope is not None or not self._host_suffix_scopes:
+            return scope
+
+        # As in ALLOWED_HOSTS, '.example.com' matches example.com and any subdomain of it
+        start = 0
+        while True:
+            scope = self._host_suffix_scopes.get('.' + host[start:])
+            if scope is not None:
+                return scope
+            start = host.find('.', start) + 1
+            if not start:
+                return None
+
+    def _new_decision_cache(self):
+        # Optional cache of decisions, keyed by the client IPs and which scope (site or admin) was checked
+        if self.IP_DECISION_CACHE_SIZE > 0:
+            return DecisionCache(self.IP_DECISION_CACHE_SIZE, self.IP_DECISION_CACHE_TTL)
+        return None
+
+    def load(self):
+        """
+        Build a new CompiledPolicy: memory-mapped from IP_POLICY_ARTIFACT if that is set, otherwise compiled from
+        the configured IP lists plus the entries in ALLOWED_IPS_FILE and DENIED_IPS_FILE.  Raises OSError or
+        ValueError if a file can't be read
+        """
+
+        if self.IP_POLICY_ARTIFACT:
+            # The artifact's IPs and ranges are merged, so only the policy scopes can tell exact matches apart
+            exact_matchers = {}
+            matchers = load_artifact(self.IP_POLICY_ARTIFACT)
+            matchers.update(self.compile_policy_scopes(exact_matchers))
+            return CompiledPolicy(matchers, self._new_decision_cache(), exact_matchers)
+
+        return self.compile_lists(self.read_ip_files())
+
+    def read_ip_files(self):
+        """
+        Read the entries in ALLOWED_IPS_FILE and DENIED_IPS_FILE, if set, into a dict of lists.  Only the denied
+        lists are read from DENIED_IPS_FILE
+        """
+
+        file_lists = {}
+        if self.ALLOWED_IPS_FILE:
+            file_lists.update(read_ip_file(self.ALLOWED_IPS_FILE))
+
+        if self.DENIED_IPS_FILE:
+            denied_lists = read_ip_file(
+                self.DENIED_IPS_FILE, 'DENIED_IPS', 'DENIED_IP_RANGES', names=DENIED_FILE_LISTS
+            )
+            for name, entries in denied_lists.items():
+                file_lists[name] = file_lists.get(name, []) + entries
+
+        return file_lists
+
+    def parse_intervals(self, ips, ip_ranges):
+        return parse_intervals(ips, ip_ranges, self.logger)
+
+    def parse_scopes(self, file_lists):
+        """
+        Parse the configured IP lists, plus any entries read from the allowlist and denylist files, into an
+        iterable of (version, start, end) integer intervals per scope
+        """
+
+        scopes = {}
+        for scope, (ips_name, ranges_name) in SCOPE_LISTS.items():
+            scopes[scope] = self.parse_intervals(
+                getattr(self, ips_name) + file_lists.get(ips_name, []),
+                getattr(self, ranges_name) + file_lists.get(ranges_name, []),
+            )
+        return scopes
+
+    def compile_lists(self, file_lists):
+        """
+        Compile the IP lists from the configuration, plus any entries read from the allowlist and denylist files,
+        into a new CompiledPolicy with an empty decision cache.  The denylist always uses the interval engine, as
+        the most compact for very large lists
+        """
+
+        engine = MATCHER_ENGINES[self.IP_MATCHER_ENGINE]
+        matchers = {}
+        exact_matchers = {}
+        for scope, intervals in self.parse_scopes(file_lists).items():
+            if scope == 'deny':
+                matchers[scope] = IntervalMatcher.from_intervals(intervals)
+            else:
+                matchers[scope], exact_matchers[scope] = compile_scope(engine, intervals)
+        matchers.update(self.compile_policy_scopes(exact_matchers))
+        return CompiledPolicy(matchers, self._new_decision_cache(), exact_matchers)
+
+    def compile_policy_scopes(self, exact_matchers=None):
+        """
+        Compile each of the IP_VIEW_POLICIES and IP_HOST_POLICIES into a matcher, keyed by its scope.  The
+        matchers of their single addresses are added to exact_matchers, if given
+        """
+
+        engine = MATCHER_ENGINES[self.IP_MATCHER_ENGINE]
+        matchers = {}
+        for prefix, scope_policies in (('view:', self.IP_VIEW_POLICIES), ('host:', self.IP_HOST_POLICIES)):
+            for name, scope_policy in scope_policies.items():
+                matcher, exact_matcher = compile_scope(engine, self.parse_intervals(
+                    scope_policy.get('ALLOWED_IPS', []), scope_policy.get('ALLOWED_IP_RANGES', [])
+                ))
+                matchers[prefix + name] = matcher
+                if exact_matchers is not None:
+                    exact_matchers[prefix + name] = exact_matcher
+        return matchers
+
+    def reload(self):
+        """
+        Rebuild the CompiledPolicy from its files, and swap it in.  If a file can't be read, e.g. it is part way
+        through being written, the current one is kept
+        """
+
+        try:
+            compiled = self.load()
+        except (OSError, ValueError) as e:
+            self.logger.error('Failed to reload the IP restriction policy, keeping the current one: {}'.format(e))
+            return
+
+        self._compiled = compiled
+        self.logger.info('Reloaded the IP restriction policy')
+
+
+_shared_policy = None
+_shared_policy_lock = threading.Lock()
+_config_generation = 0
+
+
+def get_policy(config=None):
+    """
+    Return the IpPolicy for the current settings and environment, compiled.  It is shared by the middleware, the
+    WSGI and ASGI wrappers, and any other callers in the process, so the lists are only compiled once, and
+    getting it is cheap enough to do on every call.  It is rebuilt when one of its settings is changed, e.g. by
+    override_settings, or by reload_policy().
+
+    Given a config, as returned by read_policy_config(), it is also rebuilt if it was built from a different one,
+    e.g. since the environment changed.  The middleware does this as it loads its configuration, so that its
+    flags and its IP lists are always read together
+    """
+
+    policy = _shared_policy
+    if policy is not None and (config is None or policy.config == config):
+        return policy
+
+    with _shared_policy_lock:
+        if _shared_policy is None or (config is not None and _shared_policy.config != config):
+            _build_shared_policy(config)
+        return _shared_policy
+
+
+def reload_policy():
+    """
+    Rebuild the shared IpPolicy from the current settings and environment, e.g. after changing the environment,
+    and return it.  The middleware loads its configuration again too, on its next request
+    """
+
+    global _config_generation
+
+    with _shared_policy_lock:
+        _build_shared_policy()
+        _config_generation += 1
+        return _shared_policy
+
+
+def config_generation():
+    """
+    A count of the changes to the configuration: to any setting the app has read, e.g. by override_settings, and
+    calls to reload_policy().  The middleware checks it on each request, and loads its configuration again when
+    it has changed
+    """
+
+    return _config_generation
+
+
+def _build_shared_policy(config=None):
+    # Called with the lock held
+    global _shared_policy
+
+    if config is None:
+        config = read_policy_config()
+    policy = IpPolicy(**config)
+    # Compiled now, rather than by the first request
+    policy.compile()
+    # A copy, so a list changed in place in the settings still counts as a change
+    policy.config = copy.deepcopy(config)
+    _shared_policy = policy
+
+
+def _setting_changed(setting, **kwargs):
+    global _shared_policy, _config_generation
+
+    # The one receiver for the app, rather than one per middleware, which would keep every discarded middleware
+    # reloading until it was garbage collected
+    if setting in config_names:
+        with _shared_policy_lock:
+            if setting in _POLICY_SETTING_NAMES:
+                # Built again when next asked for
+                _shared_policy = None
+            _config_generation += 1
+
+
+_POLICY_SETTING_NAMES = {name for name, _, _ in POLICY_SETTINGS}
+setting_changed.connect(_setting_changed)
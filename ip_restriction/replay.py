@@ -0,0 +1,141 @@
+import gzip
+import io
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .addresses import parse_address
+
+
+def open_log(path):
+    """
+    Open an access log for reading as text, decompressing it if it is gzipped
+    """
+
+    with open(path, 'rb') as log_file:
+        gzipped = log_file.read(2) == b'\x1f\x8b'
+
+    if gzipped:
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return io.open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BatchEvaluator():
+    """
+    Works out which of a batch of client IPs a policy would deny: those not in the allowed intervals, and those
+    in the denied intervals.  Both are IntervalMatchers.
+
+    If NumPy is installed, the IPv4 addresses of each batch are looked up all at once with searchsorted over the
+    boundary arrays.  IPv6 addresses, which NumPy has no integer type for, and all addresses without NumPy, are
+    looked up one at a time with bisect
+    """
+
+    def __init__(self, allowed, denied=None):
+        self.allowed = allowed
+        self.denied = denied if denied else None
+
+        if numpy is not None:
+            self._ipv4_allowed = numpy.array(allowed.boundaries(4), dtype=numpy.uint32)
+            if self.denied is not None:
+                self._ipv4_denied = numpy.array(self.denied.boundaries(4), dtype=numpy.uint32)
+
+    def _is_denied(self, version, value):
+        if self.denied is not None and self.denied.match(version, value):
+            return True
+        return not self.allowed.match(version, value)
+
+    def evaluate(self, addresses):
+        """
+        Return a list of whether each (version, integer) address in the batch would be denied
+        """
+
+        if numpy is None:
+            return [self._is_denied(version, value) for version, value in addresses]
+
+        results = [False] * len(addresses)
+        ipv4_indexes = []
+        for index, (version, value) in enumerate(addresses):
+            if version == 4:
+                ipv4_indexes.append(index)
+            else:
+                results[index] = self._is_denied(version, value)
+
+        if ipv4_indexes:
+            values = numpy.fromiter(
+                (addresses[index][1] for index in ipv4_indexes), dtype=numpy.uint32, count=len(ipv4_indexes)
+            )
+            # Inside an interval when an odd number of boundaries are <= the address
+            denied = numpy.searchsorted(self._ipv4_allowed, values, side='right') & 1 == 0
+            if self.denied is not None:
+                denied |= numpy.searchsorted(self._ipv4_denied, values, side='right') & 1 == 1
+
+            for index, is_denied in zip(ipv4_indexes, denied.tolist()):
+                results[index] = is_denied
+
+        return results
+
+
+class TopCounter():
+    """
+    Counts items, keeping at most capacity of them.  When full, the less common half are dropped, so the counts
+    of the most common items are exact unless they were rare early on, and memory use is bounded however many
+    distinct items there are
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = Counter()
+
+    def add(self, item):
+        self.counts[item] += 1
+        if len(self.counts) > self.capacity:
+            self.counts = Counter(dict(self.counts.most_common(self.capacity // 2)))
+
+    def most_common(self, n):
+        return self.counts.most_common(n)
+
+
+def replay(lines, extract_ip, evaluator, batch_size=100000, top_capacity=100000):
+    """
+    Evaluate the client IP of each log line, extracted by extract_ip(line), in batches.  Returns a dict of the
+    line, allowed, denied and unparsed counts, and a TopCounter of the denied IPs
+    """
+
+    totals = {'lines': 0, 'allowed': 0, 'denied': 0, 'unparsed': 0}
+    top_denied = TopCounter(top_capacity)
+
+    for batch in iter_batches(lines, batch_size):
+        totals['lines'] += len(batch)
+        ips = []
+        addresses = []
+        for line in batch:
+            ip = extract_ip(line)
+            try:
+                addresses.append(parse_address(ip))
+            except (ValueError, TypeError):
+                totals['unparsed'] += 1
+                continue
+            ips.append(ip)
+
+        for ip, is_denied in zip(ips, evaluator.evaluate(addresses)):
+            if is_denied:
+                totals['denied'] += 1
+                top_denied.add(ip)
+            else:
+                totals['allowed'] += 1
+
+    return totals, top_denied
@@ -0,0 +1,436 @@
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+try:
+    from django.core.urlresolvers import Resolver404
+except ImportError:
+    from django.urls import Resolver404
+from django import VERSION
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0, which has no async support anyway
+    sync_to_async = None
+
+from .bans import client_key
+
+
+class RequestContext():
+    """
+    Facts about a request that the rules need, each worked out on first use and then remembered, so that
+    expensive ones (resolving the URL, loading the user) are only paid for when a rule actually asks
+    """
+
+    def __init__(self, whitelister, request):
+        self.whitelister = whitelister
+        self.request = request
+        # Held for the whole request, so the rules all see the same policy even if it is reloaded meanwhile
+        self.policy = whitelister.policy
+        self._client_ips = None
+        self._is_admin = None
+        self._is_authenticated = None
+        self._view_scope = None
+        self._view_scope_known = False
+        self._site_scope = None
+        self._site_scope_known = False
+        # The rule that decided the outcome, set by the RulePipeline: the restriction that denied the request, or
+        # the exemption that let it through.  None if no restriction denied it
+        self.decided_by = None
+        # Set by the RulePipeline when the exception it raises is a restriction's denial, rather than an error
+        self.denied = False
+        # The restriction whose allowed IPs let the request through, and the scope it checked them in, or None if
+        # they were its allowed countries or ASNs.  The last such restriction to run, so the most specific
+        self.allowed_by = None
+        self.allowed_scope = None
+
+    @property
+    def client_ips(self):
+        if self._client_ips is None:
+            self._client_ips = tuple(self.whitelister.get_client_ip_list(self.request))
+        return self._client_ips
+
+    @property
+    def is_admin(self):
+        if self._is_admin is None:
+            self._is_admin = self.whitelister.is_admin_request(self.request)
+        return self._is_admin
+
+    @property
+    def view_scope(self):
+        # None is a valid answer, for a view with no IP_VIEW_POLICIES entry, so can't mark it as not worked out yet
+        if not self._view_scope_known:
+            self._view_scope = self.whitelister.get_view_scope(self.request)
+            self._view_scope_known = True
+        return self._view_scope
+
+    @property
+    def site_scope(self):
+        # None when neither RESTRICT_IPS nor an IP_HOST_POLICIES entry applies
+        if not self._site_scope_known:
+            self._site_scope = self.whitelister.get_site_scope(self.request.META)
+            self._site_scope_known = True
+        return self._site_scope
+
+    @property
+    def is_authenticated(self):
+        if self._is_authenticated is None:
+            if VERSION >= (1, 10):
+                self._is_authenticated = self.request.user.is_authenticated
+            else:
+                self._is_authenticated = self.request.user.is_authenticated()
+        return self._is_authenticated
+
+    async def ais_authenticated(self):
+        """
+        The async version of is_authenticated, which loads the user without blocking the event loop
+        """
+
+        if self._is_authenticated is None:
+            if hasattr(self.request, 'auser'):
+                # Django 5.0+
+                user = await self.request.auser()
+                self._is_authenticated = user.is_authenticated
+            else:
+                self._is_authenticated = await sync_to_async(lambda: self.request.user.is_authenticated)()
+        return self._is_authenticated
+
+
+class Rule():
+    """
+    Base class for rules.  Rules are created once per configuration load with the IpWhitelister, and only
+    rules that are enabled under that configuration are put in the pipeline.  The cost is a rough relative
+    measure of how expensive the check is, used to order the exemptions
+    """
+
+    cost = 0
+
+    def __init__(self, whitelister):
+        self.whitelister = whitelister
+
+    @property
+    def name(self):
+        """
+        The name the rule is reported under in the metrics.  Defaults to the class name
+        """
+
+        return type(self).__name__
+
+    def enabled(self):
+        return True
+
+    def check(self, context):
+        raise NotImplementedError
+
+    async def acheck(self, context):
+        """
+        Used instead of check() when the middleware is running async.  Override this for rules that need to do
+        I/O, e.g. database queries, which can't be done directly in an async context
+        """
+
+        return self.check(context)
+
+
+class Restriction(Rule):
+    """
+    A rule that can deny a request.  check() returns None to let the request through, or the exception to
+    raise to deny it.  If exemptible is False, the exemptions can't override a denial
+    """
+
+    exemptible = True
+
+
+class Exemption(Rule):
+    """
+    A rule that can let a request past all the restrictions.  check() returns True to exempt the request
+    """
+
+
+class AdminExemption(Exemption):
+    name = 'admin_bypass'
+    cost = 10
+
+    def enabled(self):
+        return self.whitelister.RESTRICT_IPS and self.whitelister.ALLOW_ADMIN
+
+    def check(self, context):
+        return context.is_admin
+
+
+class AuthenticatedExemption(Exemption):
+    """
+    Let authenticated users through.  With IP_BYPASS_MARKER, a client with a valid marker is let through without
+    loading the user, and a client found to be authenticated is given a marker
+    """
+
+    # Needs the session, and usually the user, loading from the database
+    name = 'authenticated_bypass'
+    cost = 100
+
+    def enabled(self):
+        return self.whitelister.RESTRICT_IPS and self.whitelister.ALLOW_AUTHENTICATED
+
+    def check(self, context):
+        marker = self.whitelister.bypass_marker
+        if marker is None:
+            return context.is_authenticated
+
+        if marker.is_valid(context.request):
+            return True
+        if context.is_authenticated:
+            marker.issue(context.request)
+            return True
+        return False
+
+    async def acheck(self, context):
+        marker = self.whitelister.bypass_marker
+        if marker is None:
+            return await context.ais_authenticated()
+
+        if await marker.ais_valid(context.request):
+            return True
+        if await context.ais_authenticated():
+            await marker.aissue(context.request)
+            return True
+        return False
+
+
+class BannedIpRestriction(Restriction):
+    """
+    Deny requests from clients that are temporarily banned for being denied too often, before the allowlists are
+    checked.  A ban only tightens a restriction that already applies to the request, the site's, the admin's or
+    a view's, so a client banned for trying the admin can still reach a site that isn't restricted.  The
+    exemptions still apply to banned clients, but not to the denied IPs, countries and ASNs
+    """
+
+    name = 'banned_ip'
+    cost = 0
+
+    def enabled(self):
+        return self.whitelister.bans is not None
+
+    def is_restricted(self, context):
+        # Only asked once the client is known to be banned, as it may need the URL resolving
+        w = self.whitelister
+        return (
+            context.site_scope is not None
+            or (w.RESTRICT_ADMIN_BY_IPS and context.is_admin)
+            or (bool(w.IP_VIEW_POLICIES) and context.view_scope is not None)
+        )
+
+    def check(self, context):
+        if self.whitelister.bans.is_banned(client_key(context.client_ips)) and self.is_restricted(context):
+            return PermissionDenied()
+        return None
+
+    async def acheck(self, context):
+        if await self.whitelister.bans.ais_banned(client_key(context.client_ips)) and self.is_restricted(context):
+            return PermissionDenied()
+        return None
+
+
+class DeniedIpRestriction(Restriction):
+    """
+    Deny requests from the DENIED_IPS and DENIED_IP_RANGES, whatever else is configured
+    """
+
+    name = 'denied_ip'
+    cost = 1
+    exemptible = False
+
+    def enabled(self):
+        w = self.whitelister
+        return bool(w.DENIED_IPS or w.DENIED_IP_RANGES or w.DENIED_IPS_FILE or w.IP_POLICY_ARTIFACT)
+
+    def check(self, context):
+        if context.policy.is_denied(context.client_ips):
+            return PermissionDenied()
+        return None
+
+
+class DeniedGeoIpRestriction(Restriction):
+    """
+    Deny requests from the DENIED_COUNTRIES and DENIED_ASNS, whatever else is configured
+    """
+
+    name = 'denied_geoip'
+    cost = 5
+    exemptible = False
+
+    def enabled(self):
+        return self.whitelister.geoip is not None and self.whitelister.geoip.denies
+
+    def check(self, context):
+        if self.whitelister.geoip.is_denied(context.client_ips):
+            return PermissionDenied()
+        return None
+
+
+class SiteIpRestriction(Restriction):
+    """
+    Deny requests from IPs not in the ALLOWED_IPS and ALLOWED_IP_RANGES, or the ALLOWED_COUNTRIES and ALLOWED_ASNS.
+    Requests for a host with an entry in IP_HOST_POLICIES are checked against that entry's IPs instead
+    """
+
+    name = 'site_ip'
+    cost = 1
+
+    def enabled(self):
+        return self.whitelister.RESTRICT_IPS or bool(self.whitelister.IP_HOST_POLICIES)
+
+    def check(self, context):
+        scope = context.site_scope
+        if scope is None:
+            return None
+        if context.policy.is_blocked(context.client_ips, scope):
+            geoip = self.whitelister.geoip
+            if scope != 'site' or geoip is None or not geoip.is_allowed(context.client_ips):
+                return PermissionDenied()
+            scope = None
+        context.allowed_by, context.allowed_scope = self, scope
+        return None
+
+
+class AdminIpRestriction(Restriction):
+    name = 'admin_ip'
+    cost = 10
+
+    def enabled(self):
+        return self.whitelister.RESTRICT_ADMIN_BY_IPS
+
+    def check(self, context):
+        if context.is_admin:
+            if context.policy.is_blocked(context.client_ips, 'admin'):
+                return Http404()
+            context.allowed_by, context.allowed_scope = self, 'admin'
+        return None
+
+
+class ViewIpRestriction(Restriction):
+    """
+    Deny requests to views with an entry in IP_VIEW_POLICIES, from IPs that entry doesn't allow
+    """
+
+    name = 'view_ip'
+    cost = 10
+
+    def enabled(self):
+        return bool(self.whitelister.IP_VIEW_POLICIES)
+
+    def check(self, context):
+        scope = context.view_scope
+        if scope is not None:
+            if context.policy.is_blocked(context.client_ips, scope):
+                return PermissionDenied()
+            context.allowed_by, context.allowed_scope = self, scope
+        return None
+
+
+# The restrictions that can't be exempted come first, so a request they deny is denied before the others are run
+DEFAULT_RULES = [
+    AdminExemption,
+    AuthenticatedExemption,
+    DeniedIpRestriction,
+    DeniedGeoIpRestriction,
+    BannedIpRestriction,
+    SiteIpRestriction,
+    AdminIpRestriction,
+    ViewIpRestriction,
+]
+
+
+class RulePipeline():
+    """
+    Runs the restrictions in order until one denies the request.  Only then are the exemptions checked,
+    cheapest first, so the expensive ones are skipped for requests that no restriction denies.
+
+    This gives the same outcome as checking every exemption first: a request is let through if any
+    exemption applies, and otherwise gets the denial of the first restriction to deny it.  A denial by a
+    restriction that is not exemptible is final, so once a request is denied the rest of those restrictions are
+    still run, wherever they are in the order, before any exemption is checked.
+
+    A restriction that raises PermissionDenied or Http404 counts as denying with that exception, which is only
+    raised if no exemption applies.  Any other exception, including the Resolver404 of a URL that doesn't
+    exist, is raised straight away
+    """
+
+    def __init__(self, rules):
+        rules = [rule for rule in rules if rule.enabled()]
+        self.restrictions = [rule for rule in rules if isinstance(rule, Restriction)]
+        self.exemptions = sorted(
+            (rule for rule in rules if isinstance(rule, Exemption)), key=lambda rule: rule.cost
+        )
+
+    def __bool__(self):
+        return bool(self.restrictions)
+
+    def run(self, context):
+        denial = None
+        for rule in self.restrictions:
+            # Once the request is denied, only a denial that can't be exempted could change the outcome
+            if denial is not None and rule.exemptible:
+                continue
+
+            try:
+                rule_denial = rule.check(context)
+            except Resolver404:
+                # The URL doesn't exist, found while resolving it for the admin or view rules, which is for
+                # Django to answer with its usual 404 rather than a denial
+                raise
+            except (PermissionDenied, Http404) as e:
+                rule_denial = e
+
+            if rule_denial is not None:
+                context.decided_by = rule
+                if not rule.exemptible:
+                    context.denied = True
+                    raise rule_denial
+                denial = rule_denial
+
+        if denial is None:
+            return None
+
+        for rule in self.exemptions:
+            if rule.check(context):
+                context.decided_by = rule
+                return None
+
+        context.denied = True
+        raise denial
+
+    async def arun(self, context):
+        """
+        The async version of run(), calling each rule's acheck()
+        """
+
+        denial = None
+        for rule in self.restrictions:
+            # Once the request is denied, only a denial that can't be exempted could change the outcome
+            if denial is not None and rule.exemptible:
+                continue
+
+            try:
+                rule_denial = await rule.acheck(context)
+            except Resolver404:
+                # The URL doesn't exist, found while resolving it for the admin or view rules, which is for
+                # Django to answer with its usual 404 rather than a denial
+                raise
+            except (PermissionDenied, Http404) as e:
+                rule_denial = e
+
+            if rule_denial is not None:
+                context.decided_by = rule
+                if not rule.exemptible:
+                    context.denied = True
+                    raise rule_denial
+                denial = rule_denial
+
+        if denial is None:
+            return None
+
+        for rule in self.exemptions:
+            if await rule.acheck(context):
+                context.decided_by = rule
+                return None
+
+        context.denied = True
+        raise denial
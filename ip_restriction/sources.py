@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+
+
+# The lists an allowlist file can add entries to
+FILE_LISTS = (
+    'ALLOWED_IPS', 'ALLOWED_IP_RANGES', 'ALLOWED_ADMIN_IPS', 'ALLOWED_ADMIN_IP_RANGES', 'DENIED_IPS', 'DENIED_IP_RANGES'
+)
+
+# The lists a denylist file can add entries to.  Only these, so that a threat feed can never allow an IP
+DENIED_FILE_LISTS = ('DENIED_IPS', 'DENIED_IP_RANGES')
+
+
+def read_ip_file(path, ips_name='ALLOWED_IPS', ranges_name='ALLOWED_IP_RANGES', names=FILE_LISTS):
+    """
+    Read an allowlist or denylist file, returning a dict of lists keyed by the given names.
+
+    A file ending .json holds an object with any of those keys, each a list of strings, and any other keys are
+    ignored.  Any other file is plain text, with one IP or IP range per line, and # starting a comment.  Entries
+    containing a / are added to the ranges_name list, and the rest to the ips_name list
+    """
+
+    with open(path) as ip_file:
+        if path.endswith('.json'):
+            data = json.load(ip_file)
+            if not isinstance(data, dict):
+                raise ValueError('{} must contain a JSON object'.format(path))
+            return {name: [str(entry).strip() for entry in data.get(name, [])] for name in names}
+
+        lists = {name: [] for name in names}
+        for line in ip_file:
+            entry = line.split('#', 1)[0].strip()
+            if entry:
+                lists[ranges_name if '/' in entry else ips_name].append(entry)
+        return lists
+
+
+def check_ip_file(path):
+    """
+    Check that an allowlist or denylist file can be read, and that a .json file starts as a JSON object, without
+    reading the whole file, which may be very large.  Raises OSError or ValueError if not.  The entries are only
+    parsed when the policy is compiled
+    """
+
+    with open(path) as ip_file:
+        start = ip_file.read(4096).lstrip()
+    if path.endswith('.json') and not start.startswith('{'):
+        raise ValueError('{} must contain a JSON object'.format(path))
+
+
+class FileWatcher():
+    """
+    Cheaply watches a list of files for changes.  poll() is meant to be called on every request: at most once
+    per interval it stats the files, and if any modification time, size or inode has changed it runs the
+    callback in a background thread.  Only one callback runs at a time
+    """
+
+    def __init__(self, paths, interval, callback, timer=time.monotonic):
+        self.paths = paths
+        self.interval = interval
+        self.callback = callback
+        self.timer = timer
+        self.thread = None
+        self._lock = threading.Lock()
+        self._signature = self._stat()
+        self._next_check = timer() + interval
+
+    def _stat(self):
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return signature
+
+    def poll(self):
+        """
+        Check for a change if the interval has passed, returning the thread started to handle it, if any
+        """
+
+        if self.timer() < self._next_check:
+            return None
+
+        # If another thread is already checking, leave it to that one
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        try:
+            self._next_check = self.timer() + self.interval
+
+            if self.thread is not None and self.thread.is_alive():
+                return None
+
+            signature = self._stat()
+            if signature == self._signature:
+                return None
+
+            self._signature = signature
+            self.thread = threading.Thread(
+                target=self.callback, name='ip-restriction-reload', daemon=True
+            )
+            self.thread.start()
+            return self.thread
+        finally:
+            self._lock.release()
@@ -0,0 +1,12 @@
+from django.http import HttpResponse
+
+from .metrics import registry
+
+
+def metrics(request):
+    """
+    The middleware's metrics in the Prometheus text format.  Only counts decisions if IP_METRICS is on.  Add it to
+    your urls, somewhere only your Prometheus server can reach, e.g. with RESTRICT_ADMIN_BY_IPS
+    """
+
+    return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,204 @@
+from http import HTTPStatus
+
+from .bans import client_key
+from .middleware import IpWhitelister
+
+
+class _Meta():
+    # Stands in for a request, for IpWhitelister.get_client_ip_list, which only reads META
+    def __init__(self, meta):
+        self.META = meta
+
+
+class IpGate():
+    """
+    The part of the IpWhitelister's decision that can be made from the client's IPs alone, before Django has
+    built a request: clients in the denied IPs are denied, and unless an exemption (e.g. ALLOW_ADMIN or
+    ALLOW_AUTHENTICATED) might let the request through anyway, so are those not in the allowed IPs, and banned
+    clients of a site whose IPs are restricted.  Everything else is left to the middleware.
+
+    Uses the same configuration, compiled policy and ban store as the middleware, via an IpWhitelister of its own
+    """
+
+    def __init__(self, whitelister=None):
+        self.whitelister = whitelister or IpWhitelister()
+
+    def client_ips(self, meta):
+        return tuple(self.whitelister.get_client_ip_list(_Meta(meta)))
+
+    def _denied_by_lists(self, client_ips, meta):
+        w = self.whitelister
+        policy = w.policy
+        if policy.is_denied(client_ips):
+            return 'denied_ip'
+        if w.geoip is not None and w.geoip.is_denied(client_ips):
+            return 'denied_geoip'
+        if w.pipeline.exemptions:
+            return None
+        scope = w.get_site_scope(meta)
+        if scope is not None and policy.is_blocked(client_ips, scope):
+            if scope != 'site' or w.geoip is None or not w.geoip.is_allowed(client_ips):
+                return 'site_ip'
+        return None
+
+    def _can_ban(self, meta):
+        # Only when every path of the host is restricted, as whether the admin or a view is needs the URL resolving
+        w = self.whitelister
+        return w.bans is not None and not w.pipeline.exemptions and w.get_site_scope(meta) is not None
+
+    def denied_by(self, client_ips, meta):
+        """
+        Return the name of the rule that denies the client, or None if it is not denied at this stage.  The
+        request's META, or the WSGI environ, gives its host
+        """
+
+        w = self.whitelister
+        w.reload_if_changed()
+        w.ip_policy.poll()
+
+        if self._can_ban(meta) and w.bans.is_banned(client_key(client_ips)):
+            return 'banned_ip'
+
+        rule_name = self._denied_by_lists(client_ips, meta)
+        if rule_name is not None and w.bans is not None:
+            w.bans.record_denial(client_key(client_ips))
+        return rule_name
+
+    async def adenied_by(self, client_ips, meta):
+        """
+        The async version of denied_by(), for ban stores that do I/O
+        """
+
+        w = self.whitelister
+        w.reload_if_changed()
+        w.ip_policy.poll()
+
+        if self._can_ban(meta) and await w.bans.ais_banned(client_key(client_ips)):
+            return 'banned_ip'
+
+        rule_name = self._denied_by_lists(client_ips, meta)
+        if rule_name is not None and w.bans is not None:
+            await w.bans.arecord_denial(client_key(client_ips))
+        return rule_name
+
+    def record(self, rule_name, started):
+        # Only denials are counted here, as requests let through are counted by the middleware
+        if rule_name is not None and self.whitelister.metrics is not None:
+            self.whitelister.metrics.record_rule(rule_name, 'deny', started)
+
+    def start(self):
+        return self.whitelister.metrics.start() if self.whitelister.metrics is not None else None
+
+    def deny_response(self):
+        """
+        The status, headers and body to deny with, as configured by the IP_DENY_RESPONSE settings
+        """
+
+        w = self.whitelister
+        status = w.IP_DENY_RESPONSE_STATUS or 403
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        headers.update(w.IP_DENY_RESPONSE_HEADERS)
+        headers['Content-Length'] = str(len(w._deny_body))
+        return status, list(headers.items()), w._deny_body
+
+
+class IpRestrictionWSGI():
+    """
+    WSGI application wrapper that denies clients the IpWhitelister would deny on their IPs alone, before Django
+    is entered, e.g. in wsgi.py:
+
+        application = IpRestrictionWSGI(get_wsgi_application())
+    """
+
+    def __init__(self, application, gate=None):
+        self.application = application
+        self.gate = gate or IpGate()
+
+    def __call__(self, environ, start_response):
+        started = self.gate.start()
+        rule_name = self.gate.denied_by(self.gate.client_ips(environ), environ)
+        self.gate.record(rule_name, started)
+
+        if rule_name is None:
+            return self.application(environ, start_response)
+
+        status, headers, body = self.gate.deny_response()
+        start_response('{} {}'.format(status, _reason_phrase(status)), headers)
+        return [body]
+
+
+class IpRestrictionASGI():
+    """
+    ASGI application wrapper that denies clients the IpWhitelister would deny on their IPs alone, before Django
+    is entered, e.g. in asgi.py:
+
+        application = IpRestrictionASGI(get_asgi_application())
+
+    HTTP requests are denied with the deny response, and WebSocket connections are closed before being accepted
+    """
+
+    def __init__(self, application, gate=None):
+        self.application = application
+        self.gate = gate or IpGate()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.application(scope, receive, send)
+
+        started = self.gate.start()
+        meta = scope_meta(scope)
+        rule_name = await self.gate.adenied_by(self.gate.client_ips(meta), meta)
+        self.gate.record(rule_name, started)
+
+        if rule_name is None:
+            return await self.application(scope, receive, send)
+
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+
+        status, headers, body = self.gate.deny_response()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def scope_meta(scope):
+    """
+    The REMOTE_ADDR, SERVER_NAME, and the headers the IpGate reads, of an ASGI scope, as they would appear in
+    request.META
+    """
+
+    meta = {}
+    client = scope.get('client')
+    if client:
+        meta['REMOTE_ADDR'] = client[0]
+    server = scope.get('server')
+    if server:
+        meta['SERVER_NAME'] = server[0]
+
+    headers = {}
+    for name, value in scope.get('headers', ()):
+        if name in _META_HEADERS:
+            headers.setdefault(name, []).append(value)
+    for name, values in headers.items():
+        meta[_META_HEADERS[name]] = b','.join(values).decode('latin-1')
+
+    return meta
+
+
+_META_HEADERS = {
+    b'x-forwarded-for': 'HTTP_X_FORWARDED_FOR',
+    b'host': 'HTTP_HOST',
+    b'x-forwarded-host': 'HTTP_X_FORWARDED_HOST',
+}
+
+
+def _reason_phrase(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return 'Unknown'
@@ -6,6 +6,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.admin',
+    'ip_restriction',
     'tests'
 ]
 
@@ -48,5 +49,5 @@ if version_components[0] == 1 and version_components[1] == 9:
     MIDDLEWARE_CLASSES = _middleware
 elif version_components[0] == 1 and version_components[1] >= 10:
     MIDDLEWARE = _middleware
-elif version_components[0] == 2:
+elif version_components[0] >= 2:
     MIDDLEWARE = _middleware
@@ -0,0 +1,54 @@
+from django.test import TestCase
+
+from ip_restriction.addresses import parse_address, parse_network
+
+
+class TestParseAddress(TestCase):
+
+    def test_ipv4(self):
+        self.assertEqual(parse_address('10.0.0.1'), (4, 0x0a000001))
+
+    def test_ipv6(self):
+        self.assertEqual(parse_address('::1'), (6, 1))
+        self.assertEqual(parse_address('2001:db8::'), (6, 0x20010db8 << 96))
+
+    def test_ipv4_mapped(self):
+        self.assertEqual(parse_address('::ffff:10.0.0.1'), (4, 0x0a000001))
+        self.assertEqual(parse_address('0:0:0:0:0:ffff:a00:1'), (4, 0x0a000001))
+        # Only the mapped addresses are folded, not other IPv6 addresses embedding an IPv4 one
+        self.assertEqual(parse_address('::10.0.0.1'), (6, 0x0a000001))
+
+    def test_equivalent_forms(self):
+        self.assertEqual(parse_address('2001:0db8:0000::0001'), parse_address('2001:db8::1'))
+        self.assertEqual(parse_address('2001:DB8::1'), parse_address('2001:db8::1'))
+
+    def test_invalid(self):
+        # Zero padded IPv4 addresses are ambiguous, as some parsers read them as octal
+        for address in ['', '10.0.0', '10.0.0.256', 'example.com', '10.0.0.1/32', '010.0.0.1', None]:
+            with self.assertRaises(ValueError):
+                parse_address(address)
+
+
+class TestParseNetwork(TestCase):
+
+    def test_ipv4(self):
+        self.assertEqual(parse_network('10.0.0.0/8'), (4, 0x0a000000, 0x0affffff))
+        self.assertEqual(parse_network('10.0.0.1'), (4, 0x0a000001, 0x0a000001))
+        self.assertEqual(parse_network('0.0.0.0/0'), (4, 0, 2 ** 32 - 1))
+
+    def test_ipv6(self):
+        self.assertEqual(parse_network('::/0'), (6, 0, 2 ** 128 - 1))
+        self.assertEqual(parse_network('::1/128'), (6, 1, 1))
+
+    def test_ipv4_mapped(self):
+        self.assertEqual(parse_network('::ffff:10.0.0.0/104'), (4, 0x0a000000, 0x0affffff))
+        self.assertEqual(parse_network('::ffff:0:0/96'), (4, 0, 2 ** 32 - 1))
+        self.assertEqual(parse_network('::fffe:0:0/95')[0], 6)
+
+    def test_netmask(self):
+        self.assertEqual(parse_network('10.0.0.0/255.0.0.0'), (4, 0x0a000000, 0x0affffff))
+
+    def test_invalid(self):
+        for network in ['127.0.0.1/30', '10.0.0.0/33', '10.0.0.0/', 'example.com/8', '::1/129']:
+            with self.assertRaises(ValueError):
+                parse_network(network)
@@ -0,0 +1,75 @@
+import ipaddress
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.artifact import check_artifact, load_artifact, write_artifact
+from ip_restriction.matchers import IntervalMatcher
+
+
+class TestArtifact(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'policy.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _matcher(self, *ranges):
+        return IntervalMatcher(ipaddress.ip_network(ip_range) for ip_range in ranges)
+
+    def test_round_trip(self):
+        write_artifact(self.path, {
+            'site': self._matcher('10.0.0.0/8', '192.168.0.1/32', '2001:db8::/32', '255.255.255.0/24'),
+            'admin': self._matcher(),
+        })
+        check_artifact(self.path)
+        matchers = load_artifact(self.path)
+
+        self.assertEqual(sorted(matchers), ['admin', 'site'])
+        self.assertEqual(len(matchers['site']), 4)
+        for ip in ['10.1.2.3', '192.168.0.1', '2001:db8::1', '255.255.255.255']:
+            self.assertTrue(ip in matchers['site'])
+        for ip in ['11.0.0.0', '192.168.0.2', '2001:db9::', '255.255.254.255']:
+            self.assertFalse(ip in matchers['site'])
+        self.assertFalse('10.1.2.3' in matchers['admin'])
+
+    def test_invalid_artifact(self):
+        with open(self.path, 'wb') as artifact:
+            artifact.write(b'not a policy')
+        with self.assertRaises(ValueError):
+            check_artifact(self.path)
+        with self.assertRaises(ValueError):
+            load_artifact(self.path)
+
+    def test_compile_command_and_middleware(self):
+        with override_settings(
+                RESTRICT_IPS=True,
+                ALLOWED_IPS=['127.0.0.1'],
+                ALLOWED_IP_RANGES=['192.168.0.0/24'],
+                IP_POLICY_ARTIFACT=self.path):
+            out = StringIO()
+            call_command('compile_ip_policy', self.path, stdout=out)
+            self.assertIn('site: 2 ranges', out.getvalue())
+
+            # Once compiled, the artifact is used rather than the IP lists in settings
+            with override_settings(ALLOWED_IPS=[]):
+                restrictor = IpWhitelister()
+                self.assertIsNone(restrictor.process_request(RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')))
+                self.assertIsNone(restrictor.process_request(RequestFactory().get('/', REMOTE_ADDR='192.168.0.9')))
+                with self.assertRaises(PermissionDenied):
+                    restrictor.process_request(RequestFactory().get('/', REMOTE_ADDR='127.0.0.2'))
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['127.0.0.1'])
+    def test_missing_artifact_falls_back_to_settings(self):
+        with override_settings(IP_POLICY_ARTIFACT=self.path):
+            restrictor = IpWhitelister()
+            self.assertIsNone(restrictor.process_request(RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')))
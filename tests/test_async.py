@@ -0,0 +1,108 @@
+from unittest import skipUnless
+from unittest.mock import Mock
+
+from django import VERSION
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+
+from ip_restriction import IpWhitelister
+from ip_restriction.middleware import iscoroutinefunction
+
+if VERSION >= (3, 1):
+    from django.test import AsyncClient, AsyncRequestFactory
+    from django.test.client import RequestFactory
+
+try:
+    from django.urls import reverse_lazy
+except ImportError:
+    from django.core.urlresolvers import reverse_lazy
+
+
+class AuthenticatedUser():
+    is_authenticated = True
+
+
+class AnonymousUser():
+    is_authenticated = False
+
+
+async def async_view(request):
+    return HttpResponse('It works!')
+
+
+def sync_view(request):
+    return HttpResponse('It works!')
+
+
+@skipUnless(VERSION >= (3, 1), 'Async middleware needs Django 3.1+')
+class TestAsyncIpWhitelister(TestCase):
+
+    def _request(self, ip, user=None):
+        request = AsyncRequestFactory().get('/example')
+        request.META['REMOTE_ADDR'] = ip
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_sync_and_async_capable(self):
+        self.assertTrue(IpWhitelister.sync_capable)
+        self.assertTrue(IpWhitelister.async_capable)
+
+        self.assertTrue(iscoroutinefunction(IpWhitelister(async_view)))
+        self.assertFalse(iscoroutinefunction(IpWhitelister(sync_view)))
+
+        response = IpWhitelister(sync_view)(RequestFactory().get('/example'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['127.0.0.1'])
+    async def test_async_call(self):
+        middleware = IpWhitelister(async_view)
+
+        response = await middleware(self._request('127.0.0.1'))
+        self.assertEqual(response.status_code, 200)
+
+        response = await middleware(self._request('127.0.0.2', user=AuthenticatedUser()))
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertRaises(PermissionDenied):
+            await middleware(self._request('127.0.0.2'))
+
+    @override_settings(
+        RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['127.0.0.1'], IP_BYPASS_MARKER='cookie',
+    )
+    async def test_async_bypass_marker(self):
+        middleware = IpWhitelister(async_view)
+        request = self._request('127.0.0.2', user=AuthenticatedUser())
+        request.session = Mock(session_key='abc', get={'_auth_user_id': '1'}.get)
+        response = await middleware(request)
+        marker = response.cookies['ip_restriction_bypass'].value
+
+        # The marker lets the client through without checking the user
+        request = self._request('127.0.0.2')
+        request.session = Mock(session_key='abc', get={'_auth_user_id': '1'}.get)
+        request.COOKIES['ip_restriction_bypass'] = marker
+        response = await middleware(request)
+        self.assertEqual(response.status_code, 200)
+
+        request.session = Mock(session_key='def', get={'_auth_user_id': '1'}.get)
+        with self.assertRaises(PermissionDenied):
+            await middleware(request)
+
+        # Nor once the session has ended
+        request.session = Mock(session_key='abc', get={}.get)
+        with self.assertRaises(PermissionDenied):
+            await middleware(request)
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['127.0.0.1'])
+    async def test_async_client(self):
+        # The async test client takes the client address from the ASGI scope
+        response = await AsyncClient(client=('127.0.0.1', 1234)).get(reverse_lazy('example'))
+        self.assertEqual(response.status_code, 200)
+
+        response = await AsyncClient(client=('127.0.0.2', 1234)).get(reverse_lazy('example'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['127.0.0.1'], IP_DENY_RESPONSE=True)
+    async def test_async_deny_response(self):
+        response = await IpWhitelister(async_view)(self._request('127.0.0.2'))
+        self.assertEqual(response.status_code, 403)
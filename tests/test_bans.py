@@ -0,0 +1,170 @@
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction import bans
+from ip_restriction.bans import CacheBanStore, LocalBanStore
+
+
+class Clock():
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class BanStoreTests():
+    """
+    Behaviour common to the ban stores
+    """
+
+    def _store(self, threshold=3, window=10, duration=60):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_banned_after_threshold(self):
+        store = self._store()
+        self.assertFalse(store.record_denial('10.0.0.1'))
+        self.assertFalse(store.record_denial('10.0.0.1'))
+        self.assertFalse(store.is_banned('10.0.0.1'))
+        self.assertTrue(store.record_denial('10.0.0.1'))
+        self.assertTrue(store.is_banned('10.0.0.1'))
+        self.assertFalse(store.is_banned('10.0.0.2'))
+
+    def test_sliding_window(self):
+        store = self._store()
+        store.record_denial('10.0.0.1')
+        store.record_denial('10.0.0.1')
+
+        # Half way through the next window, the last window's denials count for half
+        self.clock.now += 15
+        self.assertFalse(store.record_denial('10.0.0.1'))
+        self.assertTrue(store.record_denial('10.0.0.1'))
+
+        # Long after, they're forgotten
+        store = self._store()
+        store.record_denial('10.0.0.2')
+        store.record_denial('10.0.0.2')
+        self.clock.now += 100
+        self.assertFalse(store.record_denial('10.0.0.2'))
+
+
+class TestLocalBanStore(BanStoreTests, TestCase):
+
+    def _store(self, threshold=3, window=10, duration=60, max_tracked=100):
+        return LocalBanStore(threshold, window, duration, max_tracked, timer=self.clock)
+
+    def test_ban_expires(self):
+        store = self._store(threshold=1)
+        store.record_denial('10.0.0.1')
+        self.clock.now += 59
+        self.assertTrue(store.is_banned('10.0.0.1'))
+        self.clock.now += 1
+        self.assertFalse(store.is_banned('10.0.0.1'))
+
+    def test_bounded(self):
+        store = self._store(threshold=2, max_tracked=10)
+        for index in range(100):
+            store.record_denial('10.0.0.{}'.format(index))
+            store.record_denial('10.1.0.{}'.format(index))
+            store.record_denial('10.1.0.{}'.format(index))
+
+        self.assertLessEqual(len(store._counters), 10)
+        self.assertEqual(len(store._bans), 10)
+        self.assertTrue(store.is_banned('10.1.0.99'))
+
+
+class TestCacheBanStore(BanStoreTests, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+    def _store(self, threshold=3, window=10, duration=60):
+        return CacheBanStore(threshold, window, duration, caches['default'], timer=self.clock)
+
+    def test_shared(self):
+        self._store(threshold=1).record_denial('10.0.0.1')
+        self.assertTrue(self._store(threshold=1).is_banned('10.0.0.1'))
+
+
+@override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'], IP_BAN_THRESHOLD=2)
+class TestMiddlewareBans(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        caches['default'].clear()
+        bans._local_stores.clear()
+
+    def _allowed(self, restrictor, ip, path='/example', user=None):
+        request = self.factory.get(path, REMOTE_ADDR=ip)
+        if user is not None:
+            request.user = user
+        try:
+            restrictor.process_request(request)
+        except (PermissionDenied, Http404):
+            return False
+        return True
+
+    def test_ban_short_circuits(self):
+        restrictor = IpWhitelister()
+        self.assertFalse(self._allowed(restrictor, '10.0.0.2'))
+        self.assertFalse(self._allowed(restrictor, '10.0.0.2'))
+        self.assertTrue(restrictor.bans.is_banned('10.0.0.2'))
+
+        with patch.object(restrictor.policy, 'is_blocked') as mock_is_blocked:
+            self.assertFalse(self._allowed(restrictor, '10.0.0.2'))
+            self.assertFalse(mock_is_blocked.called)
+
+        self.assertTrue(self._allowed(restrictor, '10.0.0.1'))
+
+    @override_settings(IP_BAN_BACKEND='cache')
+    def test_cache_backend_shared_between_workers(self):
+        self.assertFalse(self._allowed(IpWhitelister(), '10.0.0.2'))
+        self.assertFalse(self._allowed(IpWhitelister(), '10.0.0.2'))
+        self.assertTrue(IpWhitelister().bans.is_banned('10.0.0.2'))
+
+    @override_settings(RESTRICT_ADMIN_BY_IPS=True)
+    def test_unknown_urls_dont_count(self):
+        restrictor = IpWhitelister()
+        for _ in range(3):
+            self.assertFalse(self._allowed(restrictor, '10.0.0.1', path='/missing'))
+        self.assertTrue(self._allowed(restrictor, '10.0.0.1'))
+
+    @override_settings(ALLOW_ADMIN=True, DENIED_IPS=['6.6.6.6'], IP_BAN_THRESHOLD=3)
+    def test_ban_does_not_exempt_denied_ips(self):
+        # Once banned, the client must still be denied by the denylist, which ALLOW_ADMIN can't override
+        restrictor = IpWhitelister()
+        for _ in range(5):
+            self.assertFalse(self._allowed(restrictor, '6.6.6.6', path='/admin/login/'))
+        self.assertTrue(restrictor.bans.is_banned('6.6.6.6'))
+
+    @override_settings(
+        RESTRICT_IPS=False, RESTRICT_ADMIN_BY_IPS=True, ALLOWED_ADMIN_IPS=['10.0.0.1'], IP_BAN_THRESHOLD=3
+    )
+    def test_ban_only_applies_to_restricted_paths(self):
+        restrictor = IpWhitelister()
+        for _ in range(3):
+            self.assertFalse(self._allowed(restrictor, '10.0.0.9', path='/admin/'))
+        self.assertTrue(restrictor.bans.is_banned('10.0.0.9'))
+
+        # Banned from the admin, but the public site isn't restricted
+        self.assertFalse(self._allowed(restrictor, '10.0.0.9', path='/admin/'))
+        self.assertTrue(self._allowed(restrictor, '10.0.0.9'))
+
+    @override_settings(IP_BAN_THRESHOLD=0)
+    def test_off_by_default(self):
+        self.assertIsNone(IpWhitelister().bans)
+
+    @override_settings(IP_BAN_BACKEND='redis')
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            IpWhitelister()
@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.test.client import Client, RequestFactory
+try:
+    from django.core.urlresolvers import reverse_lazy
+except ImportError:
+    from django.urls import reverse_lazy
+
+from ip_restriction import IpWhitelister
+from ip_restriction.bypass import BypassMarker
+
+
+example_url = reverse_lazy('example')
+
+
+@override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['127.0.0.2'])
+class TestBypassMarker(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testuser')
+        cls.user.set_password('12345')
+        cls.user.save()
+
+    def _client(self, login=True):
+        client = Client(REMOTE_ADDR='127.0.0.1')
+        if login:
+            client.login(username='testuser', password='12345')
+        return client
+
+    def test_without_marker_loads_user(self):
+        client = self._client()
+        with self.assertNumQueries(2):
+            # The session, then the user
+            self.assertEqual(client.get(example_url).status_code, 200)
+
+    @override_settings(IP_BYPASS_MARKER='session')
+    def test_session(self):
+        client = self._client()
+        with self.assertNumQueries(1):
+            # Only the session, which has the marker issued on login
+            self.assertEqual(client.get(example_url).status_code, 200)
+
+        self.assertEqual(self._client(login=False).get(example_url).status_code, 403)
+
+    @override_settings(IP_BYPASS_MARKER='cookie')
+    def test_cookie(self):
+        client = self._client()
+        response = client.get(example_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.cookies['ip_restriction_bypass']['httponly'])
+
+        with self.assertNumQueries(1):
+            # Only the session, to check it is still logged in, and nothing written to it
+            self.assertEqual(client.get(example_url).status_code, 200)
+
+        # Bound to the session, so it stops working on logout
+        client.logout()
+        self.assertEqual(client.get(example_url).status_code, 403)
+
+    @override_settings(IP_BYPASS_MARKER='cookie')
+    def test_cookie_replayed_after_logout(self):
+        client = self._client()
+        self.assertEqual(client.get(example_url).status_code, 200)
+        cookies = {name: client.cookies[name].value for name in ('sessionid', 'ip_restriction_bypass')}
+        client.logout()
+
+        replay = self._client(login=False)
+        for name, value in cookies.items():
+            replay.cookies[name] = value
+        self.assertEqual(replay.get(example_url).status_code, 403)
+
+    @override_settings(IP_BYPASS_MARKER='cookie')
+    def test_forged_cookie(self):
+        client = self._client(login=False)
+        client.cookies['ip_restriction_bypass'] = 'forged:abc:def'
+        self.assertEqual(client.get(example_url).status_code, 403)
+
+    @override_settings(IP_BYPASS_MARKER='session', IP_BYPASS_MARKER_MAX_AGE=60)
+    def test_expired(self):
+        client = self._client()
+        marker = client.session['_ip_restriction_bypass']
+        with patch('django.core.signing.time.time', return_value=2000000000):
+            # The marker has expired, so the user is loaded, and a new marker issued
+            self.assertEqual(client.get(example_url).status_code, 200)
+        self.assertNotEqual(client.session['_ip_restriction_bypass'], marker)
+
+    @override_settings(IP_BYPASS_MARKER='session')
+    def test_other_user(self):
+        other = User.objects.create(username='other')
+        request = RequestFactory().get(example_url)
+        request.session = self.client.session
+        request.session['_auth_user_id'] = str(self.user.pk)
+        marker = BypassMarker('session')
+        marker.issue(request)
+        self.assertTrue(marker.is_valid(request))
+
+        request.session['_auth_user_id'] = str(other.pk)
+        self.assertFalse(marker.is_valid(request))
+
+    @override_settings(IP_BYPASS_MARKER='header')
+    def test_invalid_storage(self):
+        with self.assertRaises(ImproperlyConfigured):
+            IpWhitelister()
@@ -0,0 +1,89 @@
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.cache import DecisionCache
+
+
+class FakeTimer():
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDecisionCache(TestCase):
+
+    def test_hits_and_misses(self):
+        cache = DecisionCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', True)
+        self.assertTrue(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DecisionCache(2)
+        cache.set('a', True)
+        cache.set('b', False)
+        cache.get('a')
+        cache.set('c', True)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertTrue(cache.get('a'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_entries_expire(self):
+        timer = FakeTimer()
+        cache = DecisionCache(10, ttl=5, timer=timer)
+        cache.set('a', True)
+
+        timer.now = 4
+        self.assertTrue(cache.get('a'))
+
+        timer.now = 5
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_clear(self):
+        cache = DecisionCache(10)
+        cache.set('a', True)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+
+class TestWhitelisterDecisionCache(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_cache_disabled_by_default(self):
+        self.assertIsNone(IpWhitelister().decision_cache)
+
+    @override_settings(IP_DECISION_CACHE_SIZE=100, ALLOWED_IPS=['127.0.0.1'])
+    def test_decisions_are_cached_per_scope(self):
+        restrictor = IpWhitelister()
+        request = self.factory.get('/', REMOTE_ADDR='127.0.0.1')
+
+        self.assertFalse(restrictor.is_blocked_ip(request, 'site'))
+        self.assertFalse(restrictor.is_blocked_ip(request, 'site'))
+        self.assertTrue(restrictor.is_blocked_ip(request, 'admin'))
+
+        stats = restrictor.decision_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['size'], 2)
+
+    @override_settings(IP_DECISION_CACHE_SIZE=100, ALLOWED_IPS=['127.0.0.1'])
+    def test_cache_is_cleared_when_settings_change(self):
+        restrictor = IpWhitelister()
+        request = self.factory.get('/', REMOTE_ADDR='127.0.0.1')
+        self.assertFalse(restrictor.is_blocked_ip(request, 'site'))
+
+        with override_settings(ALLOWED_IPS=['127.0.0.2']):
+            self.assertEqual(len(restrictor.decision_cache), 0)
+            self.assertTrue(restrictor.is_blocked_ip(request, 'site'))
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import Mock, patch
+
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.checks import check_ip_lists
+from ip_restriction.policy import RateLimitedLog
+
+
+class TestSystemChecks(TestCase):
+
+    def _ids(self):
+        return [message.id for message in check_ip_lists(None)]
+
+    def test_valid(self):
+        self.assertEqual(self._ids(), [])
+
+    @override_settings(
+        ALLOWED_IPS=['10.0.0.1', '10.0.0.300'],
+        ALLOWED_IP_RANGES=['10.0.0.0/8', '10.0.0.1/8'],
+        DENIED_IPS=['nonsense'],
+        TRUSTED_PROXY_RANGES=['10.0.0.0/33'],
+        IP_VIEW_POLICIES={'api': {'ALLOWED_IPS': ['10.0.0.256']}},
+    )
+    def test_malformed_entries(self):
+        messages = check_ip_lists(None)
+        self.assertEqual([message.id for message in messages], ['ip_restriction.W001'] * 5)
+        self.assertIn("'10.0.0.300'", messages[0].msg)
+
+    def test_environment(self):
+        with patch.dict(os.environ, {'ALLOWED_IPS': '10.0.0.1,bad', 'MAX_FORWARDED_FOR_ENTRIES': 'lots'}):
+            self.assertEqual(self._ids(), ['ip_restriction.W001', 'ip_restriction.E003'])
+
+    @override_settings(IP_MATCHER_ENGINE='hash')
+    def test_unknown_engine(self):
+        self.assertEqual(self._ids(), ['ip_restriction.E001'])
+
+    @override_settings(IP_VIEW_POLICIES={'api': ['10.0.0.1']})
+    def test_malformed_view_policy(self):
+        self.assertEqual(self._ids(), ['ip_restriction.E002'])
+
+    def test_unreadable_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        with override_settings(
+            ALLOWED_IPS_FILE=os.path.join(tmp_dir, 'missing.txt'),
+            IP_POLICY_ARTIFACT=os.path.join(tmp_dir, 'missing.bin'),
+        ):
+            self.assertEqual(self._ids(), ['ip_restriction.W002'] * 2)
+
+    def test_files_are_not_parsed(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        ips_path = os.path.join(tmp_dir, 'allowed.txt')
+        with open(ips_path, 'w') as ips_file:
+            ips_file.write('10.0.0.1\n')
+        artifact_path = os.path.join(tmp_dir, 'policy.bin')
+        with open(artifact_path, 'wb') as artifact:
+            artifact.write(b'not a policy')
+
+        with override_settings(ALLOWED_IPS_FILE=ips_path, IP_POLICY_ARTIFACT=artifact_path):
+            with patch('ip_restriction.sources.read_ip_file') as read_ip_file, \
+                    patch('ip_restriction.artifact.load_artifact') as load_artifact:
+                # Only the artifact's header is read, which shows it isn't one
+                self.assertEqual(self._ids(), ['ip_restriction.W002'])
+            self.assertFalse(read_ip_file.called)
+            self.assertFalse(load_artifact.called)
+
+
+class TestMalformedClientIps(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    def test_denied_not_error(self):
+        restrictor = IpWhitelister()
+        with patch('ip_restriction.policy.malformed_ip_log') as mock_log:
+            with self.assertRaises(PermissionDenied):
+                restrictor.process_request(self.factory.get('/example', HTTP_X_FORWARDED_FOR='not-an-ip'))
+            self.assertTrue(mock_log.warning.called)
+
+            # A valid IP alongside is still checked
+            restrictor.process_request(self.factory.get('/example', HTTP_X_FORWARDED_FOR='not-an-ip, 10.0.0.1'))
+
+    @override_settings(DENIED_IPS=['10.0.0.1'])
+    def test_not_denied(self):
+        restrictor = IpWhitelister()
+        with patch('ip_restriction.policy.malformed_ip_log'):
+            self.assertIsNone(restrictor.process_request(self.factory.get('/example', HTTP_X_FORWARDED_FOR='garbage')))
+
+    def test_rate_limited_log(self):
+        logger = Mock()
+        now = [0]
+        log = RateLimitedLog(logger, interval=60, timer=lambda: now[0])
+
+        log.warning('first')
+        log.warning('second')
+        log.warning('third')
+        now[0] = 61
+        log.warning('fourth')
+
+        self.assertEqual([call[0][0] for call in logger.warning.call_args_list], [
+            'first', 'fourth (2 similar messages suppressed)',
+        ])
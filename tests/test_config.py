@@ -1,4 +1,6 @@
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
 
 from ip_restriction import IpWhitelister
 from .decorators import override_environment
@@ -16,6 +18,7 @@ class TestIPRestrictionConfig(TestCase):
         self.assertFalse(restrictor.RESTRICT_ADMIN_BY_IPS)
         self.assertEqual(restrictor.ALLOWED_ADMIN_IPS, [])
         self.assertEqual(restrictor.ALLOWED_ADMIN_IP_RANGES, [])
+        self.assertEqual(restrictor.IP_MATCHER_ENGINE, 'trie')
 
     @override_settings(
         RESTRICT_IPS=True,
@@ -74,3 +77,31 @@ class TestIPRestrictionConfig(TestCase):
             restrictor.ALLOWED_ADMIN_IP_RANGES,
             ['192.168.0.0/20']
         )
+
+    @override_settings(IP_MATCHER_ENGINE='interval')
+    def test_matcher_engine(self):
+        restrictor = IpWhitelister()
+        self.assertEqual(restrictor.IP_MATCHER_ENGINE, 'interval')
+
+    @override_settings(IP_MATCHER_ENGINE='linear')
+    def test_unknown_matcher_engine(self):
+        with self.assertRaises(ImproperlyConfigured):
+            IpWhitelister()
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    def test_reloaded_on_next_request(self):
+        restrictor = IpWhitelister()
+        request = RequestFactory().get('/example', REMOTE_ADDR='10.0.0.2')
+        with override_settings(ALLOWED_IPS=['10.0.0.2']):
+            self.assertIsNone(restrictor.process_request(request))
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(request)
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    def test_invalid_reload_keeps_current_config(self):
+        restrictor = IpWhitelister()
+        request = RequestFactory().get('/example', REMOTE_ADDR='10.0.0.2')
+        with override_settings(ALLOWED_IPS=['10.0.0.2'], IP_MATCHER_ENGINE='linear'):
+            with self.assertLogs('ip_restriction.middleware', 'ERROR'):
+                with self.assertRaises(PermissionDenied):
+                    restrictor.process_request(request)
@@ -0,0 +1,75 @@
+import os
+from unittest.mock import patch
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import Client, TestCase, override_settings
+from django.test.client import RequestFactory
+try:
+    from django.core.urlresolvers import reverse_lazy
+except ImportError:
+    from django.urls import reverse_lazy
+
+from ip_restriction import IpWhitelister
+
+
+@override_settings(
+    RESTRICT_IPS=True,
+    ALLOWED_IPS=['127.0.0.1'],
+    RESTRICT_ADMIN_BY_IPS=True,
+    IP_DENY_RESPONSE=True,
+)
+class TestDenyResponse(TestCase):
+
+    def _get(self, ip, url='/example'):
+        return Client(REMOTE_ADDR=ip).get(url)
+
+    def test_default_statuses(self):
+        response = self._get('127.0.0.2')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+
+        self.assertEqual(self._get('127.0.0.1', url=reverse_lazy('admin:login')).status_code, 404)
+        self.assertEqual(self._get('127.0.0.1').status_code, 200)
+
+    @override_settings(
+        IP_DENY_RESPONSE_STATUS=429,
+        IP_DENY_RESPONSE_BODY='Go away',
+        IP_DENY_RESPONSE_HEADERS={'Cache-Control': 'no-store', 'Content-Type': 'text/html'},
+    )
+    def test_configured(self):
+        response = self._get('127.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.content, b'Go away')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(response['Content-Type'], 'text/html')
+
+    @override_settings(IP_DENY_RESPONSE_STATUS=403, IP_DENY_RESPONSE_BODY='Your IP is blocked')
+    def test_unknown_urls_are_not_denials(self):
+        # Found while resolving the URL for the admin restriction, but not a denial, so Django's usual 404
+        response = self._get('127.0.0.1', url='/does-not-exist/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotEqual(response.content, b'Your IP is blocked')
+
+    @override_settings(RESTRICT_IPS=False, RESTRICT_ADMIN_BY_IPS=False, IP_VIEW_POLICIES={'api': {}})
+    def test_unknown_urls_with_only_view_policies(self):
+        with self.assertRaises(Http404):
+            IpWhitelister().process_request(RequestFactory().get('/does-not-exist/', REMOTE_ADDR='127.0.0.2'))
+
+    def test_headers_from_environment(self):
+        with patch.dict(os.environ, {'IP_DENY_RESPONSE_HEADERS': '{"Retry-After": "3600"}'}):
+            restrictor = IpWhitelister()
+        response = restrictor.process_request(RequestFactory().get('/example', REMOTE_ADDR='127.0.0.2'))
+        self.assertEqual(response['Retry-After'], '3600')
+
+    def test_a_new_response_each_time(self):
+        # Other middleware may change the response, so it mustn't be shared between requests
+        restrictor = IpWhitelister()
+        request = RequestFactory().get('/example', REMOTE_ADDR='127.0.0.2')
+        self.assertIsNot(restrictor.process_request(request), restrictor.process_request(request))
+
+    @override_settings(IP_DENY_RESPONSE=False)
+    def test_off_by_default(self):
+        with self.assertRaises(PermissionDenied):
+            IpWhitelister().process_request(RequestFactory().get('/example', REMOTE_ADDR='127.0.0.2'))
@@ -0,0 +1,129 @@
+from unittest.mock import Mock, patch
+
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.checks import check_ip_lists
+from ip_restriction.geoip import GeoIpLookup, parse_asn
+
+
+COUNTRIES = {
+    '81.2.69.142': {'country': {'iso_code': 'GB'}},
+    '2.125.160.216': {'registered_country': {'iso_code': 'GB'}},
+    '89.160.20.112': {'country': {'iso_code': 'SE'}},
+    '175.16.199.1': {'country': {'iso_code': 'CN'}},
+}
+
+ASNS = {
+    '81.2.69.142': {'autonomous_system_number': 20712},
+    '12.81.92.1': {'autonomous_system_number': 7018},
+}
+
+
+class FakeReader():
+    # Stands in for a maxminddb.Reader over a database of the given records
+    def __init__(self, records):
+        self.records = records
+        self.lookups = 0
+
+    def get(self, ip):
+        self.lookups += 1
+        if ip == 'nonsense':
+            raise ValueError('not an IP')
+        return self.records.get(ip)
+
+    def close(self):
+        pass
+
+
+def fake_maxminddb():
+    readers = {'country.mmdb': FakeReader(COUNTRIES), 'asn.mmdb': FakeReader(ASNS)}
+
+    def open_database(path, mode):
+        try:
+            return readers[path]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    return Mock(MODE_MMAP=1, open_database=Mock(side_effect=open_database))
+
+
+@patch('ip_restriction.geoip.maxminddb', new_callable=fake_maxminddb)
+class TestGeoIpLookup(TestCase):
+
+    def test_lookup(self, mock_maxminddb):
+        lookup = GeoIpLookup('country.mmdb', 'asn.mmdb')
+        self.assertEqual(lookup.lookup('81.2.69.142'), ('GB', 20712))
+        self.assertEqual(lookup.lookup('2.125.160.216'), ('GB', None))
+        self.assertEqual(lookup.lookup('12.81.92.1'), (None, 7018))
+        self.assertEqual(lookup.lookup('10.0.0.1'), (None, None))
+        self.assertEqual(lookup.lookup('nonsense'), (None, None))
+        mock_maxminddb.open_database.assert_any_call('country.mmdb', 1)
+
+    def test_cached(self, mock_maxminddb):
+        lookup = GeoIpLookup('country.mmdb', cache_size=10)
+        lookup.lookup('81.2.69.142')
+        lookup.lookup('81.2.69.142')
+        self.assertEqual(lookup._country_reader.lookups, 1)
+
+    def test_missing_database(self, mock_maxminddb):
+        with self.assertRaises(ImproperlyConfigured):
+            GeoIpLookup('missing.mmdb')
+
+    def test_parse_asn(self, mock_maxminddb):
+        self.assertEqual(parse_asn('AS2856'), 2856)
+        self.assertEqual(parse_asn('as2856'), 2856)
+        self.assertEqual(parse_asn(' 2856'), 2856)
+        self.assertEqual(parse_asn(2856), 2856)
+        with self.assertRaises(ValueError):
+            parse_asn('BT')
+
+    def test_maxminddb_not_installed(self, mock_maxminddb):
+        with patch('ip_restriction.geoip.maxminddb', None):
+            with self.assertRaises(ImproperlyConfigured):
+                GeoIpLookup('country.mmdb')
+
+
+@patch('ip_restriction.geoip.maxminddb', new_callable=fake_maxminddb)
+@override_settings(IP_COUNTRY_DATABASE='country.mmdb', IP_ASN_DATABASE='asn.mmdb')
+class TestGeoIpRules(TestCase):
+
+    def _allowed(self, ip, **settings):
+        with override_settings(**settings):
+            restrictor = IpWhitelister()
+            try:
+                restrictor.process_request(RequestFactory().get('/example', REMOTE_ADDR=ip))
+            except PermissionDenied:
+                return False
+            return True
+
+    def test_allowed_countries_and_asns(self, mock_maxminddb):
+        settings = {
+            'RESTRICT_IPS': True,
+            'ALLOWED_IPS': ['10.0.0.1'],
+            'ALLOWED_COUNTRIES': ['gb'],
+            'ALLOWED_ASNS': ['AS7018'],
+        }
+        self.assertTrue(self._allowed('10.0.0.1', **settings))
+        self.assertTrue(self._allowed('81.2.69.142', **settings))
+        self.assertTrue(self._allowed('2.125.160.216', **settings))
+        self.assertTrue(self._allowed('12.81.92.1', **settings))
+        self.assertFalse(self._allowed('89.160.20.112', **settings))
+
+    def test_denied_countries_and_asns(self, mock_maxminddb):
+        settings = {'DENIED_COUNTRIES': ['CN'], 'DENIED_ASNS': ['20712'], 'ALLOW_AUTHENTICATED': True}
+        self.assertFalse(self._allowed('175.16.199.1', **settings))
+        self.assertFalse(self._allowed('81.2.69.142', **settings))
+        self.assertTrue(self._allowed('89.160.20.112', **settings))
+
+    def test_invalid_asn(self, mock_maxminddb):
+        with self.assertRaises(ImproperlyConfigured):
+            self._allowed('10.0.0.1', ALLOWED_ASNS=['BT'])
+
+    def test_checks(self, mock_maxminddb):
+        with override_settings(IP_ASN_DATABASE='missing.mmdb', DENIED_ASNS=['BT']):
+            self.assertEqual(
+                [message.id for message in check_ip_lists(None)], ['ip_restriction.E004', 'ip_restriction.E005']
+            )
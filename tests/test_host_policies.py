@@ -0,0 +1,88 @@
+import os
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.checks import check_ip_lists
+from ip_restriction.wrappers import IpRestrictionWSGI
+
+
+HOST_POLICIES = {
+    'intranet.example.com': {'ALLOWED_IPS': ['10.0.0.1']},
+    '.example.com': {'ALLOWED_IP_RANGES': ['10.0.0.0/8']},
+    '.partner.example.com': {'ALLOWED_IPS': ['192.168.0.1']},
+}
+
+
+@override_settings(IP_HOST_POLICIES=HOST_POLICIES, ALLOWED_HOSTS=['*'])
+class TestHostPolicies(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _allowed(self, host, ip, restrictor=None):
+        restrictor = restrictor or IpWhitelister()
+        try:
+            restrictor.process_request(self.factory.get('/example', REMOTE_ADDR=ip, HTTP_HOST=host))
+        except PermissionDenied:
+            return False
+        return True
+
+    def test_exact_host(self):
+        self.assertTrue(self._allowed('intranet.example.com', '10.0.0.1'))
+        self.assertTrue(self._allowed('INTRANET.example.com:8000', '10.0.0.1'))
+        self.assertFalse(self._allowed('intranet.example.com', '10.0.0.2'))
+
+    def test_wildcard(self):
+        self.assertTrue(self._allowed('example.com', '10.0.0.2'))
+        self.assertTrue(self._allowed('www.example.com', '10.0.0.2'))
+        self.assertFalse(self._allowed('www.example.com', '192.168.0.1'))
+
+    def test_longest_suffix_applies(self):
+        self.assertTrue(self._allowed('a.partner.example.com', '192.168.0.1'))
+        self.assertFalse(self._allowed('a.partner.example.com', '10.0.0.2'))
+
+    def test_other_hosts_unrestricted(self):
+        self.assertTrue(self._allowed('example.org', '1.1.1.1'))
+        self.assertTrue(self._allowed('notexample.com', '1.1.1.1'))
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['1.1.1.1'])
+    def test_replaces_site_allowlist(self):
+        self.assertTrue(self._allowed('example.org', '1.1.1.1'))
+        self.assertFalse(self._allowed('example.org', '10.0.0.2'))
+        self.assertTrue(self._allowed('www.example.com', '10.0.0.2'))
+        self.assertFalse(self._allowed('www.example.com', '1.1.1.1'))
+
+    @override_settings(USE_X_FORWARDED_HOST=True)
+    def test_forwarded_host(self):
+        request = self.factory.get(
+            '/example', REMOTE_ADDR='10.0.0.2', HTTP_HOST='proxy', HTTP_X_FORWARDED_HOST='intranet.example.com',
+        )
+        with self.assertRaises(PermissionDenied):
+            IpWhitelister().process_request(request)
+
+    def test_wsgi_wrapper(self):
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        application = IpRestrictionWSGI(lambda environ, start_response: start_response('200 OK', []) or [])
+        for host in ('intranet.example.com', 'example.org'):
+            application({'REMOTE_ADDR': '10.0.0.2', 'HTTP_HOST': host}, start_response)
+        self.assertEqual(responses, ['403 Forbidden', '200 OK'])
+
+    @override_settings(IP_HOST_POLICIES={})
+    def test_environment(self):
+        with patch.dict(os.environ, {'IP_HOST_POLICIES': '{"example.com": {"ALLOWED_IPS": ["10.0.0.1"]}}'}):
+            restrictor = IpWhitelister()
+        self.assertFalse(self._allowed('example.com', '10.0.0.2', restrictor))
+
+    @override_settings(IP_HOST_POLICIES={'example.com': {'DENIED_IPS': ['10.0.0.1']}})
+    def test_malformed(self):
+        with self.assertRaises(ImproperlyConfigured):
+            IpWhitelister()
+        self.assertEqual([message.id for message in check_ip_lists(None)], ['ip_restriction.E002'])
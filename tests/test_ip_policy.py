@@ -0,0 +1,115 @@
+import os
+import random
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpPolicy, IpWhitelister, get_policy, reload_policy
+from ip_restriction.wrappers import IpGate
+
+
+@override_settings(
+    ALLOWED_IPS=['10.0.0.1', '2001:db8::1'],
+    ALLOWED_IP_RANGES=['192.168.0.0/24'],
+    ALLOWED_ADMIN_IPS=['10.0.0.2'],
+    DENIED_IPS=['192.168.0.66'],
+    IP_VIEW_POLICIES={'api': {'ALLOWED_IPS': ['10.0.0.3']}},
+    IP_HOST_POLICIES={'.example.com': {'ALLOWED_IPS': ['10.0.0.4']}},
+)
+class TestIpPolicy(TestCase):
+
+    def test_is_allowed(self):
+        policy = IpPolicy()
+        self.assertTrue(policy.is_allowed('10.0.0.1'))
+        self.assertTrue(policy.is_allowed('::ffff:10.0.0.1'))
+        self.assertTrue(policy.is_allowed('192.168.0.1'))
+        self.assertTrue(policy.is_allowed('2001:db8::1'))
+        self.assertFalse(policy.is_allowed('10.0.0.2'))
+        self.assertFalse(policy.is_allowed('192.168.0.66'))
+        self.assertFalse(policy.is_allowed('not-an-ip'))
+
+    def test_scopes(self):
+        policy = IpPolicy()
+        self.assertTrue(policy.is_allowed('10.0.0.2', scope='admin'))
+        self.assertTrue(policy.is_allowed('10.0.0.3', scope='view:api'))
+        self.assertTrue(policy.is_allowed('10.0.0.4', scope='host:.example.com'))
+        self.assertFalse(policy.is_allowed('10.0.0.1', scope='admin'))
+        with self.assertRaises(ValueError):
+            policy.is_allowed('10.0.0.1', scope='deny')
+        with self.assertRaises(ValueError):
+            policy.check_many(['10.0.0.1'], scope='view:missing')
+
+    def test_check_many(self):
+        ips = ['10.0.0.1', '192.168.0.66', 'not-an-ip', '2001:db8::1', '10.0.0.2', '192.168.0.5', '10.0.0.1', None]
+        self.assertEqual(IpPolicy().check_many(ips), [True, False, False, True, False, True, True, False])
+        self.assertEqual(IpPolicy().check_many(iter([])), [])
+
+    def test_check_many_matches_is_allowed(self):
+        rng = random.Random(0)
+        ips = ['192.168.{}.{}'.format(rng.randint(0, 1), rng.randint(0, 255)) for _ in range(500)]
+        ips += ['2001:db8::{:x}'.format(rng.randint(0, 3)) for _ in range(50)]
+        for engine in ('trie', 'interval'):
+            policy = IpPolicy(IP_MATCHER_ENGINE=engine)
+            self.assertEqual(policy.check_many(ips), [policy.is_allowed(ip) for ip in ips])
+
+    def test_overrides(self):
+        policy = IpPolicy(ALLOWED_IPS=['10.0.0.5'], DENIED_IPS=[])
+        self.assertTrue(policy.is_allowed('10.0.0.5'))
+        self.assertFalse(policy.is_allowed('10.0.0.1'))
+        self.assertTrue(policy.is_allowed('192.168.0.66'))
+
+        with self.assertRaises(TypeError):
+            IpPolicy(ALLOWED_IP=['10.0.0.5'])
+        with self.assertRaises(ImproperlyConfigured):
+            IpPolicy(IP_MATCHER_ENGINE='hash')
+
+    def test_environment(self):
+        with patch.dict(os.environ, {'ALLOWED_IPS': '10.0.0.6'}):
+            self.assertTrue(IpPolicy().is_allowed('10.0.0.6'))
+
+
+class TestSharedPolicy(TestCase):
+
+    @override_settings(ALLOWED_IPS=['10.0.0.1'])
+    def test_shared(self):
+        policy = get_policy()
+        self.assertIs(get_policy(), policy)
+        self.assertIs(IpWhitelister().ip_policy, policy)
+        self.assertIs(IpGate().whitelister.ip_policy, policy)
+
+        with override_settings(ALLOWED_IPS=['10.0.0.2']):
+            self.assertIsNot(get_policy(), policy)
+            self.assertTrue(get_policy().is_allowed('10.0.0.2'))
+
+    def test_reload(self):
+        allowed_ips = ['10.0.0.1']
+        with override_settings(ALLOWED_IPS=allowed_ips):
+            policy = get_policy()
+            allowed_ips.append('10.0.0.2')
+            # The configuration isn't read again until the policy is reloaded
+            self.assertIs(get_policy(), policy)
+            self.assertIs(reload_policy(), get_policy())
+            self.assertIsNot(get_policy(), policy)
+            self.assertTrue(get_policy().is_allowed('10.0.0.2'))
+
+            # A new middleware reads the configuration again
+            allowed_ips.append('10.0.0.3')
+            self.assertTrue(IpWhitelister().ip_policy.is_allowed('10.0.0.3'))
+
+    def test_environment(self):
+        policy = get_policy()
+        self.addCleanup(reload_policy)
+        with patch.dict(os.environ, {'ALLOWED_IPS': '10.0.0.7'}):
+            self.assertIs(get_policy(), policy)
+            self.assertTrue(reload_policy().is_allowed('10.0.0.7'))
+
+    def test_environment_read_with_middleware_flags(self):
+        self.addCleanup(reload_policy)
+        with patch.dict(os.environ, {'RESTRICT_IPS': 'true', 'ALLOWED_IPS': '10.0.0.1'}):
+            self.assertEqual(IpWhitelister().ALLOWED_IPS, ['10.0.0.1'])
+        with patch.dict(os.environ, {'RESTRICT_IPS': 'true', 'ALLOWED_IPS': '10.0.0.2'}):
+            restrictor = IpWhitelister()
+        self.assertEqual(restrictor.ALLOWED_IPS, ['10.0.0.2'])
+        self.assertFalse(restrictor.is_blocked_ip(RequestFactory().get('/', REMOTE_ADDR='10.0.0.2')))
@@ -0,0 +1,135 @@
+import ipaddress
+
+from django.test import TestCase
+
+from ip_restriction.matchers import IntervalMatcher, PrefixMatcher, WideArray, merge_intervals
+
+
+class MatcherTests():
+    """
+    Behaviour common to all the matcher engines
+    """
+
+    matcher_class = None
+
+    def _matcher(self, *ranges):
+        return self.matcher_class(ipaddress.ip_network(ip_range) for ip_range in ranges)
+
+    def test_empty_matcher(self):
+        matcher = self._matcher()
+        self.assertFalse('127.0.0.1' in matcher)
+        self.assertFalse('::1' in matcher)
+        self.assertEqual(len(matcher), 0)
+
+    def test_ipv4_ranges(self):
+        matcher = self._matcher('192.168.0.0/31', '10.0.0.0/8')
+        self.assertTrue('192.168.0.0' in matcher)
+        self.assertTrue('192.168.0.1' in matcher)
+        self.assertFalse('192.168.0.2' in matcher)
+        self.assertTrue('10.255.255.255' in matcher)
+        self.assertFalse('11.0.0.0' in matcher)
+        self.assertFalse('9.255.255.255' in matcher)
+
+    def test_ipv6_ranges(self):
+        matcher = self._matcher('2001:db8::/32', '::1/128')
+        self.assertTrue('2001:db8::1' in matcher)
+        self.assertTrue('::1' in matcher)
+        self.assertFalse('::2' in matcher)
+        self.assertFalse('2001:db9::1' in matcher)
+
+    def test_match_many(self):
+        matcher = self._matcher('192.168.0.0/31', '10.0.0.0/8', '2001:db8::/32')
+        ips = ['9.255.255.255', '10.0.0.1', '192.168.0.1', '192.168.0.2']
+        values = sorted(int(ipaddress.ip_address(ip)) for ip in ips)
+        self.assertEqual(matcher.match_many(4, values), [False, True, True, False])
+        self.assertEqual(matcher.match_many(6, [int(ipaddress.ip_address('2001:db8::1'))]), [True])
+        self.assertEqual(matcher.match_many(4, []), [])
+
+    def test_families_are_separate(self):
+        # 0.0.0.0/0 should not match any IPv6 address, and vice versa
+        matcher = self._matcher('0.0.0.0/0')
+        self.assertTrue('8.8.8.8' in matcher)
+        self.assertTrue('255.255.255.255' in matcher)
+        self.assertFalse('::' in matcher)
+
+        matcher = self._matcher('::/0')
+        self.assertTrue('::' in matcher)
+        self.assertTrue('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff' in matcher)
+        self.assertFalse('0.0.0.0' in matcher)
+
+    def test_ipv4_mapped_addresses(self):
+        # IPv4-mapped IPv6 addresses and ranges are the same as the IPv4 ones they map
+        matcher = self._matcher('10.0.0.0/8', '::ffff:192.168.0.0/120')
+        self.assertTrue('::ffff:10.0.0.1' in matcher)
+        self.assertTrue('192.168.0.1' in matcher)
+        self.assertFalse('::ffff:11.0.0.1' in matcher)
+
+    def test_many_ranges(self):
+        matcher = self._matcher(*['10.{}.{}.0/24'.format(i // 256, i % 256) for i in range(5000)])
+        self.assertTrue('10.19.135.7' in matcher)
+        self.assertFalse('10.19.136.7' in matcher)
+
+
+class TestPrefixMatcher(MatcherTests, TestCase):
+
+    matcher_class = PrefixMatcher
+
+    def test_longest_prefix(self):
+        matcher = self._matcher('10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24')
+        self.assertEqual(matcher.longest_prefix(4, int(ipaddress.ip_address('10.1.2.3'))), 24)
+        self.assertEqual(matcher.longest_prefix(4, int(ipaddress.ip_address('10.1.3.3'))), 16)
+        self.assertEqual(matcher.longest_prefix(4, int(ipaddress.ip_address('10.2.3.3'))), 8)
+        self.assertIsNone(matcher.longest_prefix(4, int(ipaddress.ip_address('11.1.2.3'))))
+
+    def test_len(self):
+        matcher = self._matcher('10.0.0.0/8', '10.1.0.0/16', '::1/128')
+        self.assertEqual(len(matcher), 3)
+
+
+class TestIntervalMatcher(MatcherTests, TestCase):
+
+    matcher_class = IntervalMatcher
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        # 10.0.0.0/24 and 10.0.1.0/24 are adjacent, 10.0.0.128/25 is inside the first
+        matcher = self._matcher('10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '10.0.3.0/24')
+        self.assertEqual(len(matcher), 2)
+        self.assertTrue('10.0.1.255' in matcher)
+        self.assertFalse('10.0.2.0' in matcher)
+        self.assertTrue('10.0.3.0' in matcher)
+
+
+class TestIntervalHelpers(TestCase):
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([(5, 9), (0, 2), (3, 4), (8, 20), (22, 22)]), [[0, 20], [22, 22]])
+
+    def test_wide_array(self):
+        values = [0, 1, 2 ** 64, 2 ** 128 - 1]
+        wide = WideArray.from_ints(values)
+        self.assertEqual(len(wide), 4)
+        self.assertEqual([wide[i] for i in range(len(wide))], values)
+        self.assertEqual(wide[-1], 2 ** 128 - 1)
+        with self.assertRaises(IndexError):
+            wide[4]
+
+
+class TestFromIntervals(TestCase):
+
+    def test_interval_matcher(self):
+        matcher = IntervalMatcher.from_intervals([(4, 10, 20), (4, 21, 30), (4, 40, 40), (6, 5, 5)])
+        self.assertEqual(len(matcher), 3)
+        self.assertTrue(matcher.match(4, 25))
+        self.assertFalse(matcher.match(4, 31))
+        self.assertTrue(matcher.match(4, 40))
+        self.assertTrue(matcher.match(6, 5))
+        self.assertFalse(matcher.match(6, 40))
+
+    def test_prefix_matcher(self):
+        matcher = PrefixMatcher.from_intervals([(4, 0x0a000000, 0x0affffff), (6, 1, 1)])
+        self.assertTrue('10.1.2.3' in matcher)
+        self.assertTrue('::1' in matcher)
+
+    def test_prefix_matcher_rejects_unaligned_intervals(self):
+        with self.assertRaises(ValueError):
+            PrefixMatcher.from_intervals([(4, 10, 20)])
@@ -0,0 +1,237 @@
+import threading
+from unittest.mock import patch
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.metrics import DecisionMetrics, MetricsRegistry, MetricsSink, StatsdSink, registry
+from ip_restriction.views import metrics as metrics_view
+
+
+calls = []
+
+
+def record_call(*args):
+    calls.append(args)
+
+
+class ListSink(MetricsSink):
+    # Example custom sink, keeping everything it is sent
+    events = []
+
+    def increment(self, name, labels=(), value=1):
+        self.events.append(('increment', name, labels, value))
+
+    def observe(self, name, labels, value, sample_rate=1.0):
+        self.events.append(('observe', name, labels, sample_rate))
+
+
+class BrokenUser():
+    # Stands in for request.user when loading the user fails, e.g. the database is down
+    @property
+    def is_authenticated(self):
+        raise RuntimeError('database is down')
+
+
+class TestMetricsRegistry(TestCase):
+
+    def test_counters_and_histograms(self):
+        metrics = MetricsRegistry(buckets=(0.001, 0.01))
+        metrics.increment('decisions', (('outcome', 'allow'),))
+        metrics.increment('decisions', (('outcome', 'allow'),), 2)
+        metrics.observe('check_seconds', (), 0.0005)
+        metrics.observe('check_seconds', (), 0.005)
+        metrics.observe('check_seconds', (), 1)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {('decisions', (('outcome', 'allow'),)): 3})
+        counts, total = snapshot['histograms'][('check_seconds', ())]
+        self.assertEqual(counts, [1, 1, 1])
+        self.assertAlmostEqual(total, 1.0055)
+
+    def test_threads_are_totalled(self):
+        metrics = MetricsRegistry()
+
+        def count():
+            for _ in range(1000):
+                metrics.increment('decisions')
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(metrics.snapshot()['counters'], {('decisions', ()): 4000})
+
+    def test_finished_threads_are_folded(self):
+        metrics = MetricsRegistry(buckets=(0.001,))
+
+        def record():
+            metrics.increment('decisions')
+            metrics.observe('check_seconds', (), 0.0005)
+
+        # As under a server that starts a thread per request
+        for _ in range(100):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        record()
+
+        self.assertEqual(len(metrics._shards), 1)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {('decisions', ()): 101})
+        self.assertEqual(snapshot['histograms'][('check_seconds', ())][0], [101, 0])
+
+    def test_render_prometheus(self):
+        metrics = MetricsRegistry(buckets=(0.001,))
+        metrics.increment('decisions', (('outcome', 'deny'), ('rule', 'site_ip')))
+        metrics.observe('check_seconds', (('outcome', 'deny'),), 0.0005)
+
+        self.assertEqual(metrics.render_prometheus(), '\n'.join([
+            '# TYPE ip_restriction_decisions_total counter',
+            'ip_restriction_decisions_total{outcome="deny",rule="site_ip"} 1',
+            '# TYPE ip_restriction_check_seconds histogram',
+            'ip_restriction_check_seconds_bucket{outcome="deny",le="0.001"} 1',
+            'ip_restriction_check_seconds_bucket{outcome="deny",le="+Inf"} 1',
+            'ip_restriction_check_seconds_sum{outcome="deny"} 0.0005',
+            'ip_restriction_check_seconds_count{outcome="deny"} 1',
+        ]) + '\n')
+
+    def test_sampling(self):
+        sink = MetricsRegistry()
+        metrics = DecisionMetrics([sink], sample_rate=0.5)
+
+        with patch('ip_restriction.metrics.random.random', return_value=0.7):
+            self.assertIsNone(metrics.start())
+        with patch('ip_restriction.metrics.random.random', return_value=0.2):
+            self.assertIsNotNone(metrics.start())
+
+
+class TestMiddlewareMetrics(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        registry.reset()
+        ListSink.events = []
+        del calls[:]
+
+    def _counters(self):
+        return {labels: value for (name, labels), value in registry.snapshot()['counters'].items()}
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'], ALLOW_ADMIN=True, IP_METRICS=True)
+    def test_decisions_are_counted_by_rule(self):
+        restrictor = IpWhitelister()
+
+        restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.0.0.1'))
+        restrictor.process_request(self.factory.get('/admin/', REMOTE_ADDR='10.0.0.2'))
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.0.0.2'))
+
+        self.assertEqual(self._counters(), {
+            (('outcome', 'allow'), ('rule', 'site_ip'), ('matcher', 'exact')): 1,
+            (('outcome', 'allow'), ('rule', 'admin_bypass')): 1,
+            (('outcome', 'deny'), ('rule', 'site_ip')): 1,
+        })
+        counts, _ = registry.snapshot()['histograms'][('check_seconds', (('outcome', 'deny'),))]
+        self.assertEqual(sum(counts), 1)
+
+    @override_settings(
+        RESTRICT_ADMIN_BY_IPS=True,
+        ALLOWED_ADMIN_IPS=['10.0.0.1'],
+        ALLOWED_ADMIN_IP_RANGES=['10.1.0.0/16'],
+        IP_METRICS=True,
+    )
+    def test_allows_are_counted_by_matcher(self):
+        restrictor = IpWhitelister()
+
+        restrictor.process_request(self.factory.get('/admin/', REMOTE_ADDR='10.0.0.1'))
+        restrictor.process_request(self.factory.get('/admin/', REMOTE_ADDR='10.1.0.1'))
+        # No restriction applies to the rest of the site
+        restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.2.0.1'))
+
+        self.assertEqual(self._counters(), {
+            (('outcome', 'allow'), ('rule', 'admin_ip'), ('matcher', 'exact')): 1,
+            (('outcome', 'allow'), ('rule', 'admin_ip'), ('matcher', 'range')): 1,
+            (('outcome', 'allow'), ('rule', 'none')): 1,
+        })
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'], ALLOW_AUTHENTICATED=True, IP_METRICS=True)
+    def test_errors_are_not_counted_as_denials(self):
+        restrictor = IpWhitelister()
+        request = self.factory.get('/example', REMOTE_ADDR='10.0.0.2')
+        request.user = BrokenUser()
+        with self.assertRaises(RuntimeError):
+            restrictor.process_request(request)
+
+        self.assertEqual(self._counters(), {})
+
+    @override_settings(RESTRICT_ADMIN_BY_IPS=True, IP_METRICS=True)
+    def test_unknown_urls_are_not_counted_as_denials(self):
+        restrictor = IpWhitelister()
+        with self.assertRaises(Http404):
+            restrictor.process_request(self.factory.get('/does-not-exist/', REMOTE_ADDR='10.0.0.1'))
+
+        self.assertEqual(self._counters(), {})
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    def test_off_by_default(self):
+        restrictor = IpWhitelister()
+        restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.0.0.1'))
+
+        self.assertIsNone(restrictor.metrics)
+        self.assertEqual(self._counters(), {})
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        IP_METRICS=True,
+        IP_METRICS_SAMPLE_RATE=0.0,
+        IP_METRICS_SINKS=['tests.test_metrics.ListSink', 'ip_restriction.metrics.CallbackSink'],
+        IP_METRICS_CALLBACK='tests.test_metrics.record_call',
+    )
+    def test_sinks(self):
+        restrictor = IpWhitelister()
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.0.0.1'))
+
+        labels = (('outcome', 'deny'), ('rule', 'site_ip'))
+        # Nothing is timed with a sample rate of 0, but the decisions are still counted
+        self.assertEqual(ListSink.events, [('increment', 'decisions', labels, 1)])
+        self.assertEqual(calls, [('increment', 'decisions', labels, 1)])
+
+    @override_settings(RESTRICT_IPS=True, IP_METRICS=True)
+    def test_view(self):
+        restrictor = IpWhitelister()
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(self.factory.get('/example', REMOTE_ADDR='10.0.0.1'))
+
+        response = metrics_view(self.factory.get('/metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'ip_restriction_decisions_total{outcome="deny",rule="site_ip"} 1', response.content
+        )
+
+
+class TestStatsdSink(TestCase):
+
+    @override_settings(IP_METRICS_STATSD_PREFIX='myapp')
+    def test_lines(self):
+        sink = StatsdSink(IpWhitelister())
+        with patch.object(sink, 'socket') as mock_socket:
+            sink.increment('decisions', (('outcome', 'deny'), ('rule', 'site_ip')))
+            sink.observe('check_seconds', (('outcome', 'deny'),), 0.0000125, 0.1)
+
+        self.assertEqual([call[0][0] for call in mock_socket.sendto.call_args_list], [
+            b'myapp.decisions.deny.site_ip:1|c',
+            b'myapp.check_seconds.deny:0.012500|ms|@0.1',
+        ])
+        self.assertEqual(mock_socket.sendto.call_args[0][1], ('localhost', 8125))
+
+    def test_send_failure_is_ignored(self):
+        sink = StatsdSink(IpWhitelister())
+        with patch.object(sink, 'socket') as mock_socket:
+            mock_socket.sendto.side_effect = OSError('unreachable')
+            sink.increment('decisions')
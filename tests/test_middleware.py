@@ -129,7 +129,25 @@ class TestIPRestriction(TestCase):
         code = self._get_response_code_for_header('192.168.0.1, 127.0.0.1')
         self.assertEqual(code, 200)
 
-    @patch('ip_restriction.IpWhitelister.logger')
+    @override_settings(
+        RESTRICT_IPS=True,
+        IP_MATCHER_ENGINE='interval',
+        ALLOWED_IPS=['127.0.0.1'],
+        ALLOWED_IP_RANGES=['192.168.0.0/31', '192.168.0.2/31']
+    )
+    def test_interval_matcher_engine(self):
+        # The interval engine merges ALLOWED_IPS and ALLOWED_IP_RANGES into one index, check that it
+        # gives the same answers as the default engine
+        for ip in ['127.0.0.1', '192.168.0.0', '192.168.0.3']:
+            self.assertEqual(self._get_response_code_for_ip(ip), 200)
+
+        for ip in ['127.0.0.2', '192.168.0.4']:
+            self.assertEqual(self._get_response_code_for_ip(ip), 403)
+
+        code = self._get_response_code_for_header('127.0.0.2, 192.168.0.1')
+        self.assertEqual(code, 200)
+
+    @patch('ip_restriction.IpPolicy.logger')
     @override_settings(RESTRICT_IPS=True, ALLOWED_IP_RANGES=['127.0.0.1/30'])
     def test_invalid_network_range_logging(self, mock_logger):
         # Supply a 'broken' format of CIDR ip range, check that the request is forbidden
@@ -189,3 +207,77 @@ class TestIPRestriction(TestCase):
             url=admin_url
         )
         self.assertEqual(response_code, 404)
+
+    @patch('ip_restriction.middleware.resolve')
+    def test_no_url_resolution_when_unrestricted(self, mock_resolve):
+        # With no restrictions on, the middleware should not resolve the URL
+        resp = self.client.get(example_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(mock_resolve.called)
+
+    @patch('ip_restriction.middleware.resolve')
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['127.0.0.1'])
+    def test_no_url_resolution_without_admin_settings(self, mock_resolve):
+        # Only ALLOW_ADMIN and RESTRICT_ADMIN_BY_IPS need to know if this is an admin URL
+        code = self._get_response_code_for_ip('127.0.0.1')
+        self.assertEqual(code, 200)
+        code = self._get_response_code_for_ip('127.0.0.2')
+        self.assertEqual(code, 403)
+        self.assertFalse(mock_resolve.called)
+
+    @patch('ip_restriction.middleware.resolve')
+    @override_settings(
+        RESTRICT_ADMIN_BY_IPS=True,
+        ALLOWED_ADMIN_IPS=['127.0.0.1'],
+        ADMIN_URL_PREFIX='/admin/')
+    def test_admin_url_prefix(self, mock_resolve):
+        admin_url = reverse_lazy('admin:login')
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.1', url=admin_url), 200)
+        self.assertEqual(self._get_response_code_for_ip('1.1.1.1', url=admin_url), 404)
+        self.assertEqual(self._get_response_code_for_ip('1.1.1.1'), 200)
+        self.assertFalse(mock_resolve.called)
+
+    @override_settings(
+        RESTRICT_ADMIN_BY_IPS=True,
+        ALLOWED_ADMIN_IPS=['127.0.0.1'],
+        ADMIN_RESOLVE_CACHE_SIZE=10)
+    def test_admin_resolve_cache(self):
+        admin_url = reverse_lazy('admin:login')
+        client = Client(REMOTE_ADDR='1.1.1.1')
+        self.assertEqual(client.get(admin_url).status_code, 404)
+
+        with patch('ip_restriction.middleware.resolve') as mock_resolve:
+            self.assertEqual(client.get(admin_url).status_code, 404)
+            self.assertEqual(client.get(example_url).status_code, 200)
+            # Only the example URL needed resolving, the admin URL was in the cache
+            self.assertEqual(mock_resolve.call_count, 1)
+
+    @override_settings(DENIED_IPS=['127.0.0.2'], DENIED_IP_RANGES=['192.168.0.0/24'])
+    def test_denied_ips(self):
+        # Without RESTRICT_IPS, only the denied IPs are blocked
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.1'), 200)
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.2'), 403)
+        self.assertEqual(self._get_response_code_for_ip('192.168.0.200'), 403)
+
+        # Any denied IP in the header blocks the request
+        self.assertEqual(self._get_response_code_for_header('127.0.0.1, 192.168.0.1'), 403)
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        ALLOW_AUTHENTICATED=True,
+        ALLOW_ADMIN=True,
+        ALLOWED_IP_RANGES=['127.0.0.0/24'],
+        DENIED_IPS=['127.0.0.2'])
+    def test_denied_ips_override_allowed_and_exemptions(self):
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.1'), 200)
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.2'), 403)
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.2', login=True), 403)
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.2', url=reverse_lazy('admin:login')), 403)
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['127.0.0.1', '::ffff:127.0.0.2'], DENIED_IPS=['127.0.0.3'])
+    def test_ipv4_mapped_addresses(self):
+        # IPv4 addresses are matched the same however they're written, in the settings or by the client
+        self.assertEqual(self._get_response_code_for_ip('::ffff:127.0.0.1'), 200)
+        self.assertEqual(self._get_response_code_for_ip('0:0:0:0:0:ffff:7f00:1'), 200)
+        self.assertEqual(self._get_response_code_for_ip('127.0.0.2'), 200)
+        self.assertEqual(self._get_response_code_for_header('::ffff:127.0.0.3, 127.0.0.1'), 403)
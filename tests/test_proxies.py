@@ -0,0 +1,62 @@
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+
+
+class TestClientIpList(TestCase):
+
+    def _client_ips(self, x_forwarded_for=None, remote_addr='10.0.0.1'):
+        meta = {'REMOTE_ADDR': remote_addr}
+        if x_forwarded_for is not None:
+            meta['HTTP_X_FORWARDED_FOR'] = x_forwarded_for
+        request = RequestFactory().get('/', **meta)
+        return IpWhitelister().get_client_ip_list(request)
+
+    def test_no_header(self):
+        self.assertEqual(self._client_ips(), ['10.0.0.1'])
+
+    def test_all_entries_without_trusted_proxies(self):
+        self.assertEqual(self._client_ips('1.1.1.1, 2.2.2.2'), ['1.1.1.1', '2.2.2.2'])
+
+    @override_settings(MAX_FORWARDED_FOR_ENTRIES=3)
+    def test_entries_are_capped_from_the_right(self):
+        header = ', '.join('1.1.1.{}'.format(i) for i in range(1000))
+        self.assertEqual(self._client_ips(header), ['1.1.1.997', '1.1.1.998', '1.1.1.999'])
+
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_trusted_proxy_count(self):
+        # One proxy appends the address it saw to the header, so that's the client
+        self.assertEqual(self._client_ips('6.6.6.6, 1.1.1.1'), ['1.1.1.1'])
+        self.assertEqual(self._client_ips('1.1.1.1'), ['1.1.1.1'])
+        self.assertEqual(self._client_ips(), ['10.0.0.1'])
+
+    @override_settings(TRUSTED_PROXY_COUNT=2)
+    def test_trusted_proxy_count_with_too_few_entries(self):
+        self.assertEqual(self._client_ips('1.1.1.1'), ['1.1.1.1'])
+
+    @override_settings(TRUSTED_PROXY_RANGES=['10.0.0.0/8'])
+    def test_trusted_proxy_ranges(self):
+        self.assertEqual(self._client_ips('6.6.6.6, 1.1.1.1, 10.0.0.2'), ['1.1.1.1'])
+        self.assertEqual(self._client_ips('10.0.0.3, 10.0.0.2'), ['10.0.0.3'])
+
+        # A client connecting directly isn't a trusted proxy, so its header is ignored
+        self.assertEqual(self._client_ips('1.1.1.1', remote_addr='6.6.6.6'), ['6.6.6.6'])
+
+    @override_settings(TRUSTED_PROXY_COUNT=1, TRUSTED_PROXY_RANGES=['10.0.0.0/8'])
+    def test_trusted_proxy_count_and_ranges(self):
+        # The counted proxy (REMOTE_ADDR) vouches for the last entry, which is in the trusted ranges
+        self.assertEqual(self._client_ips('6.6.6.6, 1.1.1.1, 10.0.0.2', remote_addr='2.2.2.2'), ['1.1.1.1'])
+        self.assertEqual(self._client_ips('6.6.6.6, 1.1.1.1, 2.2.2.2'), ['2.2.2.2'])
+
+
+class TestTrustedProxyRestriction(TestCase):
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['1.1.1.1'], TRUSTED_PROXY_COUNT=1)
+    def test_forged_entries_are_ignored(self):
+        # The client prepends an allowed IP, but the proxy appends the real one
+        resp = self.client.get('/example', HTTP_X_FORWARDED_FOR='1.1.1.1, 6.6.6.6')
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.get('/example', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.1.1.1')
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,143 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from ip_restriction.addresses import parse_address, parse_network
+from ip_restriction.artifact import write_artifact
+from ip_restriction.matchers import IntervalMatcher
+from ip_restriction.replay import BatchEvaluator, TopCounter, numpy
+
+
+LOG_LINES = [
+    '10.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET / HTTP/1.1" 200 512 "-" "curl"',
+    '10.0.0.2 - - [17/Oct/2026:10:00:01 +0000] "GET / HTTP/1.1" 200 512 "-" "curl"',
+    '192.168.0.1 - - [17/Oct/2026:10:00:02 +0000] "GET / HTTP/1.1" 200 512 "-" "curl"',
+    '192.168.0.1 - - [17/Oct/2026:10:00:03 +0000] "GET / HTTP/1.1" 200 512 "-" "curl"',
+    '2001:db8::1 - - [17/Oct/2026:10:00:04 +0000] "GET / HTTP/1.1" 200 512 "-" "curl"',
+    'garbage',
+]
+
+
+class TestBatchEvaluator(TestCase):
+
+    def _matcher(self, *networks):
+        return IntervalMatcher.from_intervals(parse_network(network) for network in networks)
+
+    def _evaluate(self):
+        evaluator = BatchEvaluator(self._matcher('10.0.0.0/8', '2001:db8::/32'), self._matcher('10.0.0.2'))
+        return evaluator.evaluate([
+            parse_address(ip) for ip in ['10.0.0.1', '10.0.0.2', '192.168.0.1', '2001:db8::1', '2001:db9::1']
+        ])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy(self):
+        self.assertEqual(self._evaluate(), [False, True, True, False, True])
+
+    @patch('ip_restriction.replay.numpy', None)
+    def test_without_numpy(self):
+        self.assertEqual(self._evaluate(), [False, True, True, False, True])
+
+
+class TestTopCounter(TestCase):
+
+    def test_bounded(self):
+        counter = TopCounter(10)
+        for _ in range(5):
+            counter.add('common')
+        for index in range(100):
+            counter.add(str(index))
+
+        self.assertLessEqual(len(counter.counts), 10)
+        self.assertEqual(counter.most_common(1), [('common', 5)])
+
+
+class TestReplayCommand(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'access.log.gz')
+        with gzip.open(self.log_path, 'wt') as log_file:
+            log_file.write('\n'.join(LOG_LINES) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _replay(self, *args):
+        out = StringIO()
+        call_command('replay_access_log', self.log_path, *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    @override_settings(ALLOWED_IP_RANGES=['10.0.0.0/8'], DENIED_IPS=['10.0.0.2'])
+    def test_replay(self):
+        self.assertEqual(self._replay(), [
+            'Allowed: 1 (20.00%)',
+            'Denied: 4 (80.00%)',
+            'Unparsed: 1',
+            'Most denied IPs:',
+            '  192.168.0.1 2',
+            '  10.0.0.2 1',
+            '  2001:db8::1 1',
+        ])
+
+    @override_settings(ALLOWED_IP_RANGES=['10.0.0.0/8'])
+    def test_proposed_allowed_ips_file(self):
+        allowed_path = os.path.join(self.tmp_dir, 'allowed.txt')
+        with open(allowed_path, 'w') as allowed_file:
+            allowed_file.write('192.168.0.0/16\n2001:db8::/32\n')
+
+        self.assertEqual(self._replay('--allowed-ips-file', allowed_path, '--top', '0'), [
+            'Allowed: 5 (100.00%)',
+            'Denied: 0 (0.00%)',
+            'Unparsed: 1',
+        ])
+
+    def _write_artifact(self):
+        artifact_path = os.path.join(self.tmp_dir, 'policy.bin')
+        write_artifact(artifact_path, {
+            'site': IntervalMatcher.from_intervals([parse_network('192.168.0.0/16')]),
+            'admin': IntervalMatcher(),
+            'deny': IntervalMatcher(),
+        })
+        return artifact_path
+
+    def test_artifact(self):
+        artifact_path = self._write_artifact()
+
+        self.assertEqual(self._replay('--artifact', artifact_path, '--top', '1'), [
+            'Allowed: 2 (40.00%)',
+            'Denied: 3 (60.00%)',
+            'Unparsed: 1',
+            'Most denied IPs:',
+            '  10.0.0.1 1',
+        ])
+
+    def test_configured_artifact(self):
+        # The artifact is what the middleware enforces, rather than the IP lists it was compiled from
+        with override_settings(ALLOWED_IP_RANGES=['10.0.0.0/8'], IP_POLICY_ARTIFACT=self._write_artifact()):
+            self.assertEqual(self._replay('--top', '0'), [
+                'Allowed: 2 (40.00%)',
+                'Denied: 3 (60.00%)',
+                'Unparsed: 1',
+            ])
+
+    @override_settings(ALLOWED_IPS=['10.0.0.2'])
+    def test_regex(self):
+        with gzip.open(self.log_path, 'wt') as log_file:
+            log_file.write('proxy=1.2.3.4 client=10.0.0.2\nproxy=1.2.3.4 client=10.0.0.3\n')
+
+        self.assertEqual(self._replay('--regex', r'client=(?P<ip>\S+)', '--top', '0'), [
+            'Allowed: 1 (50.00%)',
+            'Denied: 1 (50.00%)',
+            'Unparsed: 0',
+        ])
+
+    def test_missing_log(self):
+        with self.assertRaises(CommandError):
+            call_command('replay_access_log', os.path.join(self.tmp_dir, 'missing.log'), stdout=StringIO())
@@ -0,0 +1,113 @@
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+from ip_restriction.rules import Exemption, Restriction
+
+
+class ExplodingUser():
+    # Stands in for request.user, failing the test if the user is loaded
+    @property
+    def is_authenticated(self):
+        raise AssertionError('request.user should not have been evaluated')
+
+
+class AuthenticatedUser():
+    is_authenticated = True
+
+
+class TeapotHeaderRestriction(Restriction):
+    # Example custom rule, denying requests with an X-Teapot header
+    def check(self, context):
+        if 'HTTP_X_TEAPOT' in context.request.META:
+            return PermissionDenied()
+        return None
+
+
+class FinalTeapotHeaderRestriction(TeapotHeaderRestriction):
+    exemptible = False
+
+
+class HealthCheckExemption(Exemption):
+    # Example custom rule, exempting the health check URL from all restrictions
+    def check(self, context):
+        return context.request.path == '/healthcheck'
+
+
+class TestRulePipeline(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _request(self, ip, path='/example', user=None):
+        request = self.factory.get(path, REMOTE_ADDR=ip)
+        request.user = user or ExplodingUser()
+        return request
+
+    def test_no_rules_when_unrestricted(self):
+        self.assertFalse(IpWhitelister().pipeline)
+
+    @override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['127.0.0.1'])
+    def test_allowed_ip_does_not_load_user(self):
+        restrictor = IpWhitelister()
+        self.assertIsNone(restrictor.process_request(self._request('127.0.0.1')))
+
+    @override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['127.0.0.1'])
+    def test_blocked_ip_checks_user(self):
+        restrictor = IpWhitelister()
+        self.assertIsNone(restrictor.process_request(self._request('127.0.0.2', user=AuthenticatedUser())))
+
+        with self.assertRaises(AssertionError):
+            restrictor.process_request(self._request('127.0.0.2'))
+
+    @override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True)
+    def test_exemption_applies_to_malformed_ip(self):
+        # Authenticated users were let through before the IP was ever parsed, and still are
+        restrictor = IpWhitelister()
+        self.assertIsNone(restrictor.process_request(self._request('not-an-ip', user=AuthenticatedUser())))
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        ALLOW_AUTHENTICATED=True,
+        ALLOWED_IPS=['127.0.0.1'],
+        RESTRICT_ADMIN_BY_IPS=True)
+    def test_authenticated_exemption_covers_admin_restriction(self):
+        restrictor = IpWhitelister()
+        request = self._request('127.0.0.1', path='/admin/', user=AuthenticatedUser())
+        self.assertIsNone(restrictor.process_request(request))
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        ALLOWED_IPS=['127.0.0.1'],
+        IP_RESTRICTION_RULES=[
+            'tests.test_rules.TeapotHeaderRestriction',
+            'tests.test_rules.HealthCheckExemption',
+        ])
+    def test_custom_rules(self):
+        restrictor = IpWhitelister()
+        self.assertIsNone(restrictor.process_request(self._request('127.0.0.1')))
+
+        request = self._request('127.0.0.1')
+        request.META['HTTP_X_TEAPOT'] = '1'
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(request)
+
+        self.assertIsNone(restrictor.process_request(self._request('127.0.0.2', path='/healthcheck')))
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        ALLOWED_IPS=['127.0.0.1'],
+        IP_RESTRICTION_RULES=[
+            'tests.test_rules.FinalTeapotHeaderRestriction',
+            'tests.test_rules.HealthCheckExemption',
+        ])
+    def test_later_restriction_that_is_not_exemptible(self):
+        # Runs after the site restriction, which denies the IP, and still can't be exempted
+        restrictor = IpWhitelister()
+        self.assertIsNone(restrictor.process_request(self._request('127.0.0.2', path='/healthcheck')))
+
+        request = self._request('127.0.0.2', path='/healthcheck')
+        request.META['HTTP_X_TEAPOT'] = '1'
+        with self.assertRaises(PermissionDenied):
+            restrictor.process_request(request)
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpPolicy, IpWhitelister
+from ip_restriction.sources import FileWatcher, read_ip_file
+
+
+class TempDirMixin():
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        # Write then rename, as a deployment tool would, so the watcher sees a new inode
+        with open(path + '.tmp', 'w') as tmp_file:
+            tmp_file.write(content)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+class TestReadIpFile(TempDirMixin, TestCase):
+
+    def test_text_file(self):
+        path = self._write('allowed.txt', '# office\n192.168.0.1\n\n10.0.0.0/8  # vpn\n')
+        lists = read_ip_file(path)
+        self.assertEqual(lists['ALLOWED_IPS'], ['192.168.0.1'])
+        self.assertEqual(lists['ALLOWED_IP_RANGES'], ['10.0.0.0/8'])
+        self.assertEqual(lists['ALLOWED_ADMIN_IPS'], [])
+
+    def test_json_file(self):
+        path = self._write('allowed.json', '{"ALLOWED_IPS": ["192.168.0.1"], "ALLOWED_ADMIN_IP_RANGES": ["::1/128"]}')
+        lists = read_ip_file(path)
+        self.assertEqual(lists['ALLOWED_IPS'], ['192.168.0.1'])
+        self.assertEqual(lists['ALLOWED_IP_RANGES'], [])
+        self.assertEqual(lists['ALLOWED_ADMIN_IP_RANGES'], ['::1/128'])
+
+    def test_invalid_json_file(self):
+        path = self._write('allowed.json', '["192.168.0.1"]')
+        with self.assertRaises(ValueError):
+            read_ip_file(path)
+
+    def test_denylist_json_file_can_not_allow(self):
+        path = self._write(
+            'feed.json', '{"DENIED_IPS": ["6.6.6.6"], "ALLOWED_IPS": ["7.7.7.7"], "ALLOWED_ADMIN_IPS": ["7.7.7.7"]}'
+        )
+        policy = IpPolicy(ALLOWED_IPS=['6.6.6.6'], ALLOWED_ADMIN_IPS=[], DENIED_IPS_FILE=path)
+        self.assertFalse(policy.is_allowed('6.6.6.6'))
+        self.assertFalse(policy.is_allowed('7.7.7.7'))
+        self.assertFalse(policy.is_allowed('7.7.7.7', scope='admin'))
+
+
+class TestFileWatcher(TempDirMixin, TestCase):
+
+    def test_poll(self):
+        path = self._write('allowed.txt', '192.168.0.1\n')
+        calls = []
+        watcher = FileWatcher([path], 0, lambda: calls.append(True))
+
+        self.assertIsNone(watcher.poll())
+
+        self._write('allowed.txt', '192.168.0.2\n')
+        watcher.poll().join()
+        self.assertEqual(len(calls), 1)
+
+        self.assertIsNone(watcher.poll())
+
+    def test_poll_interval(self):
+        path = self._write('allowed.txt', '192.168.0.1\n')
+        watcher = FileWatcher([path], 3600, lambda: None)
+        self._write('allowed.txt', '192.168.0.2\n')
+        self.assertIsNone(watcher.poll())
+
+
+class TestWhitelisterIpFile(TempDirMixin, TestCase):
+
+    def _request(self, ip):
+        return RequestFactory().get('/', REMOTE_ADDR=ip)
+
+    def test_file_is_reloaded(self):
+        path = self._write('allowed.txt', '192.168.0.1\n')
+
+        with override_settings(
+                RESTRICT_IPS=True,
+                ALLOWED_IPS=['127.0.0.1'],
+                ALLOWED_IPS_FILE=path,
+                ALLOWED_IPS_FILE_POLL_INTERVAL=0):
+            restrictor = IpWhitelister()
+            self.assertIsNone(restrictor.process_request(self._request('127.0.0.1')))
+            self.assertIsNone(restrictor.process_request(self._request('192.168.0.1')))
+            with self.assertRaises(PermissionDenied):
+                restrictor.process_request(self._request('192.168.0.2'))
+
+            old_policy = restrictor.policy
+            self._write('allowed.txt', '192.168.0.2\n')
+            restrictor.process_request(self._request('127.0.0.1'))
+            restrictor.ip_policy.watcher.thread.join()
+
+            self.assertIsNot(restrictor.policy, old_policy)
+            self.assertIsNone(restrictor.process_request(self._request('192.168.0.2')))
+            with self.assertRaises(PermissionDenied):
+                restrictor.process_request(self._request('192.168.0.1'))
+
+    def test_unreadable_file_keeps_policy(self):
+        path = self._write('allowed.json', '{"ALLOWED_IPS": ["192.168.0.1"]}')
+
+        with override_settings(RESTRICT_IPS=True, ALLOWED_IPS_FILE=path):
+            restrictor = IpWhitelister()
+            old_policy = restrictor.policy
+
+            self._write('allowed.json', '{"ALLOWED_IPS": [')
+            restrictor.ip_policy.reload()
+
+            self.assertIs(restrictor.policy, old_policy)
+            self.assertIsNone(restrictor.process_request(self._request('192.168.0.1')))
@@ -0,0 +1,78 @@
+import os
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister
+
+
+VIEW_POLICIES = {
+    'api': {'ALLOWED_IP_RANGES': ['10.0.0.0/8']},
+    'api:internal': {'ALLOWED_IPS': ['10.0.0.1']},
+    'healthcheck': {'ALLOWED_IPS': ['192.168.0.1']},
+}
+
+
+@override_settings(IP_VIEW_POLICIES=VIEW_POLICIES)
+class TestViewPolicies(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _allowed(self, path, ip, restrictor=None):
+        restrictor = restrictor or IpWhitelister()
+        try:
+            restrictor.process_request(self.factory.get(path, REMOTE_ADDR=ip))
+        except PermissionDenied:
+            return False
+        return True
+
+    def test_namespace(self):
+        self.assertTrue(self._allowed('/api/status', '10.0.0.2'))
+        self.assertFalse(self._allowed('/api/status', '192.168.0.1'))
+
+    def test_view_name_overrides_namespace(self):
+        self.assertTrue(self._allowed('/api/internal', '10.0.0.1'))
+        self.assertFalse(self._allowed('/api/internal', '10.0.0.2'))
+
+    def test_url_name(self):
+        self.assertTrue(self._allowed('/healthcheck', '192.168.0.1'))
+        self.assertFalse(self._allowed('/healthcheck', '10.0.0.1'))
+
+    def test_other_views_unrestricted(self):
+        self.assertTrue(self._allowed('/example', '1.1.1.1'))
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.2', '192.168.0.1'])
+    def test_applies_on_top_of_site_restriction(self):
+        self.assertTrue(self._allowed('/api/status', '10.0.0.2'))
+        self.assertFalse(self._allowed('/api/status', '10.0.0.3'))
+        self.assertFalse(self._allowed('/api/status', '192.168.0.1'))
+
+    @override_settings(ADMIN_RESOLVE_CACHE_SIZE=10)
+    def test_resolve_cache(self):
+        restrictor = IpWhitelister()
+        self.assertFalse(self._allowed('/api/status', '192.168.0.1', restrictor))
+
+        with patch('ip_restriction.middleware.resolve') as mock_resolve:
+            self.assertFalse(self._allowed('/api/status', '192.168.0.1', restrictor))
+            self.assertTrue(self._allowed('/api/status', '10.0.0.2', restrictor))
+            self.assertFalse(mock_resolve.called)
+
+    @override_settings(IP_VIEW_POLICIES={'api': {'ALLOWED_IPS': ['10.0.0.1'], 'DENIED_IPS': ['10.0.0.2']}})
+    def test_unknown_keys(self):
+        with self.assertRaises(ImproperlyConfigured):
+            IpWhitelister()
+
+    @override_settings(IP_VIEW_POLICIES={})
+    def test_environment(self):
+        with patch.dict(os.environ, {'IP_VIEW_POLICIES': '{"api": {"ALLOWED_IPS": ["10.0.0.1"]}}'}):
+            restrictor = IpWhitelister()
+        self.assertTrue(self._allowed('/api/status', '10.0.0.1', restrictor))
+        self.assertFalse(self._allowed('/api/status', '10.0.0.2', restrictor))
+
+    def test_environment_not_json(self):
+        with patch.dict(os.environ, {'IP_VIEW_POLICIES': 'api'}):
+            with self.assertRaises(ImproperlyConfigured):
+                IpWhitelister()
@@ -0,0 +1,154 @@
+from unittest import skipUnless
+
+from django import VERSION
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+
+from ip_restriction import IpWhitelister, bans
+from ip_restriction.metrics import registry
+from ip_restriction.wrappers import IpRestrictionASGI, IpRestrictionWSGI, scope_meta
+
+
+def wsgi_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'It works!']
+
+
+async def asgi_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'It works!'})
+
+
+class TestWSGIWrapper(TestCase):
+
+    def setUp(self):
+        bans._local_stores.clear()
+
+    def _call(self, environ):
+        responses = []
+
+        def start_response(status, headers):
+            responses.append((status, dict(headers)))
+
+        body = b''.join(IpRestrictionWSGI(wsgi_app)(environ, start_response))
+        return responses[0][0], responses[0][1], body
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    def test_site_allowlist(self):
+        self.assertEqual(self._call({'REMOTE_ADDR': '10.0.0.1'})[0], '200 OK')
+
+        status, headers, body = self._call({'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(status, '403 Forbidden')
+        self.assertEqual(headers['Content-Length'], '0')
+        self.assertEqual(body, b'')
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'], TRUSTED_PROXY_COUNT=1)
+    def test_forwarded_for(self):
+        environ = {'REMOTE_ADDR': '192.168.0.1', 'HTTP_X_FORWARDED_FOR': '10.0.0.2, 10.0.0.1'}
+        self.assertEqual(self._call(environ)[0], '200 OK')
+
+    @override_settings(RESTRICT_IPS=True, ALLOW_AUTHENTICATED=True, ALLOWED_IPS=['10.0.0.1'], DENIED_IPS=['10.0.0.3'])
+    def test_exemptions_left_to_middleware(self):
+        # An authenticated user might be let through, which only the middleware can tell
+        self.assertEqual(self._call({'REMOTE_ADDR': '10.0.0.2'})[0], '200 OK')
+        # But the denied IPs are denied whatever
+        self.assertEqual(self._call({'REMOTE_ADDR': '10.0.0.3'})[0], '403 Forbidden')
+
+    @override_settings(
+        RESTRICT_IPS=True,
+        IP_DENY_RESPONSE_STATUS=429,
+        IP_DENY_RESPONSE_BODY='Go away',
+        IP_DENY_RESPONSE_HEADERS={'Retry-After': '60'},
+    )
+    def test_deny_response_settings(self):
+        status, headers, body = self._call({'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(status, '429 Too Many Requests')
+        self.assertEqual(headers['Retry-After'], '60')
+        self.assertEqual(body, b'Go away')
+
+    @override_settings(RESTRICT_IPS=True, IP_BAN_THRESHOLD=2, IP_METRICS=True)
+    def test_bans_and_metrics(self):
+        registry.reset()
+        wrapper = IpRestrictionWSGI(wsgi_app)
+        for _ in range(3):
+            wrapper({'REMOTE_ADDR': '10.0.0.2'}, lambda status, headers: None)
+
+        self.assertTrue(wrapper.gate.whitelister.bans.is_banned('10.0.0.2'))
+        counters = registry.snapshot()['counters']
+        self.assertEqual(counters[('decisions', (('outcome', 'deny'), ('rule', 'site_ip')))], 2)
+        self.assertEqual(counters[('decisions', (('outcome', 'deny'), ('rule', 'banned_ip')))], 1)
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'], RESTRICT_ADMIN_BY_IPS=True, IP_BAN_THRESHOLD=2)
+    def test_bans_shared_with_middleware(self):
+        wrapper = IpRestrictionWSGI(wsgi_app)
+        restrictor = IpWhitelister()
+
+        # Denied by the admin restriction, which only the middleware checks, and banned by the wrapper
+        for _ in range(2):
+            with self.assertRaises(Http404):
+                restrictor.process_request(RequestFactory().get('/admin/', REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(self._call({'REMOTE_ADDR': '10.0.0.1'})[0], '403 Forbidden')
+
+        # Denied by the wrapper, and banned by the middleware
+        for _ in range(2):
+            wrapper({'REMOTE_ADDR': '10.0.0.2'}, lambda status, headers: None)
+        self.assertTrue(restrictor.bans.is_banned('10.0.0.2'))
+
+    @override_settings(RESTRICT_ADMIN_BY_IPS=True, ALLOWED_ADMIN_IPS=['10.0.0.1'], IP_BAN_THRESHOLD=2)
+    def test_bans_only_on_restricted_sites(self):
+        restrictor = IpWhitelister()
+        for _ in range(2):
+            with self.assertRaises(Http404):
+                restrictor.process_request(RequestFactory().get('/admin/', REMOTE_ADDR='10.0.0.2'))
+        self.assertTrue(restrictor.bans.is_banned('10.0.0.2'))
+
+        # Banned from the admin, which is left to the middleware, but the site isn't restricted
+        self.assertEqual(self._call({'REMOTE_ADDR': '10.0.0.2'})[0], '200 OK')
+
+
+@skipUnless(VERSION >= (3, 1), 'Async needs Django 3.1+')
+class TestASGIWrapper(TestCase):
+
+    async def _call(self, scope):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            messages.append(message)
+
+        await IpRestrictionASGI(asgi_app)(scope, receive, send)
+        return messages
+
+    def test_scope_meta(self):
+        scope = {
+            'client': ('10.0.0.1', 1234),
+            'headers': [
+                (b'x-forwarded-for', b'1.1.1.1'), (b'host', b'example.com'), (b'x-forwarded-for', b'2.2.2.2'),
+            ],
+        }
+        self.assertEqual(scope_meta(scope), {
+            'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '1.1.1.1,2.2.2.2', 'HTTP_HOST': 'example.com',
+        })
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    async def test_http(self):
+        messages = await self._call({'type': 'http', 'client': ('10.0.0.1', 1234), 'headers': []})
+        self.assertEqual(messages[0]['status'], 200)
+
+        messages = await self._call({'type': 'http', 'client': ('10.0.0.2', 1234), 'headers': []})
+        self.assertEqual(messages[0]['status'], 403)
+        self.assertIn((b'content-type', b'text/plain; charset=utf-8'), messages[0]['headers'])
+        self.assertEqual(messages[1], {'type': 'http.response.body', 'body': b''})
+
+    @override_settings(RESTRICT_IPS=True, ALLOWED_IPS=['10.0.0.1'])
+    async def test_websocket(self):
+        messages = await self._call({'type': 'websocket', 'client': ('10.0.0.2', 1234), 'headers': []})
+        self.assertEqual(messages, [{'type': 'websocket.close', 'code': 1008}])
+
+    @override_settings(RESTRICT_IPS=True)
+    async def test_lifespan_passed_through(self):
+        messages = await self._call({'type': 'lifespan'})
+        self.assertEqual(messages[0]['status'], 200)
@@ -1,10 +1,17 @@
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
 from . import views
 
 
+api_patterns = [
+    url(r'^status$', views.ExampleView.as_view(), name='status'),
+    url(r'^internal$', views.ExampleView.as_view(), name='internal'),
+]
+
 urlpatterns = [
     url(r'^example$', views.ExampleView.as_view(), name='example'),
+    url(r'^healthcheck$', views.ExampleView.as_view(), name='healthcheck'),
+    url(r'^api/', include((api_patterns, 'api'), namespace='api')),
     url(r'^admin/', admin.site.urls),
 ]